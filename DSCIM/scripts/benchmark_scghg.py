@@ -0,0 +1,293 @@
+import xarray as xr
+import pandas as pd
+import numpy as np
+import yaml
+from pathlib import Path
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Benchmarks command_line_scghg.py on synthetic inputs with the dimensions of the DSCIM-EPA inputs
+# Nothing is downloaded, so this runs offline, and the scale is set by the number of runids
+#
+#   python scripts/benchmark_scghg.py --runids 1000 --pulse-years 2020 2030
+#
+# Results of a real run can be checked against the published SC-GHGs in output/global_scghgs with
+#
+#   python scripts/benchmark_scghg.py --validate path/to/output/global_scghgs
+#
+# and runs with --fused-kernel can be checked against runs without it on the synthetic inputs with
+#
+#   python scripts/benchmark_scghg.py --check-fused --runids 1000 --pulse-years 2020 2030
+
+scripts = Path(__file__).resolve().parent
+published = scripts.parent / 'output' / 'global_scghgs'
+
+parser = argparse.ArgumentParser(description = "Benchmark DSCIM-EPA SCGHG runs on synthetic inputs, or validate SCGHGs against the published ones")
+parser.add_argument("--runids", type = int, default = 1000, help = "number of runids in the synthetic inputs (10000 in the DSCIM-EPA inputs)")
+parser.add_argument("--pulse-years", nargs = "+", type = int, default = [2020], help = "pulse years to run")
+parser.add_argument("--sectors", nargs = "+", default = ['combined'], choices = ['combined', 'coastal', 'agriculture', 'mortality', 'energy', 'labor'])
+parser.add_argument("--valuations", nargs = "+", default = ['global'], choices = ['global', 'territorial_us'])
+parser.add_argument("--output-formats", nargs = "+", default = ['csv', 'parquet', 'zarr'], choices = ['csv', 'parquet', 'zarr'],
+                    help = "writers of uncollapsed scghgs to time, one run each")
+parser.add_argument("--repeat", type = int, default = 1, help = "number of times each run is repeated, the fastest is kept")
+parser.add_argument("--dir", help = "directory for the synthetic inputs and outputs (default: a temporary directory that is removed afterwards)")
+parser.add_argument("--save", help = "save the results as JSON")
+parser.add_argument("--baseline", help = "JSON results of an earlier benchmark to compare with")
+parser.add_argument("--validate", metavar = "DIR", help = "compare the SCGHGs in DIR with the published ones instead of benchmarking")
+parser.add_argument("--check-fused", action = "store_true", help = "compare runs with --fused-kernel with runs without it instead of benchmarking")
+parser.add_argument("--rtol", type = float, default = 1e-9, help = "relative tolerance of --validate and --check-fused (default: 1e-9)")
+parser.add_argument("--args", default = "", help = "extra arguments for command_line_scghg.py, e.g. \"--workers 4\"")
+
+
+# Writes synthetic inputs and a generated_conf.yml to base, laid out like the inputs from directory_setup.py
+def make_inputs(base, runids, seed = 0):
+    rng = np.random.default_rng(seed)
+    climate = base / 'input' / 'climate'
+    econ = base / 'input' / 'econ'
+    damage_functions = base / 'input' / 'damage_functions'
+    for path in [climate, econ, damage_functions]:
+        path.mkdir(parents = True, exist_ok = True)
+
+    gases = ['CO2_Fossil', 'CH4', 'N2O']
+    pulse_years = [2020, 2030, 2040, 2050, 2060, 2070, 2080]
+    years = np.arange(2000, 2301)
+    runid = np.arange(1, runids + 1)
+
+    # Warming rises to about 4C by 2300 and a pulse adds a small, gas-specific amount from the pulse year on
+    control = np.linspace(0.8, 4, len(years)) * (1 + 0.2 * rng.standard_normal((runids, 1)))
+    control = np.broadcast_to(control, (len(gases), len(pulse_years), runids, len(years)))
+    pulse = np.array([1e-4, 1e-6, 1e-5])[:, None, None, None] * (years >= np.array(pulse_years)[:, None, None])
+    xr.Dataset({'control_temperature': (('gas', 'pulse_year', 'runid', 'year'), control),
+                'pulse_temperature': (('gas', 'pulse_year', 'runid', 'year'), control + pulse)},
+               coords = {'gas': gases, 'pulse_year': pulse_years, 'runid': runid, 'year': years, 'simulation': 0}
+              ).to_netcdf(climate / 'gmst_pulse.nc')
+    xr.Dataset({'gmsl': (('runtype', 'gas', 'pulse_year', 'runid', 'year'), np.stack([0.3 * control, 0.3 * control + 2 * pulse]))},
+               coords = {'runtype': ['control', 'pulse'], 'gas': gases, 'pulse_year': pulse_years, 'runid': runid, 'year': years}
+              ).to_zarr(climate / 'gmsl_pulse.zarr', mode = 'w')
+    xr.Dataset({'conversion': ('gas', [1/1e9 * 12/44 * 1e3, 1/1e6, 1/1e6])},
+               coords = {'gas': gases}).to_netcdf(climate / 'conversion_v5.03_Feb072022.nc4')
+
+    # GDP grows at 2% and population is flat, both varying across runids
+    econ_years = np.arange(2010, 2301)
+    for name, region, scale in [('global', 'world', 1.0), ('USA', 'USA', 0.2)]:
+        gdp = 1e14 * scale * np.exp(0.02 * (econ_years - 2010)) * (1 + 0.1 * rng.random((runids, 1, 1)))
+        pop = 8e9 * scale * np.ones((runids, 1, len(econ_years))) * (1 + 0.05 * rng.random((runids, 1, 1)))
+        xr.Dataset({'gdp': (('runid', 'region', 'year'), gdp), 'pop': (('runid', 'region', 'year'), pop)},
+                   coords = {'runid': runid, 'region': [region], 'year': econ_years}
+                  ).to_netcdf(econ / f"rff_{name}_socioeconomics.nc4")
+
+    # Damage function coefficients for every sector and discount rate, named as command_line_scghg.py expects
+    sectors = ['coastal_v0.20', 'agriculture', 'mortality_v1', 'energy', 'labor', 'AMEL_m1', 'CAMEL_m1_c0.20']
+    etas_rhos = [[1.016010255, 9.149608e-05], [1.244459066, 0.00197263997], [1.421158116, 0.00461878399]]
+    terms = {'anomaly': 1e12, 'np.power(anomaly, 2)': 5e11, 'gmsl': 2e12, 'np.power(gmsl, 2)': 1e12}
+    for sector in sectors + [s + '_USA' for s in sectors]:
+        (damage_functions / sector).mkdir(exist_ok = True)
+        scale = 0.2 if sector.endswith('_USA') else 1.0
+        for eta, rho in etas_rhos:
+            xr.Dataset({k: (('runid', 'year'), scale * v * (1 + 0.1 * rng.random((runids, len(years))))) for k, v in terms.items()},
+                       coords = {'runid': runid, 'year': years}
+                      ).to_netcdf(damage_functions / sector / f"risk_aversion_euler_ramsey_eta{round(eta,3)}_rho{round(rho,3)}_dfc.nc4")
+
+    conf = {'mortality_version': 1,
+            'coastal_version': '0.20',
+            'rff_climate': {'gases': gases,
+                            'gmsl_path': '',
+                            'gmst_path': '',
+                            'gmst_fair_path': str(climate / 'gmst_pulse.nc'),
+                            'gmsl_fair_path': str(climate / 'gmsl_pulse.zarr'),
+                            'damages_pulse_conversion_path': str(climate / 'conversion_v5.03_Feb072022.nc4'),
+                            'ecs_mask_path': None,
+                            'emission_scenarios': None},
+            'paths': {'rff_damage_function_library': str(damage_functions)},
+            'rffdata': {'socioec_output': str(econ), 'pulse_years': pulse_years},
+            'sectors': {'coastal_v0.20': {'formula': 'damages ~ -1 + gmsl + np.power(gmsl, 2)'},
+                        'agriculture': {'formula': 'damages ~ -1 + anomaly + np.power(anomaly, 2)'},
+                        'mortality_v1': {'formula': 'damages ~ -1 + anomaly + np.power(anomaly, 2)'},
+                        'energy': {'formula': 'damages ~ -1 + anomaly + np.power(anomaly, 2)'},
+                        'labor': {'formula': 'damages ~ -1 + anomaly + np.power(anomaly, 2)'},
+                        'AMEL_m1': {'formula': 'damages ~ -1 + anomaly + np.power(anomaly, 2)'},
+                        'CAMEL_m1_c0.20': {'formula': 'damages ~ -1 + anomaly + np.power(anomaly, 2) + gmsl + np.power(gmsl, 2)'}},
+            'save_path': str(base / 'output')}
+    with open(base / 'generated_conf.yml', 'w') as outfile:
+        yaml.dump(conf, outfile, default_flow_style = False)
+
+
+# Runs command_line_scghg.py in base with a run report and returns the total time, the stage times and the peak memory
+# The run is waited for with os.wait4, whose peak resident set size is that of this run and its worker processes alone
+def run_scghgs(base, options):
+    shutil.rmtree(base / 'output', ignore_errors = True)
+    # The run metadata records the commit of this repository, wherever the run happens
+    git_dir = subprocess.run(['git', 'rev-parse', '--absolute-git-dir'], cwd = scripts, capture_output = True, text = True).stdout.strip()
+    env = dict(os.environ, GIT_DIR = git_dir) if git_dir else None
+    start = time.perf_counter()
+    # Output goes to a file rather than a pipe, which could fill up while the run is waited for
+    with tempfile.TemporaryFile('w+') as stderr:
+        run = subprocess.Popen([sys.executable, str(scripts / 'command_line_scghg.py'), '--report', '--no-result-cache'] + options,
+                               cwd = base, env = env, stdout = subprocess.DEVNULL, stderr = stderr, text = True)
+        _, status, usage = os.wait4(run.pid, 0)
+        run.returncode = os.waitstatus_to_exitcode(status)
+        total = time.perf_counter() - start
+        if run.returncode != 0:
+            stderr.seek(0)
+            print(stderr.read())
+            raise subprocess.CalledProcessError(run.returncode, run.args)
+    report = pd.concat([pd.read_csv(f) for f in (base / 'output').glob('*_scghgs/run-report-*.csv')])
+    stages = report.groupby('stage').agg(wall_s = ('wall_s', 'sum'), cpu_s = ('cpu_s', 'sum'), max_rss_mb = ('max_rss_mb', 'max'))
+    # ru_maxrss is in kilobytes on Linux
+    return total, stages, usage.ru_maxrss / 1024
+
+
+# Times command_line_scghg.py with --help and with --dry-run, which parse the options and config without computing anything
+# Startup is short, so the fastest of at least three runs is kept
+def startup_times(base, options, repeat):
+    times = {}
+    for name, extra in [('help', ['--help']), ('dry_run', options + ['--dry-run'])]:
+        runs = []
+        for i in range(max(repeat, 3)):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, str(scripts / 'command_line_scghg.py')] + extra, cwd = base, capture_output = True, check = True)
+            runs.append(time.perf_counter() - start)
+        times[f"{name}_s"] = min(runs)
+    return times
+
+
+# Compares the collapsed and, where present, uncollapsed SCGHGs in path with the published ones
+def validate(path, rtol):
+    path = Path(path)
+    failed = 0
+    checked = 0
+    for published_file in sorted(published.rglob('*.csv')):
+        file = path / published_file.relative_to(published)
+        if not file.exists():
+            continue
+        expected = pd.read_csv(published_file, float_precision = 'round_trip')
+        result = pd.read_csv(file, float_precision = 'round_trip')
+        keys = [c for c in expected.columns if c not in ['scghg', 'adjustment_factor']]
+        merged = expected.merge(result, on = keys, how = 'outer', suffixes = ('_published', ''), indicator = True)
+        values = [c for c in ['scghg', 'adjustment_factor'] if c in expected.columns]
+        diff = max(np.nanmax(np.abs(merged[c] / merged[c + '_published'] - 1)) for c in values)
+        ok = (merged._merge == 'both').all() and diff <= rtol
+        print(f"{'ok  ' if ok else 'FAIL'} {published_file.relative_to(published)}: max relative difference {diff:.3g}")
+        failed += not ok
+        checked += 1
+    if checked == 0:
+        raise FileNotFoundError(f"No SCGHG files in {path} match the published files in {published}")
+    print(f"{checked - failed} of {checked} files match the published SCGHGs within {rtol:g}")
+    return failed == 0
+
+
+# Checks the kernels of --fused-kernel, compiled with numba and as NumPy, against the expressions they replace, then runs
+# the SCGHGs on the synthetic inputs with and without --fused-kernel and compares the collapsed and uncollapsed SCGHGs
+def check_fused(args, base, seed = 0):
+    sys.path.insert(0, str(scripts))
+    import dscim_epa
+
+    rng = np.random.default_rng(seed)
+    ypc = rng.uniform(1e4, 1e5, (3, args.runids))
+    etas = np.array([1.016010255, 1.244459066, 1.421158116])
+    scghg = rng.normal(200, 50, (3, args.runids))
+    expected = np.power(ypc, -etas[:, None])
+    expected = expected / expected.mean(axis = 1, keepdims = True)
+    ok = True
+    for use_numba in [True, False]:
+        kernels = dscim_epa.fused_kernels(use_numba)
+        adjustment_factor = ypc.copy()
+        kernels['adjustment_factor'](adjustment_factor, etas, True, True)
+        collapsed = kernels['weighted_mean'](expected, scghg)
+        diff = max(np.max(np.abs(adjustment_factor / expected - 1)), np.max(np.abs(collapsed / (expected * scghg).mean(axis = 1) - 1)))
+        print(f"{'ok  ' if diff <= args.rtol else 'FAIL'} {'numba' if kernels['numba'] else 'NumPy'} kernels: max relative difference {diff:.3g}")
+        ok &= diff <= args.rtol
+
+    print(f"Generating synthetic inputs with {args.runids} runids in {base}")
+    make_inputs(base, args.runids)
+    options = (['--sectors'] + args.sectors + ['--valuations'] + args.valuations
+               + ['--pulse-years'] + [str(i) for i in args.pulse_years] + ['--uncollapsed'] + args.args.split())
+    outputs = {}
+    for name, extra in [('reference', []), ('fused', ['--fused-kernel'])]:
+        total, stages, max_rss_mb = run_scghgs(base, options + extra)
+        print(f"{name}: {total:.2f}s in total, {stages.wall_s.get('collapse', 0):.3f}s collapsing")
+        outputs[name] = base / f"output-{name}"
+        shutil.rmtree(outputs[name], ignore_errors = True)
+        (base / 'output').rename(outputs[name])
+    for file in sorted(outputs['reference'].rglob('sc-*.csv')):
+        expected = pd.read_csv(file, float_precision = 'round_trip')
+        result = pd.read_csv(outputs['fused'] / file.relative_to(outputs['reference']), float_precision = 'round_trip')
+        values = [c for c in ['scghg', 'adjustment_factor'] if c in expected.columns]
+        same = (expected.drop(columns = values) == result.drop(columns = values)).all().all()
+        diff = max(np.max(np.abs(result[c] / expected[c] - 1)) for c in values)
+        print(f"{'ok  ' if same and diff <= args.rtol else 'FAIL'} {file.relative_to(outputs['reference'])}: max relative difference {diff:.3g}")
+        ok &= same and diff <= args.rtol
+    return ok
+
+
+def benchmark(args, base):
+    print(f"Generating synthetic inputs with {args.runids} runids in {base}")
+    start = time.perf_counter()
+    make_inputs(base, args.runids)
+    print(f"Generated inputs in {time.perf_counter() - start:.1f}s")
+
+    results = {'runids': args.runids, 'pulse_years': args.pulse_years, 'sectors': args.sectors, 'valuations': args.valuations, 'runs': {}}
+    options = (['--sectors'] + args.sectors + ['--valuations'] + args.valuations
+               + ['--pulse-years'] + [str(i) for i in args.pulse_years] + args.args.split())
+    results['startup'] = startup_times(base, options, args.repeat)
+    print(f"Startup: --help {results['startup']['help_s']:.2f}s, --dry-run {results['startup']['dry_run_s']:.2f}s")
+    for output_format in args.output_formats:
+        runs = [run_scghgs(base, options + ['--uncollapsed', '--gcnp', '--output-format', output_format]) for i in range(args.repeat)]
+        total, stages, max_rss_mb = min(runs, key = lambda run: run[0])
+        results['runs'][output_format] = {'total_s': total,
+                                          'max_rss_mb': max_rss_mb,
+                                          'stages': stages.to_dict(orient = 'index')}
+        print(f"\n{output_format}: {total:.2f}s in total")
+        print(stages.round(3).to_string())
+    return results
+
+
+# Prints the change in total and stage times from an earlier benchmark
+def compare(results, baseline, name):
+    print(f"\nCompared with {name} ({baseline['runids']} runids):")
+    # Benchmarks saved before startup was timed have no startup times
+    for key, startup in results['startup'].items():
+        if key in baseline.get('startup', {}):
+            print(f"startup {key[:-2].replace('_', '-')}: {baseline['startup'][key]:.2f}s -> {startup:.2f}s ({startup / baseline['startup'][key]:.2f}x)")
+    for output_format, run in results['runs'].items():
+        if output_format not in baseline['runs']:
+            continue
+        before = baseline['runs'][output_format]
+        print(f"{output_format}: total {before['total_s']:.2f}s -> {run['total_s']:.2f}s ({run['total_s'] / before['total_s']:.2f}x)")
+        for name, stage in run['stages'].items():
+            if name in before['stages'] and before['stages'][name]['wall_s'] > 0:
+                print(f"  {name}: {before['stages'][name]['wall_s']:.3f}s -> {stage['wall_s']:.3f}s ({stage['wall_s'] / before['stages'][name]['wall_s']:.2f}x)")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.validate is not None:
+        sys.exit(0 if validate(args.validate, args.rtol) else 1)
+    if args.check_fused:
+        if args.dir is not None:
+            base = Path(args.dir).resolve()
+            base.mkdir(parents = True, exist_ok = True)
+            sys.exit(0 if check_fused(args, base) else 1)
+        with tempfile.TemporaryDirectory() as tmp:
+            sys.exit(0 if check_fused(args, Path(tmp)) else 1)
+
+    if args.dir is not None:
+        base = Path(args.dir).resolve()
+        base.mkdir(parents = True, exist_ok = True)
+        results = benchmark(args, base)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = benchmark(args, Path(tmp))
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            compare(results, json.load(f), args.baseline)
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent = 1)
@@ -1,536 +1,319 @@
-import xarray as xr
-import dscim
+# Command line interface to the SCGHG calculations in dscim_epa.py
+# Only light modules are imported before the arguments are parsed, so --help and --dry-run return quickly
 import yaml
-from dscim.menu.simple_storage import Climate, EconVars
-import pandas as pd
-import numpy as np
-from itertools import product
-from pathlib import Path
-import inquirer
-from pyfiglet import Figlet
 from pathlib import Path
+import argparse
 import os
 import re
-import subprocess
-from datetime import date
 import sys
+from itertools import product
 
-args = sys.argv
-if len(args) == 1:
-    conf_name = "generated_conf.yml"
+# Command line arguments
+# Passing any run option (or a run spec) skips the interactive questionnaire
+parser = argparse.ArgumentParser(description = "Calculate DSCIM-EPA SCGHGs. Without run options, an interactive questionnaire is shown.")
+parser.add_argument("conf_name", nargs = "?", default = "generated_conf.yml",
+                    help = "config file in the current working directory (default: generated_conf.yml)")
+parser.add_argument("--spec", help = "YAML run spec with any of the keys sectors, discount_rates, pulse_years, valuations and files")
+parser.add_argument("--sectors", nargs = "+", choices = ['combined', 'coastal', 'agriculture', 'mortality', 'energy', 'labor'])
+parser.add_argument("--discount-rates", nargs = "+", help = "near-term Ramsey discount rates, e.g. 1.5 2.0 2.5, or other eta, rho pairs as eta<eta>_rho<rho> (default: all)")
+parser.add_argument("--pulse-years", nargs = "+", type = int, help = "pulse years (default: all pulse years in the config)")
+parser.add_argument("--valuations", nargs = "+", choices = ['global', 'territorial_us'])
+parser.add_argument("--gcnp", action = "store_true", help = "save global consumption no pulse")
+parser.add_argument("--uncollapsed", action = "store_true", help = "save uncollapsed scghgs")
+parser.add_argument("--summary", action = "store_true",
+                    help = "save quantiles, mean, variance and certainty equivalent of the full distributions without saving them")
+parser.add_argument("--quantiles", nargs = "+", type = float, default = [0.05, 0.25, 0.5, 0.75, 0.95],
+                    help = "quantiles of the full distributions saved with --summary (default: 0.05 0.25 0.5 0.75 0.95)")
+parser.add_argument("--quantile-error", type = float, default = 0.001,
+                    help = "relative error bound of the quantiles saved with --summary (default: 0.001)")
+parser.add_argument("--annual", action = "store_true",
+                    help = "also save scghgs interpolated to every year between the first and last pulse year, uncollapsed too with --uncollapsed")
+parser.add_argument("--preview", type = int, metavar = "N",
+                    help = "compute a stratified sample of N runids and save certainty equivalent scghgs with standard errors in a preview directory")
+parser.add_argument("--preview-seed", type = int, default = 0, help = "random seed of the --preview sample (default: 0)")
+parser.add_argument("--shard", metavar = "SPEC",
+                    help = "compute one shard of the ensemble, a range of runids such as 1-2500 or k/n for the runids equal to k modulo n, to be merged with merge_shards.py")
+parser.add_argument("--workers", type = int, default = 1, help = "number of worker processes computing SCGHG runs in parallel (default: 1)")
+parser.add_argument("--write-queue", type = int, default = 1,
+                    help = "number of pulse years whose csv, parquet and zarr files may be left to write in the background while the next pulse year is computed, 0 to write them before moving on (default: 1)")
+parser.add_argument("--output-format", choices = ['csv', 'parquet', 'zarr'], default = 'csv',
+                    help = "format of uncollapsed scghgs: per-gas csv or parquet files, or one zarr store (default: csv)")
+parser.add_argument("--force", action = "store_true", help = "recompute every run instead of loading unchanged runs from the result cache")
+parser.add_argument("--no-result-cache", action = "store_true", help = "neither read nor write the result cache")
+parser.add_argument("--runid-chunks", type = int, help = "compute out of core with inputs chunked to this many runids (default: in memory)")
+parser.add_argument("--vectorize-rates", action = "store_true",
+                    help = "compute all discount rates of a sector and pulse year in one pass over the inputs")
+parser.add_argument("--fused-kernel", action = "store_true",
+                    help = "compute adjustment factors and certainty equivalent scghgs with fused kernels, compiled with numba where it is installed")
+parser.add_argument("--float32", action = "store_true",
+                    help = "hold and save scghgs, adjustment factors and gcnp in float32, summing over years and runids in float64")
+parser.add_argument("--float32-check", type = int, metavar = "N", default = 200,
+                    help = "number of runids on which --float32 runs are checked against float64 before they start, 0 to skip the check (default: 200)")
+parser.add_argument("--float32-rtol", type = float, default = 1e-5,
+                    help = "largest relative difference from float64 allowed by the --float32 check (default: 1e-05)")
+parser.add_argument("--report", action = "store_true",
+                    help = "save the wall time, CPU time and peak memory of each stage as run-report-<sector>.json/.csv next to the attributes files")
+parser.add_argument("--profile", choices = ['cprofile', 'tracemalloc'],
+                    help = "also profile the run: cprofile saves run-profile.prof for the main process, tracemalloc adds the traced peak memory of each stage to the run report")
+parser.add_argument("--dry-run", action = "store_true", help = "list the runs that would be computed and exit")
+args = parser.parse_args()
+
+conf_name = args.conf_name
+
+# The calculations import xarray here, and dscim once the first run starts
+import dscim_epa
+from dscim_epa import discount_conversion_dict, sector_names
+
+if args.report or args.profile is not None:
+    dscim_epa.run_report = dscim_epa.RunReport(trace_memory = args.profile == 'tracemalloc')
+if args.profile == 'tracemalloc':
+    import tracemalloc
+    tracemalloc.start()
+
+conf = dscim_epa.read_conf(Path(os.getcwd()) / conf_name)
+if conf_name != "generated_conf.yml":
+    conf_savename = re.split('\\.', conf_name)[0] + "-"
 else:
-    conf_name = args[1]
-
-
-
-master = Path(os.getcwd()) / conf_name
-try:
-    with open(master, "r") as stream:
-        conf = yaml.safe_load(stream)
-except FileNotFoundError:
-    raise FileNotFoundError("Please run directory_setup.py or place the config in your current working directory")
-
-coastal_v = str(conf["coastal_version"])
-mortality_v = str(conf["mortality_version"])
-CAMEL_v = f"CAMEL_m{mortality_v}_c{coastal_v}"
-
-discount_conversion_dict = {'1.016010255_9.149608e-05': '1.5% Ramsey',
-                            '1.244459066_0.00197263997': '2.0% Ramsey',
-                            '1.421158116_0.00461878399': '2.5% Ramsey'}   
-gas_conversion_dict = {'CO2_Fossil':'CO2',
-                       'N2O':'N2O',
-                       'CH4':'CH4'} 
-    
-def makedir(path):
-    if not os.path.exists(path):
-        os.makedirs(path)
-        
-        
-def generate_meta(menu_item):
-    # find machine name
-    machine_name = os.getenv("HOSTNAME")
-    if machine_name is None:
+    conf_savename = ""
+
+
+# Reads the run matrix from a YAML run spec and command line options, with options taking precedence
+def read_run_spec(args, conf):
+    sector_dict = sector_names(conf)
+    spec = {}
+    if args.spec is not None:
+        with open(args.spec, "r") as stream:
+            spec = yaml.safe_load(stream) or {}
+    for key in ['sectors', 'discount_rates', 'pulse_years', 'valuations']:
+        if getattr(args, key) is not None:
+            spec[key] = getattr(args, key)
+    files = set(spec.get('files', []))
+    files.update(f for f in ['gcnp', 'uncollapsed', 'summary', 'annual'] if getattr(args, f))
+
+    sectors = spec.get('sectors', ['combined'])
+    unknown = [i for i in sectors if i not in sector_dict]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown sectors {unknown}. Choose from {list(sector_dict)}")
+
+    # Discount rates may be given as '2.0% Ramsey' or 2.0, or as any other eta, rho pair, either 'eta1.3_rho0.003' or [1.3, 0.003]
+    rate_dict = {v: [float(x) for x in k.split('_')] for k, v in discount_conversion_dict.items()}
+    etas_rhos = []
+    unknown = []
+    for i in spec.get('discount_rates', rate_dict):
+        pair = re.fullmatch(r"eta([^_]+)_rho([^_]+)", str(i))
         try:
-            machine_name = os.uname()[1]
-        except AttributeError:
-            machine_name = "unknown"
-    
-    # find git commit hash
-    try:
-        label = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).decode('ascii').strip()
-    except subprocess.CalledProcessError:
-        label = "unknown"
-    
-    meta = {"Author": "Climate Impact Lab",
-            "Date Created": date.today().strftime("%d/%m/%Y"),
-            "Units": "2020 PPP-adjusted USD"}
-    
-    for attr_dict in [
-        vars(menu_item),
-        vars(vars(menu_item)["climate"]),
-        vars(vars(menu_item)["econ_vars"]),
-    ]:
-        meta.update(
-            {
-                k: v
-                for k, v in attr_dict.items()
-                if (type(v) not in [xr.DataArray, xr.Dataset, pd.DataFrame])
-                and k not in ["damage_function", "logger"]
-            }
-        )
-
-    # update with git hash and machine name
-    meta.update(dict(machine=machine_name, commit=label,url="https://github.com/ClimateImpactLab/dscim-epa/commit/"+subprocess.check_output(['git','rev-parse','HEAD']).decode('ascii').strip()))
-
-    # convert to strs
-    meta = {k: v if type(v) in [int, float] else str(v) for k, v in meta.items()}
-    
-    
-    # exclude irrelevant attrs
-    irrelevant_keys = ['econ_vars',
-                       'climate',
-                       'subset_dict',
-                       'filename_suffix',
-                       'ext_subset_start_year',
-                       'ext_subset_end_year',
-                       'ext_end_year',
-                       'ext_method',
-                       'clip_gmsl',
-                       'scenario_dimensions',
-                       'scc_quantiles',
-                       'quantreg_quantiles',
-                       'quantreg_weights',
-                       'full_uncertainty_quantiles',
-                       'extrap_formula',
-                       'fair_dims',
-                       'sector_path',
-                       'save_files',
-                       'save_path',
-                       'delta',
-                       'histclim',
-                       'ce_path',
-                       'gmst_path',
-                       'gmsl_path']
-    for k in irrelevant_keys:
-        if k in meta.keys():
-            del meta[k]
-    
-    # adjust attrs
-    meta['emission_scenarios'] = 'RFF-SPv2'
-    meta['damagefunc_base_period'] = meta.pop('base_period')
-    meta['socioeconomics_path'] = meta.pop('path')    
-    meta['gases'] = meta['gases'].split("'")
-    meta['gases'] = [e for e in meta['gases'] if e not in (', ','[',']')]
-    meta['gases'] = [gas_conversion_dict[gas] for gas in meta['gases']]
-    
-    if meta['sector']=='CAMEL_m1_c0.20':
-        meta['sector'] = 'combined'
-    else:
-        meta['sector'] = re.split("_",meta['sector'])[0] 
-        
-    if terr_us:
-        meta.update(discounting_socioeconomics_path = f"{conf['rffdata']['socioec_output']}/rff_global_socioeconomics.nc4")
-      
-    return meta
-
-
-# Merge attrs
-def merge_meta(attrs,meta):
-    if len(attrs)==0:
-        attrs.update(meta)
-    else:
-        for meta_keys in attrs.keys():
-            if str(meta[meta_keys]) not in str(attrs[meta_keys]):
-                if type(attrs[meta_keys])!=list:
-                    update = [attrs[meta_keys]]
-                    update.append(meta[meta_keys])
-                    attrs[meta_keys] = update
-                else:
-                    attrs[meta_keys].append(meta[meta_keys])
-    return attrs
-################################################################################
-
-# Function for one run of SCGHGs
-def epa_scghg(sector = "CAMEL_m1_c0.20",
-            terr_us = False,
-            eta = 2.0,
-            rho = 0.0,
-            pulse_year = 2020,
-            discount_type = "euler_ramsey",
-            menu_option = "risk_aversion"):
-
-    if menu_option != "risk_aversion":
-        raise Exception("DSCIM-EPA provides only 'risk_aversion' SCGHGs")
-    
-    # Read generated config
-    master = Path(os.getcwd()) / conf_name
-    with open(master, "r") as stream:
-        conf = yaml.safe_load(stream)
-    
-    # Manually add other config parameters that are not meant to change run to run
-    conf["global_parameters"] = {'fair_aggregation': ["uncollapsed"],
-     'subset_dict': {'ssp': []},
-     'weitzman_parameter': [0.5],
-     'save_files': []}
-
-
-    # Read in U.S. and global socioeconomic files
-    if terr_us:
-        econ_terr_us = EconVars(
-            path_econ=f"{conf['rffdata']['socioec_output']}/rff_USA_socioeconomics.nc4"
-        )
-        # List of kwargs to add to kwargs read in from the config file for direct territorial U.S. damages
-        add_kwargs = {
-            "econ_vars": econ_terr_us,
-            "climate_vars": Climate(**conf["rff_climate"], pulse_year=pulse_year),
-            "formula": conf["sectors"][sector if not terr_us else sector[:-4]]["formula"],
-            "discounting_type": discount_type,
-            "sector": sector,
-            "ce_path": None,
-            "save_path": None,
-            "eta": eta,
-            "rho": rho,
-            "damage_function_path": Path(conf['paths']['rff_damage_function_library'])  / sector,
-            "ecs_mask_path": None,
-            "ecs_mask_name": None,
-            "fair_dims":[],
-        }
-
-        # An extra set of kwargs is needed when running U.S. SCGHGs
-        # Combine config kwargs with the add_kwargs for direct territorial U.S. damages
-        kwargs_terr_us = conf["global_parameters"].copy()
-        for k, v in add_kwargs.items():
-            assert (
-                k not in kwargs_terr_us.keys()
-            ), f"{k} already set in config. Please check `global_parameters`."
-            kwargs_terr_us.update({k: v})
-
-
-    econ_glob = EconVars(
-        path_econ=f"{conf['rffdata']['socioec_output']}/rff_global_socioeconomics.nc4"
-    )
-
-    # This class allows for a shorter naming convention for the damage function files (rounding etas and rhos in the filename)
-    class RiskAversionRecipe(dscim.menu.risk_aversion.RiskAversionRecipe):
-        @property
-        def damage_function_coefficients(self) -> xr.Dataset:
-            """
-            Load damage function coefficients if the coefficients are provided by the user.
-            Otherwise, compute them.
-            """
-            if self.damage_function_path is not None:
-                return xr.open_dataset(
-                    f"{self.damage_function_path}/{self.NAME}_{self.discounting_type}_eta{round(self.eta,3)}_rho{round(self.rho,3)}_dfc.nc4"
-                )
+            if isinstance(i, (list, tuple)) and len(i) == 2:
+                etas_rhos.append([float(x) for x in i])
+            elif pair is not None:
+                etas_rhos.append([float(pair[1]), float(pair[2])])
             else:
-                return self.damage_function["params"]
-
-    # List of kwargs to add to kwargs read in from the config file for global discounting and damages
-    add_kwargs = {
-        "econ_vars": econ_glob,
-        "climate_vars": Climate(**conf["rff_climate"], pulse_year=pulse_year),
-        "formula": conf["sectors"][sector if not terr_us else sector[:-4]]["formula"],
-        "discounting_type": discount_type,
-        "sector": sector,
-        "ce_path": None,
-        "save_path": None,
-        "eta": eta,
-        "rho": rho,
-        "damage_function_path": Path(conf['paths']['rff_damage_function_library']) / [sector if not terr_us else sector[:-4]][0], 
-        "ecs_mask_path": None,
-        "ecs_mask_name": None,
-        "fair_dims":[],
-    }
-
-    # Combine config kwargs with the add_kwargs for global discounting and damages
-    kwargs_global = conf["global_parameters"].copy()
-    for k, v in add_kwargs.items():
-        assert (
-            k not in kwargs_global.keys()
-        ), f"{k} already set in config. Please check `global_parameters`."
-        kwargs_global.update({k: v})
-
-    # For both territorial U.S. and global SCGHGs, endogenous Ramsey discounting based on global socioeconomics is used
-    menu_item_global = RiskAversionRecipe(**kwargs_global)
-    df = menu_item_global.uncollapsed_discount_factors
-
-    # Compute damages for global or U.S. runs
-    if terr_us:
-        menu_item_terr_us = RiskAversionRecipe(**kwargs_terr_us)
-        md = menu_item_terr_us.uncollapsed_marginal_damages
-    else:
-        md = menu_item_global.uncollapsed_marginal_damages
-
-    # The 113.648/112.29 deflates the SCGHGs from 2019 dollars to 2020 dollars
-    conv_2019to2020 = 113.648/112.29
-    
-    # Compute SCGHGs
-    # Multiplying marginal damages by discount factors and summing across years creates the SCGHGs
-    scghgs = (
-        (md.rename(marginal_damages = 'scghg') * df.rename(discount_factor = 'scghg'))
-        .sum("year")* conv_2019to2020
-    )     
-        
-    # Code to calculate epa-spec adjustment factors
-    gcnp = menu_item_global.global_consumption_no_pulse.rename('gcnp')
-
-    # Isolate population from socioeconomics
-    pop = xr.open_dataset(f"{conf['rffdata']['socioec_output']}/rff_global_socioeconomics.nc4").sel(region = 'world', drop = True).pop
-    
-    # Calculate global consumption no pulse per population
-    a = xr.merge([pop, gcnp])  
-    ypv = a.gcnp/a.pop
-
-    # Create adjustment factor using adjustment.factor = (ypc^-eta)/mean(ypc^-eta)
-    c = np.power(ypv, -eta).sel(year = pulse_year, drop = True)
-    adj = (c/c.mean()).rename('adjustment_factor')
-
-    # Merge adjustments with uncollapsed scghgs
-    adjustments = xr.merge([scghgs,adj.to_dataset()])          
-    
-    # generate attrs           
-    if terr_us:
-        meta = generate_meta(menu_item_terr_us)
-    else:
-        meta = generate_meta(menu_item_global)
-
-    return([adjustments, gcnp* conv_2019to2020, meta])
-
-# Function to perform multiple runs of SCGHGs and combine into one file to save out
-def epa_scghgs(sectors,
-             terr_us,
-             etas_rhos,
-             risk_combos = (('risk_aversion', 'euler_ramsey')),
-             pulse_years = (2020,2030,2040,2050,2060,2070,2080),
-             gcnp = False,
-             uncollapsed = False):
-
-    # Read generated config    
-    master = Path(os.getcwd()) / conf_name
-    with open(master, "r") as stream:
-        conf = yaml.safe_load(stream)
-        
-    attrs={}
-
-    # Nested for loops to run each combination of SCGHGs requested
-    # Each run of the outer loop saves one set of SCGHGs
-    # The inner loop combines all SCGHG runs for that file
-    for j, pulse_year in product(risk_combos, pulse_years):
-        # These arrays will be populated with data arrays to be combined
-        all_arrays_uscghg = []
-        all_arrays_gcnp = []
-
-        discount_type= j[1]
-        menu_option = j[0]
-        for i, sector in product(etas_rhos, sectors):
-            
-            if re.split("_",sector)[0]=="CAMEL":
-                sector_short = "combined"
-            else:
-                sector_short = re.split("_",sector)[0]
-                
-            eta = i[0]
-            rho = i[1]
-
-            print(f"Calculating {'territorial U.S.' if terr_us else 'global'} {sector_short} scghgs {'and gcnp' if gcnp else ''} \n discount rate: {discount_conversion_dict[str(eta) + '_' + str(rho)]} \n pulse year: {pulse_year}")
-            df_single_scghg, df_single_gcnp, meta = epa_scghg(sector = sector,
-                                                          terr_us = terr_us,
-                                                          discount_type = discount_type,
-                                                          menu_option = menu_option,
-                                                          eta = eta,
-                                                          rho = rho,
-                                                          pulse_year = pulse_year)
-            
-            # Creates new coordinates to differentiate between runs
-            # For SCGHGs
-            df_scghg = df_single_scghg.assign_coords(discount_rate =  discount_conversion_dict[str(eta) + "_" + str(rho)], menu_option = menu_option, sector = sector_short)
-            df_scghg_expanded = df_scghg.expand_dims(['discount_rate','menu_option', 'sector'])
-            if 'simulation' in df_scghg_expanded.dims:
-                df_scghg_expanded = df_scghg_expanded.drop_vars('simulation')
-            all_arrays_uscghg = all_arrays_uscghg + [df_scghg_expanded]
-
-            # For global consumption no pulse
-            df_gcnp = df_single_gcnp.assign_coords(discount_rate =  discount_conversion_dict[str(eta) + "_" + str(rho)], menu_option = menu_option, sector = sector_short)
-            df_gcnp_expanded = df_gcnp.expand_dims(['discount_rate','menu_option', 'sector'])
-            if 'simulation' in df_gcnp_expanded.dims:
-                df_gcnp_expanded = df_gcnp_expanded.drop_vars('simulation')
-            all_arrays_gcnp = all_arrays_gcnp + [df_gcnp_expanded]    
-        
-            attrs = merge_meta(attrs,meta)
-        
-        print("Processing...")
-        df_full_scghg = xr.combine_by_coords(all_arrays_uscghg)
-        df_full_gcnp = xr.combine_by_coords(all_arrays_gcnp)
-        
-        # Changes coordinate names of gases
-        df_full_scghg = df_full_scghg.assign_coords(gas=[gas_conversion_dict[gas] for gas in df_full_scghg.gas.values])
-        df_full_gcnp = df_full_gcnp.assign_coords(gas=[gas_conversion_dict[gas] for gas in df_full_gcnp.gas.values])
-        
-        # Splits SCGHGs by gas and saves them out separately
-        # For uncollapsed SCGHGs
-        if conf_name != "generated_conf.yml":
-            conf_savename = re.split('\.', conf_name)[0] + "-"
-        else:
-            conf_savename = ""
-        gases = ['CO2','CH4', 'N2O']
-        if uncollapsed:    
-            for gas in gases:
-                out_dir = Path(conf['save_path']) / f"{'territorial_us' if terr_us else 'global'}_scghgs" / 'full_distributions' / gas 
-                makedir(out_dir)
-                uncollapsed_gas_scghgs = df_full_scghg.sel(gas = gas, drop = True).to_dataframe().reindex()
-                print(f"Saving {'territorial U.S.' if terr_us else 'global'} uncollapsed {sector_short} sc-{gas} \n pulse year: {pulse_year}")
-                uncollapsed_gas_scghgs.to_csv(out_dir / f"{conf_savename}sc-{gas}-dscim-{sector_short}-{pulse_year}-n10000.csv")
-                attrs_save = attrs.copy()
-                attrs_save['gases'] = gas
-                with open(out_dir / f"{conf_savename}attributes-{gas}-{sector_short}.txt", 'w') as f: 
-                    for key, value in attrs_save.items(): 
-                        f.write('%s:%s\n' % (key, value))
-
-        # Applies the adjustment factor to convert to certainty equivalent SCGHGs
-        df_full_scghg = (df_full_scghg.adjustment_factor * df_full_scghg.scghg).mean(dim = 'runid')
-
-        # Splits and saves collapsed SCGHGs
-        for gas in gases:
-            out_dir = Path(conf['save_path']) / f"{'territorial_us' if terr_us else 'global'}_scghgs"   
-            makedir(out_dir)
-            collapsed_gas_scghg = df_full_scghg.sel(gas = gas, drop = True).rename('scghg').to_dataframe().reindex() 
-            print(f"Saving {'territorial U.S.' if terr_us else 'global'} collapsed {sector_short} sc-{gas} \n pulse year: {pulse_year}")
-            collapsed_gas_scghg.to_csv(out_dir / f"{conf_savename}sc-{gas}-dscim-{sector_short}-{pulse_year}.csv") 
-
-        # Creates attribute files 
-        with open(out_dir / f"attributes-{sector_short}.txt", 'w') as f: 
-            for key, value in attrs.items(): 
-                f.write('%s:%s\n' % (key, value))
-    
-    # Saves global consumption no pulse
-    # Fewer GCNPs are saved because they vary across fewer dimensions than SCGHGs
-    if gcnp:
-        out_dir = Path(conf['save_path']) / 'gcnp' 
-        makedir(out_dir)
-        df_full_gcnp.attrs=attrs
-        print(f"Saving {sector_short} global consumption no pulse (gcnp)")
-        df_full_gcnp.to_netcdf(out_dir / f"{conf_savename}gcnp-dscim-{sector_short}.nc4")  
-        print(f"gcnp is available in {str(out_dir)}")
-
-    print(f"{'territorial_us' if terr_us else 'global'}_scghgs are available in {str(Path(conf['save_path']))}/{'territorial_us' if terr_us else 'global'}_scghgs")
-   
-
-# Command line interface for DSCIM-epa runs        
-f = Figlet(font='slant')
-print(f.renderText('DSCIM-EPA'))
+                etas_rhos.append(rate_dict[str(i) if str(i).endswith('Ramsey') else f"{float(i):.1f}% Ramsey"])
+        except (KeyError, ValueError):
+            unknown.append(i)
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown discount rates {unknown}. Choose from {list(rate_dict)}, or give eta, rho pairs as eta<eta>_rho<rho>")
+    if len(etas_rhos) == 0:
+        raise ValueError('You must select at least one eta, rho combination')
+
+    valuations = spec.get('valuations', ['global'])
+    unknown = [i for i in valuations if i not in ['global', 'territorial_us']]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown valuations {unknown}. Choose from ['global', 'territorial_us']")
+
+    return dict(sectors = [sector_dict[i] for i in sectors],
+                valuations = [i == 'territorial_us' for i in valuations],
+                etas_rhos = etas_rhos,
+                pulse_years = [int(i) for i in spec.get('pulse_years', conf['rffdata']['pulse_years'])],
+                gcnp = 'gcnp' in files,
+                uncollapsed = 'uncollapsed' in files,
+                summary = 'summary' in files,
+                annual = 'annual' in files)
 
 
+risk_combos = [['risk_aversion', 'euler_ramsey']] # Default
 
-questions = [
-    inquirer.List("sector",
-        message= 'Select sector',
-        choices= [
-            ('Combined',CAMEL_v),
-            ('Coastal',"coastal_v" + coastal_v),
-            ('Agriculture','agriculture'),
-            ('Mortality',"mortality_v" + mortality_v),
-            ('Energy','energy'),
-            ('Labor','labor'),
+# Interactive questionnaire, returns the run matrix for one sector and valuation type
+def ask_run_options(conf):
+    import inquirer
+    from pyfiglet import Figlet
+    sector_dict = sector_names(conf)
+
+    f = Figlet(font='slant')
+    print(f.renderText('DSCIM-EPA'))
+
+    questions = [
+        inquirer.List("sector",
+            message= 'Select sector',
+            choices= [
+                ('Combined',sector_dict['combined']),
+                ('Coastal',sector_dict['coastal']),
+                ('Agriculture','agriculture'),
+                ('Mortality',sector_dict['mortality']),
+                ('Energy','energy'),
+                ('Labor','labor'),
+            ],
+            default = [sector_dict['combined']]),
+        inquirer.Checkbox("eta_rhos",
+            message= 'Select discount rates',
+            choices= [
+                (
+                    '1.5% Ramsey',
+                    [1.016010255, 9.149608e-05]
+                ),
+                (
+                    '2.0% Ramsey',
+                    [1.244459066, 0.00197263997]
+                ),
+                (
+                    '2.5% Ramsey',
+                    [1.421158116, 0.00461878399]
+                ),
         ],
-        default = [CAMEL_v]),
-    inquirer.Checkbox("eta_rhos",
-        message= 'Select discount rates',
-        choices= [
-            (
-                '1.5% Ramsey',
-                [1.016010255, 9.149608e-05]
-            ),
-            (
-                '2.0% Ramsey',
-                [1.244459066, 0.00197263997]
-            ),
-            (
-                '2.5% Ramsey',
-                [1.421158116, 0.00461878399]
-            ),
-    ],
-        default = [[1.016010255, 9.149608e-05],
-                   [1.244459066, 0.00197263997],
-                   [1.421158116, 0.00461878399]]),
-    inquirer.Checkbox("pulse_year",
-        message= 'Select pulse years',
-        choices= [
-            (
-                '2020',
-                2020
-            ),
-            (
-                '2030',
-                2030
-            ),
-            (
-                '2040',
-                2040
-            ),
-            (
-                '2050',
-                2050
-            ),
-            (
-                '2060',
-                2060
-            ),
-            (
-                '2070',
-                2070
-            ),
-            (
-                '2080',
-                2080
-            ),
-
-    ],
-        default = [2020,2030,2040,2050,2060,2070,2080]),
-    inquirer.List("U.S.",
-        message= 'Select valuation type',
-        choices= [
-            ('Global',False),
-            ('Territorial U.S.',True)
-        ]),
-    inquirer.Checkbox("files",
-        message= 'Optional files to save (will increase runtime substantially)',
-        choices= [
-            (
-                'Global consumption no pulse',
-                'gcnp'
-            ),
-            (
-                'Uncollapsed scghgs',
-                'uncollapsed'
-            ),
-    ])
-        
-]
-
-answers = inquirer.prompt(questions)
-etas_rhos = answers['eta_rhos']
-sector = [answers['sector']]
-pulse_years = answers['pulse_year']
-terr_us = answers['U.S.']
-gcnp = True if 'gcnp' in answers['files'] else False
-uncollapsed = True if 'uncollapsed' in answers['files'] else False
-
-if terr_us:
-    sector = [i + "_USA" for i in sector]
+            default = [[1.016010255, 9.149608e-05],
+                       [1.244459066, 0.00197263997],
+                       [1.421158116, 0.00461878399]]),
+        inquirer.Checkbox("pulse_year",
+            message= 'Select pulse years',
+            choices= [
+                (
+                    '2020',
+                    2020
+                ),
+                (
+                    '2030',
+                    2030
+                ),
+                (
+                    '2040',
+                    2040
+                ),
+                (
+                    '2050',
+                    2050
+                ),
+                (
+                    '2060',
+                    2060
+                ),
+                (
+                    '2070',
+                    2070
+                ),
+                (
+                    '2080',
+                    2080
+                ),
 
-if len(etas_rhos) == 0:
-    raise ValueError('You must select at least one eta, rho combination')
-
-risk_combos = [['risk_aversion', 'euler_ramsey']] # Default
-gases = ['CO2_Fossil', 'CH4', 'N2O'] # Default
-epa_scghgs(sector,
-         terr_us,
-         etas_rhos,
-         risk_combos,
-         pulse_years=pulse_years,
-         gcnp = gcnp,
-         uncollapsed = uncollapsed)
+        ],
+            default = [2020,2030,2040,2050,2060,2070,2080]),
+        inquirer.List("U.S.",
+            message= 'Select valuation type',
+            choices= [
+                ('Global',False),
+                ('Territorial U.S.',True)
+            ]),
+        inquirer.Checkbox("files",
+            message= 'Optional files to save (will increase runtime substantially)',
+            choices= [
+                (
+                    'Global consumption no pulse',
+                    'gcnp'
+                ),
+                (
+                    'Uncollapsed scghgs',
+                    'uncollapsed'
+                ),
+                (
+                    'Summary statistics of uncollapsed scghgs',
+                    'summary'
+                ),
+                (
+                    'Annual scghgs interpolated between pulse years',
+                    'annual'
+                ),
+        ])
+
+    ]
+
+    answers = inquirer.prompt(questions)
+
+    if len(answers['eta_rhos']) == 0:
+        raise ValueError('You must select at least one eta, rho combination')
+
+    return dict(sectors = [answers['sector']],
+                valuations = [answers['U.S.']],
+                etas_rhos = answers['eta_rhos'],
+                pulse_years = answers['pulse_year'],
+                gcnp = True if 'gcnp' in answers['files'] else False,
+                uncollapsed = True if 'uncollapsed' in answers['files'] else False,
+                summary = True if 'summary' in answers['files'] else False,
+                annual = True if 'annual' in answers['files'] else False)
+
+
+# Command line interface for DSCIM-epa runs
+batch = args.spec is not None or any(getattr(args, k) not in (None, False) for k in ['sectors', 'discount_rates', 'pulse_years', 'valuations', 'gcnp', 'uncollapsed', 'summary', 'annual'])
+if batch:
+    run_options = read_run_spec(args, conf)
+else:
+    run_options = ask_run_options(conf)
+
+if args.workers < 1:
+    raise ValueError('--workers must be at least 1')
+if args.write_queue < 0:
+    raise ValueError('--write-queue must be at least 0')
+
+# Lists the runs without importing dscim or reading any inputs
+if args.dry_run:
+    rates = [discount_conversion_dict.get(f"{eta}_{rho}", f"eta{eta}_rho{rho}") for eta, rho in run_options['etas_rhos']]
+    for sector, terr_us in product(run_options['sectors'], run_options['valuations']):
+        print(f"{'territorial U.S.' if terr_us else 'global'} {sector}: {', '.join(rates)}; pulse years {', '.join(str(i) for i in run_options['pulse_years'])}")
+    files = [f for f in ['gcnp', 'uncollapsed', 'summary', 'annual'] if run_options[f]]
+    if args.preview is not None:
+        print(f"Preview of {args.preview} runids (seed {args.preview_seed})")
+    if args.shard is not None:
+        print(f"Shard {args.shard}, saved to be merged with merge_shards.py")
+    if args.float32:
+        print("Computed and saved in float32")
+    print(f"{len(run_options['sectors']) * len(run_options['valuations']) * len(rates) * len(run_options['pulse_years'])} runs, saving collapsed scghgs{''.join(' and ' + f for f in files)} to {conf['save_path']}")
+    sys.exit(0)
+
+# Results of previous runs are kept beside the output directory rather than among the outputs
+if args.no_result_cache:
+    result_cache = None
+else:
+    result_cache = dscim_epa.ResultCache(Path(conf['save_path']).parent / 'result_cache', conf, force = args.force)
+
+if args.profile == 'cprofile':
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+dscim_epa.epa_scghgs_batch(conf,
+                           risk_combos = risk_combos,
+                           result_cache = result_cache,
+                           workers = args.workers,
+                           runid_chunks = args.runid_chunks,
+                           output_format = args.output_format,
+                           vectorize_rates = args.vectorize_rates,
+                           conf_savename = conf_savename,
+                           quantiles = args.quantiles,
+                           quantile_error = args.quantile_error,
+                           preview = args.preview,
+                           preview_seed = args.preview_seed,
+                           shard = args.shard,
+                           write_queue = args.write_queue,
+                           fused = args.fused_kernel,
+                           float32 = args.float32,
+                           float32_check = args.float32_check,
+                           float32_rtol = args.float32_rtol,
+                           **run_options)
+
+# Worker processes are not included in the profile
+if args.profile == 'cprofile':
+    profiler.disable()
+    profiler.dump_stats(Path(conf['save_path']) / f"{conf_savename}run-profile.prof")
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
 
 
 print(f"Full results are available in {str(Path(conf['save_path']))}")
-
@@ -0,0 +1,129 @@
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import hashlib
+import json
+import os
+import re
+
+# Builds EPA/output/scghg_annual.csv from the SCGHGs of the three damage modules, as EPA/code/compile_scghgs.R does
+# The output directories are indexed once, the files are read in parallel with typed columns, SCGHGs are averaged across
+# GIVE, the Meta-Analysis and DSCIM, interpolated to every emission year and rounded as in the published table.
+# The table is only rebuilt when the index of source files, their size and modification time, has changed.
+#
+#   python scripts/compile_scghgs.py
+
+root = Path(__file__).resolve().parents[2]
+
+parser = argparse.ArgumentParser(description = "Compile the annual SCGHG table from the GIVE, Meta-Analysis and DSCIM SCGHGs")
+parser.add_argument("--root", default = str(root), help = "directory holding GIVE, Meta-Analysis, DSCIM and EPA (default: this repository)")
+parser.add_argument("--output", help = "annual table to write (default: EPA/output/scghg_annual.csv under --root)")
+parser.add_argument("--workers", type = int, default = 8, help = "number of threads reading the source files (default: 8)")
+parser.add_argument("--force", action = "store_true", help = "rebuild the table even if no source file has changed")
+
+# Version of the compiled table, to be increased when the compilation below changes
+compile_version = 1
+
+# Output directory of each damage module, with the name and pattern of its SCGHG files, as read by compile_scghgs.R
+# DSCIM files of the combined sector only, which are the global SCGHGs of all sectors together
+modules = {'GIVE (2022)': ('GIVE/output/scghgs', re.compile(r"sc-(CO2|CH4|N2O)-give-(\d{4})\.csv")),
+           'Meta-Analysis (2017)': ('Meta-Analysis/output/scghgs', re.compile(r"sc-(CO2|CH4|N2O)-meta_analysis-(\d{4})\.csv")),
+           'DSCIM (2022)': ('DSCIM/output/global_scghgs', re.compile(r"sc-(CO2|CH4|N2O)-dscim-combined-(\d{4})\.csv"))}
+
+# Columns read from every SCGHG file, and their types
+columns = {'sector': pa.string(), 'discount_rate': pa.string(), 'scghg': pa.float64()}
+
+# Source files of every module, with their gas and emission year from the file name, and their size and modification time
+# Each directory is listed once. Other files in the directories, such as attributes or annual DSCIM tables, are left out.
+def index_sources(root):
+    rows = []
+    for module, (path, pattern) in modules.items():
+        directory = Path(root) / path
+        if not directory.is_dir():
+            raise FileNotFoundError(f"No {module} SCGHGs in {directory}")
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                match = pattern.fullmatch(entry.name)
+                if match is None or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                rows.append(dict(module = module, gas = match[1], emission_year = int(match[2]),
+                                 path = os.path.relpath(entry.path, root), size = stat.st_size, mtime_ns = stat.st_mtime_ns))
+    if len(rows) == 0:
+        raise FileNotFoundError(f"No SCGHG files in {[str(Path(root) / path) for path, pattern in modules.values()]}")
+    return pd.DataFrame(rows).sort_values(['module', 'gas', 'emission_year']).reset_index(drop = True)
+
+# Hash of the index, which changes when any source file is added, removed or rewritten
+def index_hash(index):
+    content = dict(version = compile_version, sources = index[['path', 'size', 'mtime_ns']].values.tolist())
+    return hashlib.sha256(json.dumps(content, sort_keys = True, default = str).encode()).hexdigest()
+
+# Reads the SCGHGs of total damages from one source file, labelled with its module, gas and emission year
+# GIVE files have a row for each sector and only the total is kept. DSCIM SCGHGs are rounded to whole dollars, as
+# the other modules save them.
+def read_source(root, source):
+    table = pyarrow.csv.read_csv(Path(root) / source.path,
+                                 convert_options = pyarrow.csv.ConvertOptions(include_columns = list(columns), column_types = columns))
+    df = table.to_pandas()
+    if source.module == 'DSCIM (2022)':
+        df['scghg'] = np.round(df.scghg)
+        df['sector'] = df.sector.replace({'combined': 'total'})
+    elif source.module == 'GIVE (2022)':
+        df = df[df.sector == 'total']
+    return df.assign(module = source.module, gas = source.gas, emission_year = source.emission_year)
+
+# Linearly interpolates each column between the emission years it has, as zoo::na.approx does
+def interpolate(table):
+    years = np.arange(table.index.min(), table.index.max() + 1)
+    return pd.DataFrame({c: np.interp(years, table.index[table[c].notna()], table[c].dropna()) for c in table.columns},
+                        index = pd.Index(years, name = table.index.name))
+
+# Sorts discount rate labels from the highest to the lowest rate, with labels of other eta, rho pairs last, as dscim_epa.py does
+def discount_rate_order(rate):
+    match = re.match(r"(\d+(?:\.\d+)?)%", rate)
+    return (0, -float(match[1]), '') if match else (1, 0.0, rate)
+
+# Table of annual SCGHGs averaged across the modules, with the columns and formatting of EPA/output/scghg_annual.csv:
+# gas, emission.year and a column for each discount rate from the highest to the lowest, in rounded whole dollars
+# with thousands separators
+def annual_table(scghgs):
+    means = scghgs.groupby(['gas', 'emission_year', 'discount_rate']).scghg.mean()
+    table = pd.concat({gas: interpolate(df.droplevel('gas').unstack('discount_rate')) for gas, df in means.groupby(level = 'gas')},
+                      names = ['gas'])
+    table = table[sorted(table.columns, key = discount_rate_order)]
+    for c in table.columns:
+        table[c] = [f"{int(v):,}" for v in np.round(table[c])]
+    table = table.reset_index().rename(columns = {'emission_year': 'emission.year'})
+    table.columns.name = None
+    gas_order = {gas: i for i, gas in enumerate(['CO2', 'CH4', 'N2O'])}
+    return table.sort_values(['gas', 'emission.year'], key = lambda col: col.map(gas_order) if col.name == 'gas' else col, kind = 'stable')
+
+# Writes the annual table unless it is up to date, and returns whether it was written
+# The index of the sources it was built from is saved next to it as scghg_annual-sources.json
+def compile_scghgs(root = root, output = None, workers = 8, force = False):
+    output = Path(output) if output is not None else Path(root) / 'EPA' / 'output' / 'scghg_annual.csv'
+    sources_path = output.with_name(f"{output.stem}-sources.json")
+    index = index_sources(root)
+    key = index_hash(index)
+    if not force and output.exists() and sources_path.exists():
+        with open(sources_path, 'r') as f:
+            if json.load(f).get('hash') == key:
+                print(f"{output} is up to date with its {len(index)} source files")
+                return False
+
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        scghgs = pd.concat(pool.map(lambda source: read_source(root, source), index.itertuples()), ignore_index = True)
+    annual_table(scghgs).to_csv(output, index = False)
+    with open(sources_path, 'w') as f:
+        json.dump(dict(hash = key, version = compile_version, sources = index.to_dict(orient = 'records')), f, indent = 1)
+    print(f"Compiled {len(index)} source files into {output}")
+    return True
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    compile_scghgs(Path(args.root), args.output, args.workers, args.force)
@@ -0,0 +1,36 @@
+from pathlib import Path
+import argparse
+import os
+import re
+
+import dscim_epa
+
+# Writes the damage function coefficient files of every sector and discount rate into one store,
+# damage_function_coefficients.zarr in the damage function library. command_line_scghg.py reads coefficients from
+# the store once it exists, opening it once per process instead of a file per sector and discount rate.
+# Run again after changing any coefficient file, or delete the store to go back to reading the files. Other eta, rho pairs
+# can be added to the published discount rates with --discount-rates; runs of pairs missing from the store read their files.
+#
+#   python scripts/consolidate_damage_functions.py
+#   python scripts/consolidate_damage_functions.py --discount-rates eta1.3_rho0.003
+
+parser = argparse.ArgumentParser(description = "Consolidate the DSCIM-EPA damage function coefficient files into a single store")
+parser.add_argument("conf_name", nargs = "?", default = "generated_conf.yml",
+                    help = "config file in the current working directory (default: generated_conf.yml)")
+parser.add_argument("--discount-rates", nargs = "+", default = [],
+                    help = "eta, rho pairs as eta<eta>_rho<rho> to consolidate along with the published discount rates, as given to command_line_scghg.py")
+args = parser.parse_args()
+
+etas_rhos = [[float(x) for x in k.split('_')] for k in dscim_epa.discount_conversion_dict]
+for rate in args.discount_rates:
+    pair = re.fullmatch(r"eta([^_]+)_rho([^_]+)", rate)
+    try:
+        eta_rho = [float(pair[1]), float(pair[2])]
+    except (TypeError, ValueError):
+        raise ValueError(f"Unknown discount rate {rate}. Give eta, rho pairs as eta<eta>_rho<rho>")
+    if eta_rho not in etas_rhos:
+        etas_rhos.append(eta_rho)
+
+conf = dscim_epa.read_conf(Path(os.getcwd()) / args.conf_name)
+store = dscim_epa.consolidate_damage_functions(conf, etas_rhos)
+print(f"Damage function coefficients are available in {store}")
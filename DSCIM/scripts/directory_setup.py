@@ -4,6 +4,26 @@ from pathlib import Path
 import zipfile
 from tqdm import *
 import requests
+import argparse
+import base64
+import hashlib
+import io
+import json
+import shutil
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+parser = argparse.ArgumentParser(description = "Download and unzip the DSCIM-EPA input files into the current directory")
+parser.add_argument("--url", default = 'https://storage.googleapis.com/climateimpactlab-scc-tool/dscim-epa_input_data/dscim_v20221021_inputs.zip', help = "location of the input archive")
+parser.add_argument("--sha256", help = "expected SHA-256 of the archive, checked before unzipping")
+parser.add_argument("--connections", type = int, default = 1, help = "number of ranged requests to download in parallel")
+parser.add_argument("--chunk-size", type = int, default = 1024**2, help = "download buffer size in bytes")
+parser.add_argument("--stream", action = "store_true", help = "unzip straight from the server without saving the archive, so only the unzipped inputs use disk space")
+parser.add_argument("--rechunk-runid", type = int, help = "rewrite the climate files in chunks of this many runids, for use with command_line_scghg.py --runid-chunks")
+args = parser.parse_args()
+if args.stream and args.sha256 is not None:
+    parser.error("--sha256 needs the archive on disk and cannot be used with --stream, where each member is checked against its CRC instead")
 
 base = os.getcwd()
 input = Path(base) / "input"  
@@ -41,33 +61,231 @@ conf_base = {'mortality_version': 1,
   'CAMEL_m1_c0.20': {'formula': 'damages ~ -1 + anomaly + np.power(anomaly, 2) + gmsl + np.power(gmsl, 2)'}},
   'save_path': str(output)}
   
+# Downloads bytes start to end of url into path, continuing from whatever is already in path
+# Servers that ignore the Range header send the whole file, in which case the download starts over
+def download_range(session, url, path, start, end, pbar):
+    done = os.path.getsize(path) if os.path.exists(path) else 0
+    if end is not None and start + done > end:
+        return
+    ranged = start + done > 0 or end is not None
+    headers = {'Range': f"bytes={start + done}-{'' if end is None else end}"} if ranged else {}
+    with session.get(url, stream = True, headers = headers) as r:
+        r.raise_for_status()
+        if ranged and r.status_code != 206:
+            if start > 0 or end is not None:
+                raise requests.HTTPError(f"{url} does not support ranged requests")
+            pbar.update(-done)
+            done = 0
+        with open(path, 'ab' if done else 'wb') as f:
+            for chunk in r.iter_content(chunk_size = args.chunk_size):
+                if chunk:  # filter out keep-alive new chunks
+                    f.write(chunk)
+                    pbar.update(len(chunk))
+
+# Downloads url to path, resuming partial downloads
+# With more than one connection and a server that accepts ranges, the file is fetched as that many
+# byte ranges in parallel, each kept in its own .part file until all of them are complete
+# The byte ranges of the parts are saved beside them in a .ranges.json file. Parts left with other ranges, by a run with
+# a different number of connections or of an archive that has since changed size, are removed and downloaded again.
+def download(url, path, connections = 1):
+    session = requests.Session()
+    head = session.head(url, allow_redirects = True)
+    head.raise_for_status()
+    size = int(head.headers['Content-Length']) if 'Content-Length' in head.headers else None
+    if size is not None and os.path.exists(path) and os.path.getsize(path) == size:
+        print("Input files already downloaded")
+        return head.headers
+    if size is None or head.headers.get('Accept-Ranges') != 'bytes':
+        connections = 1
+    if connections > 1:
+        step = -(-size // connections)
+        ranges = [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+    else:
+        ranges = [(0, None)]
+    parts = [f"{path}.part{i}" if connections > 1 else f"{path}.part" for i in range(len(ranges))]
+    layout = dict(size = size, ranges = [list(r) for r in ranges])
+    ranges_file = Path(f"{path}.ranges.json")
+    if not ranges_file.exists() or json.loads(ranges_file.read_text()) != layout:
+        for part in Path(path).parent.glob(f"{Path(path).name}.part*"):
+            os.remove(part)
+        ranges_file.write_text(json.dumps(layout))
+    pbar = tqdm(total = size, unit = 'B', unit_scale = True)
+    pbar.update(sum(os.path.getsize(part) for part in parts if os.path.exists(part)))
+    with ThreadPoolExecutor(len(ranges)) as pool:
+        futures = [pool.submit(download_range, session, url, part, start, end, pbar) for part, (start, end) in zip(parts, ranges)]
+        for future in futures:
+            future.result()
+    pbar.close()
+    if len(parts) == 1:
+        os.replace(parts[0], path)
+    else:
+        with open(f"{path}.part", 'wb') as f:
+            for part in parts:
+                with open(part, 'rb') as p:
+                    shutil.copyfileobj(p, f, args.chunk_size)
+        os.replace(f"{path}.part", path)
+        for part in parts:
+            os.remove(part)
+    os.remove(ranges_file)
+    if size is not None and os.path.getsize(path) != size:
+        raise IOError(f"Downloaded {os.path.getsize(path)} bytes of {url}, expected {size}")
+    return head.headers
+
+# Checks the archive against the given SHA-256 and the MD5 that Google Cloud Storage reports in x-goog-hash
+# Objects without an MD5, such as composite objects, are checked against their CRC32C instead
+def verify(path, headers, sha256 = None):
+    expected = {}
+    if sha256 is not None:
+        expected['sha256'] = sha256.lower()
+    goog_hash = dict(h.strip().split('=', 1) for h in headers.get('x-goog-hash', '').split(',') if '=' in h)
+    if 'md5' in goog_hash:
+        expected['md5'] = base64.b64decode(goog_hash['md5']).hex()
+    elif 'crc32c' in goog_hash:
+        expected['crc32c'] = base64.b64decode(goog_hash['crc32c']).hex()
+    if not expected:
+        print("No checksum available, skipping verification")
+        return
+    # google-crc32c is installed with google-cloud-storage
+    if 'crc32c' in expected:
+        import google_crc32c
+    hashes = {name: google_crc32c.Checksum() if name == 'crc32c' else hashlib.new(name) for name in expected}
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(args.chunk_size), b''):
+            for h in hashes.values():
+                h.update(block)
+    for name, h in hashes.items():
+        if h.digest().hex() != expected[name]:
+            os.remove(path)
+            raise IOError(f"{name} of {path} is {h.digest().hex()}, expected {expected[name]}. The download has been removed, please run this script again.")
+
+# Whether a member has already been extracted, judged by its size and CRC
+def extracted(member, target):
+    if member.is_dir():
+        return target.is_dir()
+    if not target.is_file() or target.stat().st_size != member.file_size:
+        return False
+    crc = 0
+    with open(target, 'rb') as f:
+        for block in iter(lambda: f.read(args.chunk_size), b''):
+            crc = zlib.crc32(block, crc)
+    return crc == member.CRC
+
+# Read-only file over HTTP that fetches whatever is read with Range requests
+# zipfile only reads the central directory and the members it is asked for, so an archive can be
+# unzipped straight from the server without saving it
+class HTTPRangeFile(io.RawIOBase):
+    def __init__(self, session, url, size):
+        self.session = session
+        self.url = url
+        self.size = size
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence = io.SEEK_SET):
+        self.pos = [offset, self.pos + offset, self.size + offset][whence]
+        return self.pos
+
+    def readinto(self, b):
+        end = min(self.pos + len(b), self.size)
+        if end <= self.pos:
+            return 0
+        r = self.session.get(self.url, headers = {'Range': f"bytes={self.pos}-{end - 1}"})
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise requests.HTTPError(f"{self.url} does not support ranged requests, please run without --stream")
+        b[:len(r.content)] = r.content
+        self.pos += len(r.content)
+        return len(r.content)
+
+# The archive keeps everything under inputs/, which is unzipped to input/
+def member_path(member):
+    parts = Path(member.filename).parts
+    if '..' in parts or Path(member.filename).is_absolute():
+        raise zipfile.BadZipFile(f"Unsafe path {member.filename} in archive")
+    if parts[0] == 'inputs':
+        return input.joinpath(*parts[1:])
+    return Path(base).joinpath(*parts)
+
+# Unzips one member to its place in input/ unless it is already there
+# Members are written under a temporary name and moved once their CRC has been checked, so a corrupt
+# member raises an error and an interrupted run never leaves a partial file behind
+def extract_member(zip_ref, member):
+    target = member_path(member)
+    if extracted(member, target):
+        return
+    if member.is_dir():
+        makedir(target)
+        return
+    makedir(target.parent)
+    with zip_ref.open(member) as source, open(f"{target}.part", 'wb') as dest:
+        shutil.copyfileobj(source, dest, args.chunk_size)
+    os.replace(f"{target}.part", target)
+
+# Unzips the archive at url without saving it, with one connection per thread
+def stream_extract(url, connections = 1):
+    session = requests.Session()
+    head = session.head(url, allow_redirects = True)
+    head.raise_for_status()
+    size = int(head.headers['Content-Length'])
+    local = threading.local()
+    def open_zip():
+        if not hasattr(local, 'zip_ref'):
+            raw = HTTPRangeFile(session, url, size)
+            local.zip_ref = zipfile.ZipFile(io.BufferedReader(raw, buffer_size = args.chunk_size), 'r')
+        return local.zip_ref
+    members = open_zip().infolist()
+    with ThreadPoolExecutor(connections) as pool:
+        list(tqdm(pool.map(lambda member: extract_member(open_zip(), member), members), total = len(members)))
+
+# Rewrites the climate files so each chunk holds a block of runids for one gas and pulse year
+# command_line_scghg.py --runid-chunks then reads each chunk once instead of whole files
+def rechunk_climate(runid_chunks):
+    # Imported here so that plain downloads neither need xarray nor wait for it to import
+    import xarray as xr
+    chunks = {'gas': 1, 'pulse_year': 1, 'runid': runid_chunks}
+    gmst = climate_inputs / 'gmst_pulse.nc'
+    with xr.open_dataset(gmst) as ds:
+        encoding = {var: {'chunksizes': tuple(min(chunks.get(dim, ds.sizes[dim]), ds.sizes[dim]) for dim in ds[var].dims)}
+                    for var in ds.data_vars if 'runid' in ds[var].dims}
+        ds.chunk({dim: n for dim, n in chunks.items() if dim in ds.dims}).to_netcdf(f"{gmst}.tmp", encoding = encoding)
+    os.replace(f"{gmst}.tmp", gmst)
+    gmsl = climate_inputs / 'gmsl_pulse.zarr'
+    ds = xr.open_zarr(gmsl)
+    for var in ds.variables.values():
+        var.encoding.pop('chunks', None)
+    ds.chunk({dim: n for dim, n in chunks.items() if dim in ds.dims}).to_zarr(f"{gmsl}.tmp", mode = 'w')
+    shutil.rmtree(gmsl)
+    os.rename(f"{gmsl}.tmp", gmsl)
+
 # Download inputs from internet  
-print("Downloading input files...")
-name = 'dscim_v20221021_inputs.zip'
-url = 'https://storage.googleapis.com/climateimpactlab-scc-tool/dscim-epa_input_data/' + name
-with requests.get(url, stream = True) as r:
-    r.raise_for_status()
-    with open(name, 'wb') as f:
-        pbar = tqdm(total = int(r.headers['Content-Length']))
-        for chunk in r.iter_content(chunk_size=8192):
-            if chunk:  # filter out keep-alive new chunks
-                f.write(chunk)
-                pbar.update(len(chunk))
-print("")
-print("Unzipping input files...")
-with zipfile.ZipFile(Path(base) /  name, 'r') as zip_ref:
-    for member in tqdm(zip_ref.infolist()):
-        try:
-            zip_ref.extract(member, Path(base))
-        except zipfile.error as e:
-            pass
-
-if os.path.exists(Path(base) / name):
-    os.remove(Path(base) / name)
+if args.stream:
+    print("Downloading and unzipping input files...")
+    # Every member is checked against its CRC as it is unzipped
+    stream_extract(args.url, connections = args.connections)
 else:
-    print("Download Failed")
+    print("Downloading input files...")
+    name = args.url.split('/')[-1]
+    headers = download(args.url, Path(base) / name, connections = args.connections)
+    print("")
+    print("Verifying input files...")
+    verify(Path(base) / name, headers, args.sha256)
+    print("Unzipping input files...")
+    with zipfile.ZipFile(Path(base) /  name, 'r') as zip_ref:
+        for member in tqdm(zip_ref.infolist()):
+            extract_member(zip_ref, member)
+    os.remove(Path(base) / name)
 
-os.rename(Path(base) / 'inputs', input)
+if args.rechunk_runid is not None:
+    print("Rechunking climate files...")
+    rechunk_climate(args.rechunk_runid)
 
 with open('generated_conf.yml', 'w') as outfile:
     yaml.dump(conf_base, outfile, default_flow_style=False)
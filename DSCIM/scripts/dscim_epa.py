@@ -0,0 +1,1815 @@
+# DSCIM-EPA SCGHG calculations, importable without side effects
+# command_line_scghg.py is the command line interface to these functions. They can also be used from other code:
+#
+#   import sys; sys.path.insert(0, 'scripts')
+#   import dscim_epa
+#   conf = dscim_epa.read_conf('generated_conf.yml')
+#   dscim_epa.epa_scghgs(conf, ['CAMEL_m1_c0.20'], False, [[1.244459066, 0.00197263997]], pulse_years = [2020])
+#
+# The config is passed to every function rather than read from the working directory.
+# dscim takes several seconds to import, so it is only imported once a run needs it.
+import xarray as xr
+import yaml
+import pandas as pd
+import numpy as np
+from itertools import product
+from pathlib import Path
+from collections import OrderedDict
+from functools import lru_cache, cached_property
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+from contextlib import contextmanager, nullcontext
+import dask
+import dask.array
+import hashlib
+import json
+import os
+import re
+import resource
+import shutil
+import subprocess
+import time
+import tracemalloc
+from datetime import date
+
+# Wall time, CPU time and peak memory of each stage of a run, saved as a run report
+# Stages run in worker processes are recorded there and sent back with their results
+class RunReport:
+    def __init__(self, trace_memory = False):
+        self.records = []
+        self.trace_memory = trace_memory
+        self.traced_peaks = []
+
+    @contextmanager
+    def stage(self, name, **labels):
+        # tracemalloc keeps a single peak, so the peak of an enclosing stage is carried over before it is reset
+        if self.trace_memory:
+            if len(self.traced_peaks) > 0:
+                self.traced_peaks[-1] = max(self.traced_peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self.traced_peaks.append(0)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            record = dict(stage = name,
+                          **labels,
+                          wall_s = time.perf_counter() - wall,
+                          cpu_s = time.process_time() - cpu,
+                          # ru_maxrss is the high-water mark of the process, in kilobytes on Linux
+                          max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                          pid = os.getpid())
+            if self.trace_memory:
+                peak = max(self.traced_peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if len(self.traced_peaks) > 0:
+                    self.traced_peaks[-1] = max(self.traced_peaks[-1], peak)
+                record['traced_peak_mb'] = peak / 1024**2
+            self.records.append(record)
+
+    # Returns the records so far and starts a new list
+    def take(self):
+        records, self.records = self.records, []
+        return records
+
+    # Saves the records so far as {path}.json and {path}.csv
+    def save(self, path):
+        records = self.take()
+        with open(f"{path}.json", 'w') as f:
+            json.dump(records, f, indent = 1)
+        report = pd.DataFrame(records)
+        # Labels first, then measurements
+        measures = [c for c in ['wall_s', 'cpu_s', 'max_rss_mb', 'traced_peak_mb', 'pid'] if c in report.columns]
+        report[[c for c in report.columns if c not in measures] + measures].to_csv(f"{path}.csv", index = False)
+
+# Set to a RunReport to keep one for the runs in this process
+run_report = None
+
+# Times a stage in the run report, if one is kept
+def stage(name, **labels):
+    if run_report is None:
+        return nullcontext()
+    return run_report.stage(name, **labels)
+
+# Reads a config written by directory_setup.py
+def read_conf(path):
+    with stage('config'):
+        try:
+            with open(path, "r") as stream:
+                conf = yaml.safe_load(stream)
+        except FileNotFoundError:
+            raise FileNotFoundError("Please run directory_setup.py or place the config in your current working directory")
+
+    # Manually add other config parameters that are not meant to change run to run
+    conf["global_parameters"] = {'fair_aggregation': ["uncollapsed"],
+     'subset_dict': {'ssp': []},
+     'weitzman_parameter': [0.5],
+     'save_files': []}
+    return conf
+
+# Names of the sectors in the config, which carry the coastal and mortality versions
+def sector_names(conf):
+    coastal_v = str(conf["coastal_version"])
+    mortality_v = str(conf["mortality_version"])
+    return {'combined': f"CAMEL_m{mortality_v}_c{coastal_v}",
+            'coastal': "coastal_v" + coastal_v,
+            'agriculture': 'agriculture',
+            'mortality': "mortality_v" + mortality_v,
+            'energy': 'energy',
+            'labor': 'labor'}
+
+discount_conversion_dict = {'1.016010255_9.149608e-05': '1.5% Ramsey',
+                            '1.244459066_0.00197263997': '2.0% Ramsey',
+                            '1.421158116_0.00461878399': '2.5% Ramsey'}   
+gas_conversion_dict = {'CO2_Fossil':'CO2',
+                       'N2O':'N2O',
+                       'CH4':'CH4'} 
+
+# Upper bound on memory held by cached global discount factors and consumption no pulse
+# Sized to hold every pulse year and discount rate of one sector
+discount_cache_max_bytes = 4 * 1024**3
+    
+def makedir(path):
+    if not os.path.exists(path):
+        os.makedirs(path)
+        
+
+# Least recently used cache for global discounting results
+# Entries are keyed on (sector, eta, rho, pulse_year, discount_type) and hold loaded
+# (discount factors, global consumption no pulse, adjustment factor) so that the
+# global and territorial U.S. runs of a sector only compute them once
+class DiscountCache:
+    def __init__(self, max_bytes = discount_cache_max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        size = sum(v.nbytes for v in value)
+        # Results larger than the whole cache are not kept
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.nbytes -= sum(v.nbytes for v in self.entries.pop(key))
+        self.entries[key] = value
+        self.nbytes += size
+        # Evict least recently used entries until the cache fits in its memory bound
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last = False)
+            self.nbytes -= sum(v.nbytes for v in evicted)
+
+discount_cache = DiscountCache()
+
+
+# Input classes built on dscim, defined on first use so that importing this module does not import dscim
+@lru_cache(maxsize = None)
+def input_classes():
+    from dscim.menu.simple_storage import Climate, EconVars
+
+    # Socioeconomics loaded once and shared by every run in this process
+    class LoadedEconVars(EconVars):
+        @cached_property
+        def econ_vars(self):
+            return super().econ_vars.load()
+
+    # Socioeconomics opened lazily with dask chunks along runid, for out of core runs
+    class ChunkedEconVars(EconVars):
+        def __init__(self, path_econ, runid_chunks):
+            super().__init__(path_econ)
+            self.runid_chunks = runid_chunks
+
+        @cached_property
+        def econ_vars(self):
+            return super().econ_vars.chunk({'runid': self.runid_chunks})
+
+    # Climate inputs opened with dask chunks along runid, for out of core runs
+    # dscim holds the GMSL pulse zarr store in a single chunk, so it is reopened here with runid chunks
+    class ChunkedClimate(Climate):
+        def __init__(self, *args, runid_chunks, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.runid_chunks = runid_chunks
+
+        @property
+        def gmst_anomalies(self):
+            return super().gmst_anomalies.chunk({'runid': self.runid_chunks})
+
+        @property
+        def gmsl_anomalies(self):
+            df = xr.open_zarr(self.gmsl_fair_path).chunk({'runid': self.runid_chunks})
+
+            # collapse runtype dimension into control and pulse variables, as in dscim
+            datasets = []
+            for var in df.keys():
+                ds = df[var].to_dataset(dim = "runtype")
+                datasets.append(ds.rename({k: f"{k}_{var}" for k in ds.keys()}))
+            anomaly = xr.combine_by_coords(datasets, combine_attrs = "override")
+            anomaly = anomaly.drop_vars(["confidence", "kind", "locations", "workflow_src"], errors = "ignore")
+            if "pulse_gmsl_median" in anomaly.keys() and "control_gmsl_median" in anomaly.keys():
+                anomaly = anomaly.rename({"pulse_gmsl_median": "medianparams_pulse_gmsl",
+                                          "control_gmsl_median": "medianparams_control_gmsl"})
+            return anomaly
+
+    # Socioeconomics and climate inputs of a subset of runids, for preview runs
+    class SubsetEconVars(EconVars):
+        def __init__(self, path_econ, runids):
+            super().__init__(path_econ)
+            self.runids = runids
+
+        @cached_property
+        def econ_vars(self):
+            return super().econ_vars.sel(runid = list(self.runids)).load()
+
+    class SubsetClimate(Climate):
+        def __init__(self, *args, runids, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.runids = runids
+
+        @property
+        def gmst_anomalies(self):
+            return super().gmst_anomalies.sel(runid = list(self.runids))
+
+        @property
+        def gmsl_anomalies(self):
+            return super().gmsl_anomalies.sel(runid = list(self.runids))
+
+    return dict(Climate = Climate, LoadedEconVars = LoadedEconVars, ChunkedEconVars = ChunkedEconVars, ChunkedClimate = ChunkedClimate,
+                SubsetEconVars = SubsetEconVars, SubsetClimate = SubsetClimate)
+
+@lru_cache(maxsize = None)
+def load_econ_vars(path_econ, runid_chunks = None, runids = None):
+    if runids is not None:
+        return input_classes()['SubsetEconVars'](path_econ = path_econ, runids = runids)
+    if runid_chunks is not None:
+        return input_classes()['ChunkedEconVars'](path_econ = path_econ, runid_chunks = runid_chunks)
+    return input_classes()['LoadedEconVars'](path_econ = path_econ)
+
+# One Climate object per config and pulse year, so its anomalies are only set up once
+# The climate config is passed as JSON to be hashable
+def load_climate(conf, pulse_year, runid_chunks = None, runids = None):
+    return load_climate_json(json.dumps(conf["rff_climate"], sort_keys = True), pulse_year, runid_chunks, runids)
+
+@lru_cache(maxsize = None)
+def load_climate_json(rff_climate, pulse_year, runid_chunks = None, runids = None):
+    if runids is not None:
+        return input_classes()['SubsetClimate'](**json.loads(rff_climate), pulse_year = pulse_year, runids = runids)
+    if runid_chunks is not None:
+        return input_classes()['ChunkedClimate'](**json.loads(rff_climate), pulse_year = pulse_year, runid_chunks = runid_chunks)
+    return input_classes()['Climate'](**json.loads(rff_climate), pulse_year = pulse_year)
+
+# Single store of the damage function coefficients of every sector and discount rate, made by consolidate_damage_functions.py
+# Within the damage function library, it has a group for each sector and discounting type (e.g. CAMEL_m1_c0.20/risk_aversion_euler_ramsey)
+# with the coefficients of every discount rate along discount_rate, labelled with their unrounded eta and rho
+def damage_function_store(conf):
+    return Path(conf['paths']['rff_damage_function_library']) / 'damage_function_coefficients.zarr'
+
+# Damage function coefficient files in the library as named by dscim, with eta and rho rounded
+def damage_function_file(library, sector, name, discounting_type, eta, rho):
+    return Path(library) / sector / f"{name}_{discounting_type}_eta{round(eta,3)}_rho{round(rho,3)}_dfc.nc4"
+
+# Writes the coefficient files of every sector in the library, for each of the discount rates, into the store
+# Each discount rate is a chunk, so a run reads only the coefficients of its own rates
+def consolidate_damage_functions(conf, etas_rhos = None, risk_combos = (('risk_aversion', 'euler_ramsey'),)):
+    library = Path(conf['paths']['rff_damage_function_library'])
+    store = damage_function_store(conf)
+    etas_rhos = etas_rhos or [[float(x) for x in k.split('_')] for k in discount_conversion_dict]
+    sectors = sorted(p.name for p in library.iterdir() if p.is_dir() and any(p.glob('*_dfc.nc4')))
+    if len(sectors) == 0:
+        raise FileNotFoundError(f"No damage function coefficient files in {library}")
+    tmp = store.with_name(f"{store.name}.tmp")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    for sector, (name, discounting_type) in product(sectors, risk_combos):
+        files = [damage_function_file(library, sector, name, discounting_type, eta, rho) for eta, rho in etas_rhos]
+        missing = [str(f) for f in files if not f.exists()]
+        if len(missing) > 0:
+            raise FileNotFoundError(f"Missing damage function coefficients {missing}")
+        print(f"Consolidating {sector} {name}_{discounting_type} damage function coefficients")
+        discount_rates = [discount_conversion_dict.get(f"{eta}_{rho}", f"eta{eta}_rho{rho}") for eta, rho in etas_rhos]
+        opened = [xr.open_dataset(f) for f in files]
+        dfc = xr.concat(opened, dim = xr.DataArray(discount_rates, dims = 'discount_rate', name = 'discount_rate'))
+        dfc = dfc.assign_coords(eta = ('discount_rate', [eta for eta, rho in etas_rhos]),
+                                rho = ('discount_rate', [rho for eta, rho in etas_rhos]))
+        dfc.chunk({'discount_rate': 1}).to_zarr(tmp, group = f"{sector}/{name}_{discounting_type}", mode = 'w')
+        for f in opened:
+            f.close()
+    import zarr
+    zarr.consolidate_metadata(str(tmp))
+    if store.exists():
+        shutil.rmtree(store)
+    os.rename(tmp, store)
+    return store
+
+# Opens a group of the damage function coefficient store once per process
+@lru_cache(maxsize = None)
+def open_damage_function_store(store, group):
+    return xr.open_zarr(store, group = group)
+
+# Whether the store has the damage function coefficients of every one of the discount rates, matched on their unrounded eta and rho
+# Runs of rates that are not in the store, such as eta, rho pairs without a published rate, read the coefficient files instead
+def has_damage_function_coefficients(store, sector, name, discounting_type, etas, rhos):
+    if not Path(store).exists():
+        return False
+    try:
+        dfc = open_damage_function_store(str(store), f"{sector}/{name}_{discounting_type}")
+    except (FileNotFoundError, KeyError):
+        return False
+    return all(((dfc.eta.values == eta) & (dfc.rho.values == rho)).any() for eta, rho in zip(etas, rhos))
+
+# Damage function coefficients of one or several discount rates from the store, matched on their unrounded eta and rho
+# Only the chunks of the requested rates are read. Raises KeyError if the store has no coefficients for a rate.
+def read_damage_function_coefficients(store, sector, name, discounting_type, etas, rhos):
+    try:
+        dfc = open_damage_function_store(str(store), f"{sector}/{name}_{discounting_type}")
+    except (FileNotFoundError, KeyError):
+        raise KeyError(f"No damage function coefficients for {sector} {name}_{discounting_type} in {store}. Re-run consolidate_damage_functions.py")
+    index = []
+    for eta, rho in zip(etas, rhos):
+        match = np.flatnonzero((dfc.eta.values == eta) & (dfc.rho.values == rho))
+        if len(match) == 0:
+            available = [f"eta {e}, rho {r}" for e, r in zip(dfc.eta.values.tolist(), dfc.rho.values.tolist())]
+            raise KeyError(f"No damage function coefficients for {sector} {name}_{discounting_type} at eta {eta}, rho {rho} in {store}. Available: {available}. "
+                           f"Add the rate with consolidate_damage_functions.py --discount-rates eta{eta}_rho{rho}")
+        index.append(match[0])
+    return dfc.isel(discount_rate = index).drop_vars(['eta', 'rho'])
+
+        
+# Attributes of one run, from its recipe
+# Provenance shared by every run (author, date, machine and commit) is added once by RunManifest
+def generate_meta(menu_item, conf, terr_us = False):
+    meta = {}
+    
+    # eta and rho are arrays when several discount rates are computed together, and are set for each rate by epa_scghg_rates
+    for attr_dict in [
+        vars(menu_item),
+        vars(vars(menu_item)["climate"]),
+        vars(vars(menu_item)["econ_vars"]),
+    ]:
+        meta.update(
+            {
+                k: v
+                for k, v in attr_dict.items()
+                if (type(v) not in [xr.DataArray, xr.Dataset, pd.DataFrame] or k in ["eta", "rho"])
+                and k not in ["damage_function", "logger"]
+            }
+        )
+
+    # convert to strs
+    meta = {k: v if type(v) in [int, float] else str(v) for k, v in meta.items()}
+    
+    
+    # exclude irrelevant attrs
+    irrelevant_keys = ['econ_vars',
+                       'climate',
+                       'subset_dict',
+                       'filename_suffix',
+                       'ext_subset_start_year',
+                       'ext_subset_end_year',
+                       'ext_end_year',
+                       'ext_method',
+                       'clip_gmsl',
+                       'scenario_dimensions',
+                       'scc_quantiles',
+                       'quantreg_quantiles',
+                       'quantreg_weights',
+                       'full_uncertainty_quantiles',
+                       'extrap_formula',
+                       'fair_dims',
+                       'sector_path',
+                       'save_files',
+                       'save_path',
+                       'delta',
+                       'histclim',
+                       'ce_path',
+                       'gmst_path',
+                       'gmsl_path',
+                       'runid_chunks',
+                       'runids']
+    for k in irrelevant_keys:
+        if k in meta.keys():
+            del meta[k]
+    
+    # adjust attrs
+    meta['emission_scenarios'] = 'RFF-SPv2'
+    meta['damagefunc_base_period'] = meta.pop('base_period')
+    meta['socioeconomics_path'] = meta.pop('path')    
+    meta['gases'] = meta['gases'].split("'")
+    meta['gases'] = [e for e in meta['gases'] if e not in (', ','[',']')]
+    meta['gases'] = [gas_conversion_dict[gas] for gas in meta['gases']]
+    
+    if meta['sector']=='CAMEL_m1_c0.20':
+        meta['sector'] = 'combined'
+    else:
+        meta['sector'] = re.split("_",meta['sector'])[0] 
+        
+    if terr_us:
+        meta.update(discounting_socioeconomics_path = f"{conf['rffdata']['socioec_output']}/rff_global_socioeconomics.nc4")
+      
+    return meta
+
+
+# Full and short git commit hashes of the code, or "unknown" outside a git repository
+@lru_cache(maxsize = None)
+def git_commit():
+    try:
+        commit, label = subprocess.check_output(['git', 'rev-parse', 'HEAD', '--short', 'HEAD'], stderr = subprocess.DEVNULL).decode('ascii').split()
+    except (subprocess.CalledProcessError, OSError):
+        commit, label = "unknown", "unknown"
+    return commit, label
+
+# Input files read by a run
+def run_inputs(conf, run):
+    sector = run['sector'] if not run['terr_us'] else run['sector'][:-4]
+    # Damage function coefficients come from the sector's group of the consolidated store where it has the run's discount rate
+    store = damage_function_store(conf)
+    def dfc(sector):
+        if has_damage_function_coefficients(store, sector, run['menu_option'], run['discount_type'], [run['eta']], [run['rho']]):
+            return store / sector / f"{run['menu_option']}_{run['discount_type']}"
+        return damage_function_file(conf['paths']['rff_damage_function_library'], sector, run['menu_option'], run['discount_type'], run['eta'], run['rho'])
+    inputs = [conf['rff_climate']['gmst_fair_path'],
+              conf['rff_climate']['gmsl_fair_path'],
+              conf['rff_climate']['damages_pulse_conversion_path'],
+              f"{conf['rffdata']['socioec_output']}/rff_global_socioeconomics.nc4",
+              dfc(sector)]
+    if run['terr_us']:
+        inputs = inputs + [f"{conf['rffdata']['socioec_output']}/rff_USA_socioeconomics.nc4",
+                           dfc(run['sector'])]
+    return [str(i) for i in inputs]
+
+# Provenance and attributes of every run saved by one call of epa_scghgs, kept in the main process
+# Provenance is captured once, each run adds only its own attributes, and the attribute files and global consumption
+# no pulse attributes are generated from it. Saved as run-manifest-<sector>.json with the config, a hash of the size
+# and modification time of every input, the grid of runs, the attributes shared by all runs, the attributes that differ
+# for each run and the files written.
+class RunManifest:
+    def __init__(self, conf, runs):
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            dscim_version = version('dscim')
+        except PackageNotFoundError:
+            dscim_version = "unknown"
+        machine_name = os.getenv("HOSTNAME")
+        if machine_name is None:
+            try:
+                machine_name = os.uname()[1]
+            except AttributeError:
+                machine_name = "unknown"
+        commit, label = git_commit()
+        self.header = {"Author": "Climate Impact Lab",
+                       "Date Created": date.today().strftime("%d/%m/%Y"),
+                       "Units": "2020 PPP-adjusted USD"}
+        self.provenance = dict(machine = machine_name, commit = label, url = "https://github.com/ClimateImpactLab/dscim-epa/commit/" + commit)
+        self.conf = conf
+        self.dscim_version = dscim_version
+        # Hash of the size and modification time of each input, or of every file in an input directory, as in the result cache
+        self.inputs = {i: hashlib.sha256(json.dumps(input_fingerprint(i)).encode()).hexdigest()
+                       for i in sorted(set(i for run in runs for i in run_inputs(conf, run)))}
+        self.grid = {k: sorted(set(run[k] for run in runs), key = lambda v: (str(type(v)), v)) for k in ['sector', 'terr_us', 'eta', 'rho', 'pulse_year', 'discount_type', 'menu_option']}
+        self.runs = []
+        self.outputs = []
+
+    # Adds the attributes of one run, labelled by its place in the output files
+    def add(self, meta, **labels):
+        self.runs.append((labels, meta))
+
+    # Adds a file written, relative to the output directory
+    def output(self, path):
+        self.outputs.append(os.path.relpath(path, self.conf['save_path']))
+
+    # Distinct values of each attribute across runs, in the order they were added
+    def values(self):
+        values = {}
+        for labels, meta in self.runs:
+            for k, v in meta.items():
+                distinct = values.setdefault(k, [])
+                if v not in distinct:
+                    distinct.append(v)
+        return values
+
+    # Attributes of all runs, as saved in attribute files: attributes that differ across runs are lists of their values
+    def attributes(self):
+        attrs = dict(self.header)
+        attrs.update({k: v[0] if len(v) == 1 else v for k, v in self.values().items()})
+        attrs.update(self.provenance)
+        return attrs
+
+    def to_dict(self):
+        values = self.values()
+        common = {k: v[0] for k, v in values.items() if len(v) == 1 and all(k in meta for labels, meta in self.runs)}
+        return dict(provenance = dict(self.header, **self.provenance, dscim = self.dscim_version),
+                    conf = self.conf,
+                    inputs = self.inputs,
+                    grid = self.grid,
+                    common = common,
+                    runs = [dict(labels, **{k: v for k, v in meta.items() if k not in common}) for labels, meta in self.runs],
+                    outputs = self.outputs)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent = 1, default = str)
+
+# Sector names as used in output files
+def short_sector_name(sector):
+    if re.split("_",sector)[0]=="CAMEL":
+        return "combined"
+    return re.split("_",sector)[0]
+
+# Dataset for the results of every run saved in one file, allocated once and filled in place with fill_results
+# Runs are laid out along discount_rate, menu_option and sector ahead of the dimensions of a single run, sorted as
+# xr.combine_by_coords would sort them, and gases are given their short names
+# Variables keep the order of the single run, followed by the new coordinates, as after xr.combine_by_coords. The
+# dimensions of the dataset follow that order, and with them the columns and rows of files saved with to_dataframe.
+def allocate_results(template, discount_rates, menu_options, sectors):
+    grid = dict(discount_rate = sorted(set(discount_rates)), menu_option = sorted(set(menu_options)), sector = sorted(set(sectors)))
+    coords = dict(grid, **{k: v for k, v in template.coords.items() if k != 'simulation' or 'simulation' not in template.dims})
+    coords['gas'] = [gas_conversion_dict[gas] for gas in template.gas.values]
+    shape = [len(v) for v in grid.values()]
+    full = xr.Dataset({name: (list(grid) + list(var.dims), np.full(shape + list(var.shape), np.nan, dtype = var.dtype), var.attrs)
+                       for name, var in template.data_vars.items()},
+                      coords = coords,
+                      attrs = template.attrs)
+    # Selecting the variables by name reorders them without copying their data
+    return full[[k for k in template.variables if k in full.variables] + [k for k in full.variables if k not in template.variables]]
+
+# Writes the results of one run into their place in a dataset from allocate_results
+# Lazy results are computed a chunk at a time straight into their place, so no other copy of them is made
+def fill_results(full, result, **cell):
+    index = tuple(full.indexes[dim].get_loc(label) for dim, label in cell.items())
+    for name, var in result.data_vars.items():
+        target = full[name].data[index]
+        source = var.transpose(*full[name].dims[len(index):]).data
+        if isinstance(source, dask.array.Array):
+            dask.array.store(source, target)
+        else:
+            target[...] = source
+
+# Relative error of the quantiles in summary statistics
+quantile_error = 0.001
+
+# Mergeable summary of the distribution of SCGHGs of one run across runids
+# Draws are added in blocks, and summaries of blocks, runid chunks or separate runs of the same ensemble merge into the
+# summary of all their draws. Counts, means, variances and certainty equivalents merge exactly, up to floating point
+# rounding. Quantiles come from a DDSketch (Masson et al. 2019), which counts draws in logarithmic buckets, so merging
+# adds bucket counts. Quantiles interpolate linearly between the draws of the ranks either side of q * (n - 1), as
+# np.quantile does by default, and each of those draws is within a relative error of rel_error.
+class SCGHGSketch:
+    def __init__(self, rel_error = quantile_error):
+        self.rel_error = rel_error
+        self.gamma = (1 + rel_error) / (1 - rel_error)
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.adjusted_sum = 0.0
+        self.zeros = 0
+        self.positive = {}
+        self.negative = {}
+
+    # Adds a block of SCGHG draws and their adjustment factors
+    def add(self, scghg, adjustment_factor):
+        if len(scghg) == 0:
+            return self
+        # Blocks of float32 runs are summed in float64
+        scghg, adjustment_factor = np.asarray(scghg, dtype = np.float64), np.asarray(adjustment_factor, dtype = np.float64)
+        block = SCGHGSketch(self.rel_error)
+        block.n = len(scghg)
+        block.mean = float(scghg.mean())
+        block.m2 = float(((scghg - block.mean)**2).sum())
+        block.adjusted_sum = float((adjustment_factor * scghg).sum())
+        block.zeros = int((scghg == 0).sum())
+        for buckets, values in [(block.positive, scghg[scghg > 0]), (block.negative, -scghg[scghg < 0])]:
+            keys, counts = np.unique(np.ceil(np.log(values) / np.log(self.gamma)).astype(int), return_counts = True)
+            buckets.update(zip(keys.tolist(), counts.tolist()))
+        return self.merge(block)
+
+    # Adds the draws of another summary, with the parallel variance update of Chan et al.
+    def merge(self, other):
+        if other.rel_error != self.rel_error:
+            raise ValueError(f"Cannot merge summaries with quantile errors {self.rel_error} and {other.rel_error}")
+        n = self.n + other.n
+        if other.n == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.n / n
+        self.m2 = self.m2 + other.m2 + delta**2 * self.n * other.n / n
+        self.n = n
+        self.adjusted_sum = self.adjusted_sum + other.adjusted_sum
+        self.zeros = self.zeros + other.zeros
+        for buckets, others in [(self.positive, other.positive), (self.negative, other.negative)]:
+            for k, c in others.items():
+                buckets[k] = buckets.get(k, 0) + c
+        return self
+
+    # Draw of a rank from 0 to n - 1, as the value representing its bucket
+    def ranked(self, rank):
+        # Buckets hold values in (gamma^(k-1), gamma^k] and are represented by the value within rel_error of all of them
+        buckets = ([(-2 * self.gamma**k / (self.gamma + 1), c) for k, c in sorted(self.negative.items(), reverse = True)]
+                   + [(0.0, self.zeros)]
+                   + [(2 * self.gamma**k / (self.gamma + 1), c) for k, c in sorted(self.positive.items())])
+        count = 0
+        for value, c in buckets:
+            count += c
+            if count > rank:
+                return value
+        return np.nan
+
+    def quantile(self, q):
+        if self.n == 0:
+            return np.nan
+        rank = q * (self.n - 1)
+        below = int(np.floor(rank))
+        value = self.ranked(below)
+        if rank > below:
+            value = value + (rank - below) * (self.ranked(below + 1) - value)
+        return value
+
+    def summary(self, quantiles):
+        return dict(n = self.n,
+                    mean = self.mean,
+                    variance = self.m2 / (self.n - 1) if self.n > 1 else np.nan,
+                    # The certainty equivalent SCGHG, as in the collapsed files
+                    certainty_equivalent = self.adjusted_sum / self.n,
+                    **{f"q{q:g}": self.quantile(q) for q in quantiles})
+
+    def to_dict(self):
+        return dict(rel_error = self.rel_error, n = self.n, mean = self.mean, m2 = self.m2, adjusted_sum = self.adjusted_sum,
+                    zeros = self.zeros, positive = self.positive, negative = self.negative)
+
+    @classmethod
+    def from_dict(cls, d):
+        sketch = cls(d['rel_error'])
+        sketch.n, sketch.mean, sketch.m2, sketch.adjusted_sum, sketch.zeros = d['n'], d['mean'], d['m2'], d['adjusted_sum'], d['zeros']
+        # JSON keys are strings
+        sketch.positive = {int(k): c for k, c in d['positive'].items()}
+        sketch.negative = {int(k): c for k, c in d['negative'].items()}
+        return sketch
+
+# Summarises every run in a dataset of SCGHGs for one gas in a single pass over blocks of runid_chunks runids
+# Returns a table with a row of summary statistics for each run, and the sketch of each run so that they can be merged later
+def summarize_runs(df, quantiles, rel_error = quantile_error, runid_chunks = None):
+    scghg = df.scghg.transpose(..., 'runid')
+    adjustment_factor = df.adjustment_factor.transpose(*scghg.dims).values
+    step = runid_chunks or scghg.sizes['runid']
+    rows = []
+    sketches = []
+    for index in np.ndindex(scghg.shape[:-1]):
+        sketch = SCGHGSketch(rel_error)
+        for start in range(0, scghg.shape[-1], step):
+            sketch.add(scghg.values[index][start:start + step], adjustment_factor[index][start:start + step])
+        labels = {dim: scghg[dim].values.tolist()[i] for dim, i in zip(scghg.dims[:-1], index)}
+        rows.append(dict(labels, **sketch.summary(quantiles)))
+        sketches.append(dict(labels, sketch = sketch.to_dict()))
+    return pd.DataFrame(rows), sketches
+
+# Sorts discount rate labels from the highest to the lowest rate, as in the published tables
+# Labels of other eta, rho pairs, which have no rate, follow in their own order
+def discount_rate_order(rate):
+    match = re.match(r"(\d+(?:\.\d+)?)%", rate)
+    return (0, -float(match[1]), '') if match else (1, 0.0, rate)
+
+# Weights that linearly interpolate values at pulse years to every year from the first to the last pulse year, as
+# zoo::na.approx does for EPA/output/scghg_annual.csv. Pulse years keep their own values.
+def annual_weights(pulse_years):
+    pulse_years = np.sort(np.asarray(pulse_years))
+    years = np.arange(pulse_years[0], pulse_years[-1] + 1)
+    weights = np.stack([np.interp(years, pulse_years, row) for row in np.eye(len(pulse_years))], axis = -1)
+    return xr.DataArray(weights, dims = ['emission_year', 'pulse_year'], coords = dict(emission_year = years, pulse_year = pulse_years))
+
+# Interpolates SCGHGs along pulse_year to every year in one pass, as a product with the interpolation weights
+# emission_year takes the place of pulse_year, or comes just before runid in uncollapsed SCGHGs
+def interpolate_annual(df):
+    weights = annual_weights(df.pulse_year.values)
+    def interpolate(var):
+        dims = [dim for dim in var.dims if dim != 'pulse_year']
+        position = dims.index('runid') if 'runid' in dims else var.dims.index('pulse_year')
+        # Float32 SCGHGs are kept in float32 rather than promoted by the float64 weights
+        return xr.dot(var, weights, dims = 'pulse_year').astype(var.dtype, copy = False).transpose(*dims[:position], 'emission_year', *dims[position:])
+    if isinstance(df, xr.Dataset):
+        annual = {name: interpolate(var) for name, var in df.data_vars.items()}
+        return xr.Dataset({name: (var.dims, var.data, var.attrs) for name, var in annual.items()},
+                          coords = next(iter(annual.values())).coords,
+                          attrs = df.attrs)
+    return interpolate(df)
+
+# Table of collapsed annual SCGHGs with the columns of EPA/output/scghg_annual.csv: gas, emission.year and a column for
+# each discount rate from the highest to the lowest. Sectors and menu options are added as columns when there are several.
+def annual_table(collapsed):
+    annual = interpolate_annual(collapsed).rename('scghg')
+    index = [dim for dim in ['menu_option', 'sector'] if annual.sizes[dim] > 1] + ['gas', 'emission_year']
+    table = annual.to_dataframe().reset_index().pivot(index = index, columns = 'discount_rate', values = 'scghg')
+    table = table[sorted(table.columns, key = discount_rate_order)]
+    table = table.reset_index().rename(columns = {'emission_year': 'emission.year'})
+    table.columns.name = None
+    gas_order = {gas: i for i, gas in enumerate(['CO2', 'CH4', 'N2O'])}
+    return table.sort_values(index[:-2] + ['gas', 'emission.year'], key = lambda col: col.map(gas_order) if col.name == 'gas' else col, kind = 'stable')
+
+# Saves the uncollapsed SCGHGs of one gas as csv, parquet or a group of the full distribution zarr store
+def save_full_distribution(df, path, output_format = 'csv', zarr_store = None, group = None):
+    if output_format == 'zarr':
+        df.to_zarr(zarr_store, group = group, mode = 'w')
+        return
+    # Columns and rows are in the order of the dimensions of the dataset, as in the published files
+    df = df.to_dataframe().reindex()
+    if output_format == 'parquet':
+        # Repeated string columns are stored as dictionary-encoded categoricals
+        df = df.reset_index()
+        df = df.astype({c: 'category' for c in df.columns if not pd.api.types.is_numeric_dtype(df[c])})
+        df.to_parquet(f"{path}.parquet", index = False)
+    else:
+        df.to_csv(f"{path}.csv")
+
+# Saves the certainty equivalent SCGHGs of one gas
+def save_collapsed(df, path):
+    df.rename('scghg').to_dataframe().reindex().to_csv(path)
+
+# Saves summary statistics of the full distributions of one gas, with the sketches they come from
+def save_summary(df, path, sketch_path, quantiles, rel_error = quantile_error, runid_chunks = None):
+    summary, sketches = summarize_runs(df, quantiles, rel_error, runid_chunks)
+    summary.to_csv(path, index = False)
+    with open(sketch_path, 'w') as f:
+        json.dump(sketches, f)
+
+def save_attributes(attrs, path):
+    with open(path, 'w') as f:
+        for key, value in attrs.items():
+            f.write('%s:%s\n' % (key, value))
+
+# Writes output files in a background thread while the next pulse year is computed
+# Files are written one at a time in the order they are submitted. Writes are grouped in batches, one for each pulse year,
+# and at most max_pending batches are left to write before the next one is started, so a run that computes faster than
+# it writes waits rather than holding the results of every pulse year in memory. Errors do not stop the run: they are
+# collected and raised together by close, once every other file is written. With max_pending = 0, files are written
+# in the calling thread as they are submitted. NetCDF files are written with write rather than submit: netCDF4 and HDF5
+# are not safe to use from two threads, and the next pulse year reads its inputs from netCDF files.
+class BackgroundWriter:
+    def __init__(self, max_pending = 1):
+        self.max_pending = max_pending
+        self.pool = ThreadPoolExecutor(max_workers = 1) if max_pending > 0 else None
+        self.batch = []
+        self.batches = []
+        self.errors = []
+
+    # Writes a file in the calling thread, within a stage of the run report
+    def write(self, name, labels, write, *args, **kwargs):
+        with stage(name, **labels):
+            write(*args, **kwargs)
+
+    def submit(self, name, labels, write, *args, **kwargs):
+        if self.pool is not None:
+            future = self.pool.submit(self.write, name, labels, write, *args, **kwargs)
+        else:
+            future = Future()
+            try:
+                future.set_result(self.write(name, labels, write, *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        self.batch.append((name, labels, future))
+
+    def collect(self, batch):
+        for name, labels, future in batch:
+            try:
+                future.result()
+            except Exception as e:
+                self.errors.append(f"{name} ({', '.join(f'{k} {v}' for k, v in labels.items())}): {type(e).__name__}: {e}")
+
+    # Ends the batch of writes submitted so far and waits until at most max_pending batches are left to write
+    def throttle(self):
+        self.batches.append(self.batch)
+        self.batch = []
+        while len(self.batches) > self.max_pending:
+            self.collect(self.batches.pop(0))
+
+    # Waits for every write and raises an error listing the writes that failed
+    def close(self):
+        self.batches.append(self.batch)
+        self.batch = []
+        for batch in self.batches:
+            self.collect(batch)
+        self.batches = []
+        if self.pool is not None:
+            self.pool.shutdown()
+        if len(self.errors) > 0:
+            raise RuntimeError(f"{len(self.errors)} output files could not be written:\n" + "\n".join(self.errors))
+
+# Runids of the ensemble, in the order of the socioeconomics that every run is computed in
+def ensemble_runids(conf):
+    with xr.open_dataset(f"{conf['rffdata']['socioec_output']}/rff_global_socioeconomics.nc4") as econ:
+        return econ.runid.values
+
+# Pairing of RFF-SP socioeconomic and FaIR climate draws behind each runid, as used by GIVE and the Meta-Analysis
+def fair_sequence_path(conf):
+    return conf['rffdata'].get('fair_sequence', Path(__file__).resolve().parents[2] / 'GIVE' / 'input' / 'rffsp_fair_sequence.csv')
+
+# Reproducible stratified sample of n runids for preview runs
+# Runids are ordered by RFF-SP draw, in groups of similar draws, and by FaIR draw within each group, and split into n // 2
+# strata of neighbouring runids. Each stratum contributes two runids (three for the first n % 2 strata), so every part of
+# both the socioeconomic and the climate distributions is represented. Returns the sampled runids in order and a table
+# with the stratum of each runid and the number of runids of the ensemble in that stratum.
+def stratified_runids(conf, n, seed = 0):
+    sequence = pd.read_csv(fair_sequence_path(conf))
+    ensemble = ensemble_runids(conf)
+    # runids are the trials of the sequence
+    sequence = sequence[sequence.trial.isin(ensemble)]
+    if n < 2 or n > len(sequence):
+        raise ValueError(f"Preview runs need between 2 and {len(sequence)} runids")
+    strata = n // 2
+    groups = int(np.ceil(np.sqrt(strata)))
+    rffsp_group = np.floor(sequence.rffsp_id.rank(method = 'first').values * groups / (len(sequence) + 1)).astype(int)
+    order = sequence.trial.values[np.lexsort((sequence.fair_id.values, rffsp_group))]
+    rng = np.random.default_rng(seed)
+    rows = []
+    for h, members in enumerate(np.array_split(order, strata)):
+        for runid in rng.choice(members, size = 2 + (h < n % 2), replace = False):
+            rows.append(dict(runid = int(runid), stratum = h, stratum_size = len(members)))
+    sample = pd.DataFrame(rows).sort_values('runid').reset_index(drop = True)
+    return tuple(sample.runid.tolist()), sample
+
+# Certainty equivalent SCGHGs of a preview run with their Monte Carlo standard errors against the full ensemble
+# The certainty equivalent is a ratio estimate, since adjustment factors are normalised over the sampled runids, so its
+# error is that of the stratified mean of adjustment_factor * (scghg - certainty equivalent), with the finite population
+# correction of each stratum
+def preview_errors(df, sample):
+    collapsed = (df.adjustment_factor * df.scghg).mean(dim = 'runid')
+    residuals = (df.adjustment_factor * (df.scghg - collapsed)).rename('residual')
+    strata = sample.set_index('runid').to_xarray().sel(runid = df.runid)
+    sizes = strata.stratum_size.groupby(strata.stratum).first()
+    counts = strata.stratum_size.groupby(strata.stratum).count()
+    weights = sizes / sizes.sum()
+    variance = residuals.groupby(strata.stratum).var(ddof = 1)
+    std_error = np.sqrt((weights**2 * (1 - counts / sizes) * variance / counts).sum(dim = 'stratum'))
+    return collapsed, std_error
+
+# Adjustment factors from ypc^-eta at the pulse year, adjustment.factor = (ypc^-eta)/mean(ypc^-eta)
+def adjustment_factors(c):
+    if 'discount_rate' in c.dims:
+        # Each rate is normalised by its own mean, taken as in a run of that rate alone
+        return xr.concat([c.sel(discount_rate = r) / c.sel(discount_rate = r).mean() for r in c.discount_rate.values],
+                         dim = 'discount_rate').rename('adjustment_factor')
+    return (c/c.mean()).rename('adjustment_factor')
+
+# Kernels of fused runs, looping over the values in place instead of allocating a temporary array for each operation
+# values has a row for each discount rate. Raises each row to the power of -eta and divides it by its mean, or only one of the two
+def adjustment_factor_kernel(values, etas, power, normalize):
+    for r in range(values.shape[0]):
+        total = 0.0
+        for i in range(values.shape[1]):
+            if power:
+                values[r, i] = values[r, i] ** -etas[r]
+            total += values[r, i]
+        if normalize:
+            mean = total / values.shape[1]
+            for i in range(values.shape[1]):
+                values[r, i] = values[r, i] / mean
+
+# Mean of weights * values along the last axis, as a generalised ufunc
+def weighted_mean_kernel(weights, values, out):
+    total = 0.0
+    for i in range(values.shape[0]):
+        total += weights[i] * values[i]
+    out[0] = total / values.shape[0]
+
+def adjustment_factor_numpy(values, etas, power, normalize):
+    if power:
+        np.power(values, -etas[:, None], out = values)
+    if normalize:
+        values /= values.mean(axis = 1, keepdims = True)
+
+def weighted_mean_numpy(weights, values):
+    return np.einsum('...i,...i->...', weights, values, dtype = np.float64) / values.shape[-1]
+
+# The kernels compiled with numba, which is installed with numbagg, or their NumPy versions where numba is not available
+# Compiled kernels are cached next to this module, so they are only compiled on the first run
+@lru_cache(maxsize = None)
+def fused_kernels(use_numba = True):
+    try:
+        if not use_numba:
+            raise ImportError
+        import numba
+    except ImportError:
+        return dict(adjustment_factor = adjustment_factor_numpy, weighted_mean = weighted_mean_numpy, numba = False)
+    return dict(adjustment_factor = numba.njit(cache = True)(adjustment_factor_kernel),
+                weighted_mean = numba.guvectorize(['void(float64[:], float64[:], float64[:])'], '(n),(n)->()', cache = True)(weighted_mean_kernel),
+                numba = True)
+
+# Adjustment factors of a fused run from consumption per capita at the pulse year, ypc, in place of adjustment_factors
+# ypc^-eta is taken and each rate normalised by its mean in one pass over a single array, with the same dimensions as
+# adjustment_factors returns. Without eta, values is ypc^-eta already and is only normalised, and without normalize
+# ypc^-eta is returned as marginal_utility for the shards of a run.
+def fused_adjustment_factors(values, eta = None, normalize = True):
+    if isinstance(eta, xr.DataArray) and 'discount_rate' not in values.dims:
+        values = values.expand_dims(discount_rate = eta.discount_rate.values)
+    if 'discount_rate' in values.dims:
+        values = values.transpose('discount_rate', ...)
+        etas = eta.sel(discount_rate = values.discount_rate).values if eta is not None else np.zeros(values.sizes['discount_rate'])
+    else:
+        etas = np.array([eta if eta is not None else 0.0])
+    # The kernel writes into a contiguous copy unless values is already one
+    data = np.require(values.values, dtype = np.float64, requirements = ['C', 'W'])
+    fused_kernels()['adjustment_factor'](data.reshape(len(etas), -1), etas.astype(np.float64), eta is not None, normalize)
+    return values.copy(data = data).rename('adjustment_factor' if normalize else 'marginal_utility')
+
+# Certainty equivalent SCGHGs of a fused run, the mean of adjustment_factor * scghg over runids in one pass
+def fused_collapse(df):
+    return xr.apply_ufunc(fused_kernels()['weighted_mean'], df.adjustment_factor, df.scghg,
+                          input_core_dims = [['runid'], ['runid']])
+
+# Runids of a shard of the ensemble, given as a range of runids such as '1-2500' or as 'k/n' for the runids equal to k modulo n
+def shard_runids(conf, shard):
+    ensemble = ensemble_runids(conf)
+    runid_range = re.fullmatch(r"(\d+)-(\d+)", shard)
+    modulo = re.fullmatch(r"(\d+)/(\d+)", shard)
+    if runid_range is not None:
+        first, last = int(runid_range[1]), int(runid_range[2])
+        selected = ensemble[(ensemble >= first) & (ensemble <= last)]
+    elif modulo is not None:
+        k, n = int(modulo[1]), int(modulo[2])
+        if k >= n:
+            raise ValueError(f"Shard {shard} must be between 0/{n} and {n - 1}/{n}")
+        selected = ensemble[ensemble % n == k]
+    else:
+        raise ValueError(f"Unknown shard {shard}. Use a range of runids such as 1-2500 or k/n for the runids equal to k modulo n")
+    if len(selected) == 0:
+        raise ValueError(f"Shard {shard} has no runids in the ensemble")
+    return tuple(int(i) for i in selected)
+
+# Directory of the shards of one run, with a directory for each shard
+def shard_path(conf, terr_us, sector_short, conf_savename = ""):
+    return Path(conf['save_path']) / f"{'territorial_us' if terr_us else 'global'}_scghgs" / 'shards' / f"{conf_savename}{sector_short}"
+
+# Yields the results of each run from the shards of a run, as epa_scghg_runs yields them for a run over the whole ensemble
+# SCGHGs, ypc^-eta and global consumption no pulse are joined along runid in the order of the ensemble before the adjustment
+# factors are normalised over every runid, so every sum over runids is taken exactly as in a run over the whole ensemble
+def shard_results(shards, ensemble, fused = False):
+    gas_names = {v: k for k, v in gas_conversion_dict.items()}
+    gcnp = shards[0]['options']['gcnp']
+    files = {}
+    # Gases are given back their names, and coordinates their types, as in a single run
+    def join(datasets, cell):
+        joined = xr.concat([ds.sel(cell, drop = True) for ds in datasets], dim = 'runid').sel(runid = ensemble)
+        joined = joined.assign_coords({k: joined[k].astype(dtype) for k, dtype in shards[0]['coords'].items() if k in joined.coords})
+        return joined.assign_coords(gas = [gas_names[gas] for gas in joined.gas.values])
+    for labels, meta in shards[0]['runs']:
+        pulse_year = labels['pulse_year']
+        if pulse_year not in files:
+            for ds in [ds for datasets in files.values() for ds in datasets]:
+                ds.close()
+            files = {pulse_year: [xr.open_dataset(Path(shard['path']) / f"{pulse_year}.nc4") for shard in shards]}
+            if gcnp:
+                files['gcnp'] = [xr.open_dataset(Path(shard['path']) / f"{pulse_year}-gcnp.nc4") for shard in shards]
+        cell = {k: labels[k] for k in ['discount_rate', 'menu_option', 'sector']}
+        df = join(files[pulse_year], cell)
+        adjustment_factor = fused_adjustment_factors(df.marginal_utility) if fused else adjustment_factors(df.marginal_utility)
+        # Adjustment factors of float32 shards are normalised in float64 and then stored in float32, as in a float32 run
+        adjustment_factor = adjustment_factor.astype(df.scghg.dtype, copy = False)
+        # Variables keep the order of a single run, which sets the layout of the files saved from them
+        adjustments = df.drop_vars('marginal_utility').assign(adjustment_factor = adjustment_factor)
+        yield [adjustments, join(files['gcnp'], cell).gcnp if gcnp else None, meta]
+    for ds in [ds for datasets in files.values() for ds in datasets]:
+        ds.close()
+
+# Merges the finished shards of a run, saved in a directory from shard_path, into the files of a run over the whole ensemble
+# Shards must have been run with the same options, and together hold every runid of the ensemble exactly once
+def merge_shards(conf, path):
+    shards = []
+    for f in sorted(Path(path).glob('*/shard.json')):
+        with open(f, 'r') as stream:
+            shards.append(dict(json.load(stream), path = f.parent))
+    if len(shards) == 0:
+        raise FileNotFoundError(f"No finished shards in {path}")
+    for shard in shards[1:]:
+        if shard['options'] != shards[0]['options'] or shard['runs'] != shards[0]['runs']:
+            raise ValueError(f"Shard {shard['shard']} was run with different options or inputs from shard {shards[0]['shard']}")
+    ensemble = ensemble_runids(conf)
+    counts = pd.Series([runid for shard in shards for runid in shard['runids']]).value_counts()
+    repeated = sorted(counts.index[counts > 1])
+    missing = sorted(set(ensemble.tolist()) - set(counts.index))
+    if len(repeated) > 0 or len(missing) > 0:
+        raise ValueError(f"Shards {[shard['shard'] for shard in shards]} must hold every runid once: "
+                         f"{len(missing)} runids are missing (e.g. {missing[:5]}) and {len(repeated)} are in several shards (e.g. {repeated[:5]})")
+    epa_scghgs(conf, shards = shards, **shards[0]['options'])
+
+################################################################################
+
+# Function for one run of SCGHGs
+# eta and rho may also be arrays along a discount_rate dimension (see epa_scghg_rates), in which case
+# every discount rate is computed in one pass and the results have a discount_rate dimension
+# With float32, discount factors and marginal damages are held and multiplied in float32, summed over years in float64,
+# and the SCGHGs, adjustment factors and global consumption no pulse are returned in float32
+def epa_scghg(conf,
+            sector = "CAMEL_m1_c0.20",
+            terr_us = False,
+            eta = 2.0,
+            rho = 0.0,
+            pulse_year = 2020,
+            discount_type = "euler_ramsey",
+            menu_option = "risk_aversion",
+            discount_cache = None,
+            runid_chunks = None,
+            runids = None,
+            normalize = True,
+            fused = False,
+            float32 = False):
+
+    if menu_option != "risk_aversion":
+        raise Exception("DSCIM-EPA provides only 'risk_aversion' SCGHGs")
+
+    # Out of core runs stream over runid chunks, so nothing is loaded into the discount cache
+    if runid_chunks is not None:
+        discount_cache = None
+
+    rates = isinstance(eta, xr.DataArray)
+    if rates:
+        labels = dict(sector = sector, pulse_year = pulse_year, discount_rate = " / ".join(eta.discount_rate.values))
+    else:
+        labels = dict(sector = sector, pulse_year = pulse_year, discount_rate = discount_conversion_dict.get(f"{eta}_{rho}", f"eta{eta}_rho{rho}"))
+    # With a run report, in memory runs compute each stage as it is reached so that its time is attributed to it
+    eager = run_report is not None and runid_chunks is None
+
+    # Read in U.S. and global socioeconomic files and climate
+    with stage('inputs', **labels):
+        econ_glob = load_econ_vars(f"{conf['rffdata']['socioec_output']}/rff_global_socioeconomics.nc4", runid_chunks, runids)
+        climate = load_climate(conf, pulse_year, runid_chunks, runids)
+        if terr_us:
+            econ_terr_us = load_econ_vars(f"{conf['rffdata']['socioec_output']}/rff_USA_socioeconomics.nc4", runid_chunks, runids)
+        if eager:
+            econ_glob.econ_vars
+
+    if terr_us:
+        # List of kwargs to add to kwargs read in from the config file for direct territorial U.S. damages
+        add_kwargs = {
+            "econ_vars": econ_terr_us,
+            "climate_vars": climate,
+            "formula": conf["sectors"][sector if not terr_us else sector[:-4]]["formula"],
+            "discounting_type": discount_type,
+            "sector": sector,
+            "ce_path": None,
+            "save_path": None,
+            "eta": eta,
+            "rho": rho,
+            "damage_function_path": Path(conf['paths']['rff_damage_function_library'])  / sector,
+            "ecs_mask_path": None,
+            "ecs_mask_name": None,
+            "fair_dims":[],
+        }
+
+        # An extra set of kwargs is needed when running U.S. SCGHGs
+        # Combine config kwargs with the add_kwargs for direct territorial U.S. damages
+        kwargs_terr_us = conf["global_parameters"].copy()
+        for k, v in add_kwargs.items():
+            assert (
+                k not in kwargs_terr_us.keys()
+            ), f"{k} already set in config. Please check `global_parameters`."
+            kwargs_terr_us.update({k: v})
+
+
+    # This class allows for a shorter naming convention for the damage function files (rounding etas and rhos in the filename)
+    # Coefficients are read from the consolidated store instead where it has every discount rate of the run
+    dfc_store = damage_function_store(conf)
+    import dscim.menu.risk_aversion
+    class RiskAversionRecipe(dscim.menu.risk_aversion.RiskAversionRecipe):
+        @property
+        def damage_function_coefficients(self) -> xr.Dataset:
+            """
+            Load damage function coefficients if the coefficients are provided by the user.
+            Otherwise, compute them.
+            """
+            if self.damage_function_path is not None:
+                # The sector is the name of its directory in the damage function library
+                sector = Path(self.damage_function_path).name
+                etas, rhos = (self.eta.values, self.rho.values) if rates else ([self.eta], [self.rho])
+                if has_damage_function_coefficients(dfc_store, sector, self.NAME, self.discounting_type, etas, rhos):
+                    dfc = read_damage_function_coefficients(dfc_store, sector, self.NAME, self.discounting_type, etas, rhos)
+                    if rates:
+                        dfc = dfc.assign_coords(discount_rate = self.eta.discount_rate.values)
+                    else:
+                        dfc = dfc.isel(discount_rate = 0, drop = True)
+                    # Loaded as the coefficient files are unless the run is out of core
+                    if runid_chunks is None:
+                        dfc = dfc.load()
+                elif rates:
+                    # The coefficients of each discount rate are stacked along discount_rate
+                    dfc = xr.concat([xr.open_dataset(f"{self.damage_function_path}/{self.NAME}_{self.discounting_type}_eta{round(float(e),3)}_rho{round(float(r),3)}_dfc.nc4")
+                                     for e, r in zip(self.eta.values, self.rho.values)],
+                                    dim = self.eta.discount_rate)
+                else:
+                    dfc = xr.open_dataset(
+                        f"{self.damage_function_path}/{self.NAME}_{self.discounting_type}_eta{round(self.eta,3)}_rho{round(self.rho,3)}_dfc.nc4"
+                    )
+                if runid_chunks is not None and 'runid' in dfc.dims:
+                    dfc = dfc.chunk({'runid': runid_chunks})
+                if runids is not None and 'runid' in dfc.dims:
+                    dfc = dfc.sel(runid = list(runids))
+                return dfc
+            else:
+                return self.damage_function["params"]
+
+        def calculate_discount_factors(self, cons_pc):
+            if not rates:
+                return super().calculate_discount_factors(cons_pc)
+
+            # As in dscim, with the time preference component accumulated over years for each discount rate
+            cons_pc = cons_pc.sel(year = slice(self.climate.pulse_year, self.ext_end_year))
+            rhos = self.rho.expand_dims(year = cons_pc.year, axis = -1)
+            if not self.discrete_discounting:
+                rhos = np.expm1(rhos)
+            stream_rhos = rhos.copy(data = np.divide(1, np.multiply.accumulate(rhos.values + 1, rhos.dims.index("year"))))
+            ratio = cons_pc.sel(year = self.climate.pulse_year) ** (self.eta) / cons_pc ** (self.eta)
+            return ratio * stream_rhos
+
+    # List of kwargs to add to kwargs read in from the config file for global discounting and damages
+    add_kwargs = {
+        "econ_vars": econ_glob,
+        "climate_vars": climate,
+        "formula": conf["sectors"][sector if not terr_us else sector[:-4]]["formula"],
+        "discounting_type": discount_type,
+        "sector": sector,
+        "ce_path": None,
+        "save_path": None,
+        "eta": eta,
+        "rho": rho,
+        "damage_function_path": Path(conf['paths']['rff_damage_function_library']) / [sector if not terr_us else sector[:-4]][0], 
+        "ecs_mask_path": None,
+        "ecs_mask_name": None,
+        "fair_dims":[],
+    }
+
+    # Combine config kwargs with the add_kwargs for global discounting and damages
+    kwargs_global = conf["global_parameters"].copy()
+    for k, v in add_kwargs.items():
+        assert (
+            k not in kwargs_global.keys()
+        ), f"{k} already set in config. Please check `global_parameters`."
+        kwargs_global.update({k: v})
+
+    # For both territorial U.S. and global SCGHGs, endogenous Ramsey discounting based on global socioeconomics is used
+    # The global discount factors depend on the sector's damage functions but not on terr_us, so they are shared through the cache
+    menu_item_global = RiskAversionRecipe(**kwargs_global)
+
+    if rates:
+        cache_key = (sector if not terr_us else sector[:-4], tuple(eta.values), tuple(rho.values), pulse_year, discount_type, runids, normalize, fused, float32)
+    else:
+        cache_key = (sector if not terr_us else sector[:-4], eta, rho, pulse_year, discount_type, runids, normalize, fused, float32)
+    cached = discount_cache.get(cache_key) if discount_cache is not None else None
+    if cached is not None:
+        df, gcnp, adj = cached
+    else:
+        with stage('discount_factors', **labels):
+            df = menu_item_global.uncollapsed_discount_factors
+            if float32:
+                df = df.astype(np.float32)
+            # Persisting computes the discount factors but keeps their chunks, so later sums over them match an uncached run
+            if discount_cache is not None or eager:
+                df = df.persist()
+
+        with stage('adjustment_factors', **labels):
+            # Code to calculate epa-spec adjustment factors
+            gcnp = menu_item_global.global_consumption_no_pulse.rename('gcnp')
+
+            # Isolate population from socioeconomics
+            pop = econ_glob.econ_vars.sel(region = 'world', drop = True).pop
+
+            if fused:
+                # Only consumption per capita at the pulse year is computed, and the kernel takes the rest in place
+                adj = fused_adjustment_factors(gcnp.sel(year = pulse_year, drop = True) / pop.sel(year = pulse_year, drop = True), eta, normalize)
+            else:
+                # Calculate global consumption no pulse per population
+                a = xr.merge([pop, gcnp])  
+                ypv = a.gcnp/a.pop
+
+                # Create adjustment factor using adjustment.factor = (ypc^-eta)/mean(ypc^-eta)
+                c = np.power(ypv, -eta).sel(year = pulse_year, drop = True)
+                if normalize:
+                    adj = adjustment_factors(c)
+                else:
+                    # Shards of a run keep ypc^-eta, which is normalised over every runid when the shards are merged
+                    adj = c.rename('marginal_utility')
+            if discount_cache is not None or eager:
+                gcnp, adj = gcnp.persist(), adj.persist()
+
+        if discount_cache is not None:
+            discount_cache.put(cache_key, (df, gcnp, adj))
+
+    # Reuse the loaded consumption no pulse for global marginal damages instead of recomputing it
+    if discount_cache is not None:
+        menu_item_global.global_consumption_no_pulse = gcnp
+
+    # Compute damages for global or U.S. runs
+    with stage('marginal_damages', **labels):
+        if terr_us:
+            menu_item_terr_us = RiskAversionRecipe(**kwargs_terr_us)
+            md = menu_item_terr_us.uncollapsed_marginal_damages
+        else:
+            md = menu_item_global.uncollapsed_marginal_damages
+        # dscim computes marginal damages in float64, and float32 runs hold them in float32 from here on
+        if float32:
+            md = md.astype(np.float32)
+        # Persisting keeps the chunks of the marginal damages, so the sum over years below is unchanged
+        if eager:
+            md = md.persist()
+
+    # The 113.648/112.29 deflates the SCGHGs from 2019 dollars to 2020 dollars
+    conv_2019to2020 = 113.648/112.29
+    
+    # Compute SCGHGs
+    # Multiplying marginal damages by discount factors and summing across years creates the SCGHGs
+    with stage('scghgs', **labels):
+        # Float32 products are summed over years in float64
+        scghgs = (
+            (md.rename(marginal_damages = 'scghg') * df.rename(discount_factor = 'scghg'))
+            .sum("year", **({'dtype': np.float64} if float32 else {}))* conv_2019to2020
+        )     
+
+        # Merge adjustments with uncollapsed scghgs
+        adjustments = xr.merge([scghgs,adj.to_dataset()])          
+        # ypc^-eta of shards stays in float64, so that merged shards normalise the same values as a run without shards
+        if float32:
+            adjustments = adjustments.assign({k: v.astype(np.float32) for k, v in adjustments.data_vars.items() if k != 'marginal_utility'})
+        if eager:
+            adjustments = adjustments.load()
+    
+    # generate attrs           
+    with stage('meta', **labels):
+        if terr_us:
+            meta = generate_meta(menu_item_terr_us, conf, terr_us)
+        else:
+            meta = generate_meta(menu_item_global, conf, terr_us)
+
+    # The cached consumption no pulse stays in float64, as marginal damages are computed from it
+    gcnp = gcnp* conv_2019to2020
+    if float32:
+        gcnp = gcnp.astype(np.float32)
+
+    return([adjustments, gcnp, meta])
+
+# Runs of several discount rates for one sector and pulse year, computed in one pass
+# eta and rho become arrays along a discount_rate dimension, so the climate and socioeconomics are
+# read and the consumption paths computed once for all rates. Returns the results of each rate in order.
+def epa_scghg_rates(conf, etas_rhos, **kwargs):
+    discount_rates = [discount_conversion_dict.get(f"{eta}_{rho}", f"eta{eta}_rho{rho}") for eta, rho in etas_rhos]
+    eta = xr.DataArray([i[0] for i in etas_rhos], coords = {'discount_rate': discount_rates}, dims = 'discount_rate')
+    rho = xr.DataArray([i[1] for i in etas_rhos], coords = {'discount_rate': discount_rates}, dims = 'discount_rate')
+    adjustments, gcnp, meta = epa_scghg(conf, eta = eta, rho = rho, **kwargs)
+    # SCGHGs are computed once for all rates rather than again for each rate they are split into
+    adjustments = adjustments.persist()
+    return [[adjustments.sel(discount_rate = r, drop = True),
+             gcnp.sel(discount_rate = r, drop = True),
+             {k: e if k == 'eta' else p if k == 'rho' else v for k, v in meta.items()}]
+            for r, (e, p) in zip(discount_rates, etas_rhos)]
+
+# Size and modification time of an input file, or of every file in an input directory such as a zarr store
+# Read from disk on every call, so that long-running processes such as scghg_service.py notice replaced inputs
+def input_fingerprint(path):
+    path = Path(path)
+    if path.is_dir():
+        return [[str(f.relative_to(path)), f.stat().st_size, f.stat().st_mtime_ns] for f in sorted(path.rglob('*')) if f.is_file()]
+    if path.is_file():
+        return [path.stat().st_size, path.stat().st_mtime_ns]
+    return None
+
+# Version of the cached results, to be increased when the calculation in epa_scghg or the attributes it returns change
+result_cache_version = 2
+
+# Content-addressed store of epa_scghg results on disk
+# Each run is saved under a hash of its parameters, the resolved config, the dscim version and the
+# size and modification time of every input file it reads, so re-runs only compute new or changed runs
+# Inputs are fingerprinted once for each cache, which lasts for one command
+class ResultCache:
+    def __init__(self, path, conf, force = False):
+        self.path = Path(path)
+        self.conf = conf
+        self.force = force
+        self.fingerprints = {}
+
+    def input_fingerprint(self, path):
+        if path not in self.fingerprints:
+            self.fingerprints[path] = input_fingerprint(path)
+        return self.fingerprints[path]
+
+    def key(self, run):
+        import dscim
+        conf = self.conf
+        inputs = run_inputs(conf, run)
+        content = dict(version = result_cache_version,
+                       dscim = dscim.__version__,
+                       # Fused and float32 runs are keyed apart, so that the keys of other runs are unchanged
+                       run = {k: run[k] for k in ['sector', 'terr_us', 'eta', 'rho', 'pulse_year', 'discount_type', 'menu_option'] + [k for k in ['fused', 'float32'] if run.get(k)]},
+                       conf = {k: v for k, v in conf.items() if k != 'save_path'},
+                       inputs = {i: self.input_fingerprint(i) for i in inputs})
+        return hashlib.sha256(json.dumps(content, sort_keys = True, default = str).encode()).hexdigest()
+
+    # Whether a run is stored, including its global consumption no pulse if that is needed
+    def has(self, run, gcnp = True):
+        if self.force:
+            return False
+        key = self.key(run)
+        files = [f"{key}.nc4", f"{key}.json"] + ([f"{key}-gcnp.nc4"] if gcnp else [])
+        return all((self.path / f).exists() for f in files)
+
+    def get(self, run, gcnp = True):
+        key = self.key(run)
+        adjustments = xr.load_dataset(self.path / f"{key}.nc4")
+        df_gcnp = xr.load_dataarray(self.path / f"{key}-gcnp.nc4") if gcnp else None
+        with open(self.path / f"{key}.json", 'r') as f:
+            meta = json.load(f)
+        return [adjustments, df_gcnp, meta]
+
+    # Stores a run and returns its loaded results
+    # Files are written under temporary names and then moved, so interrupted runs never leave partial entries
+    def put(self, run, result, gcnp = True):
+        makedir(self.path)
+        key = self.key(run)
+        adjustments, df_gcnp, meta = result
+        adjustments = adjustments.load()
+        adjustments.to_netcdf(self.path / f"{key}.nc4.tmp")
+        os.replace(self.path / f"{key}.nc4.tmp", self.path / f"{key}.nc4")
+        if gcnp:
+            df_gcnp = df_gcnp.load()
+            df_gcnp.to_netcdf(self.path / f"{key}-gcnp.nc4.tmp")
+            os.replace(self.path / f"{key}-gcnp.nc4.tmp", self.path / f"{key}-gcnp.nc4")
+        with open(self.path / f"{key}.json.tmp", 'w') as f:
+            json.dump(meta, f)
+        os.replace(self.path / f"{key}.json.tmp", self.path / f"{key}.json")
+        return [adjustments, df_gcnp, meta]
+
+
+# Labels of a run, or of a group of runs computed together, in the run report
+def run_labels(*runs):
+    return dict(sector = runs[0]['sector'],
+                pulse_year = runs[0]['pulse_year'],
+                discount_rate = " / ".join(discount_conversion_dict.get(f"{run['eta']}_{run['rho']}", f"eta{run['eta']}_rho{run['rho']}") for run in runs))
+
+# Computes a group of runs that differ only in their discount rate
+# Groups of more than one run are computed in one pass with epa_scghg_rates
+def epa_scghg_group(conf, group, discount_cache = None):
+    if len(group) == 1:
+        return [epa_scghg(conf, discount_cache = discount_cache, **group[0])]
+    run = {k: v for k, v in group[0].items() if k not in ['eta', 'rho']}
+    return epa_scghg_rates(conf, [[i['eta'], i['rho']] for i in group], discount_cache = discount_cache, **run)
+
+# Runs one group of SCGHG runs in a worker process
+# Results are loaded before they are returned so that the computation happens in the worker rather than the parent
+# The worker's run report records are returned with them
+def epa_scghg_loaded(conf, group, keep_gcnp = True):
+    if run_report is not None:
+        run_report.take()  # records copied from the parent when the worker was forked
+    with stage('cell', **run_labels(*group)):
+        results = [[adjustments.load(), gcnp.load() if keep_gcnp else None, meta]
+                   for adjustments, gcnp, meta in epa_scghg_group(conf, group, discount_cache = discount_cache)]
+    return results, run_report.take() if run_report is not None else []
+
+# Yields the results of epa_scghg for each run in order
+# Runs found in the result cache are loaded from disk and only the remaining runs are computed and reported as calculated
+# With rates, runs that differ only in their discount rate are computed together
+def epa_scghg_runs(conf, runs, workers = 1, discount_cache = None, result_cache = None, gcnp = True, rates = False):
+    cached = [result_cache is not None and result_cache.has(run, gcnp) for run in runs]
+    groups = {}
+    for i, (run, hit) in enumerate(zip(runs, cached)):
+        if not hit:
+            key = tuple((k, v) for k, v in run.items() if k not in ['eta', 'rho']) if rates else i
+            groups.setdefault(key, []).append(i)
+    group_results = epa_scghg_compute(conf,
+                                      [[runs[i] for i in group] for group in groups.values()],
+                                      workers = workers,
+                                      discount_cache = discount_cache,
+                                      gcnp = gcnp)
+    computed = (result for group in groups.values() for result in zip(group, next(group_results)))
+
+    # Groups are computed in the order of their first run, so results are never needed before they are computed
+    done = {}
+    for i, (run, hit) in enumerate(zip(runs, cached)):
+        if hit:
+            with stage('result_cache_get', **run_labels(run)):
+                result = result_cache.get(run, gcnp)
+            yield result
+            continue
+        discount_rate = discount_conversion_dict.get(f"{run['eta']}_{run['rho']}", f"eta{run['eta']}_rho{run['rho']}")
+        print(f"Calculating {'territorial U.S.' if run['terr_us'] else 'global'} {short_sector_name(run['sector'])} scghgs {'and gcnp' if gcnp else ''} \n discount rate: {discount_rate} \n pulse year: {run['pulse_year']}")
+        while i not in done:
+            k, result = next(computed)
+            done[k] = result
+        result = done.pop(i)
+        if result_cache is not None:
+            with stage('result_cache_put', **run_labels(run)):
+                result = result_cache.put(run, result, gcnp)
+        yield result
+
+# Computes each group of runs and yields their results in order
+# With more than one worker, all groups are sent to a process pool up front and collected in submission order,
+# so results are merged exactly as in the serial loop
+def epa_scghg_compute(conf, groups, workers = 1, discount_cache = None, gcnp = True):
+    if workers <= 1:
+        for group in groups:
+            with stage('cell', **run_labels(*group)):
+                results = epa_scghg_group(conf, group, discount_cache = discount_cache)
+                # Lazy results are computed within the cell when they are timed
+                if run_report is not None:
+                    for result in results:
+                        result[0] = result[0].load()
+            yield results
+        return
+
+    # Workers are forked so that they share the inputs already loaded, the discount cache and the run report of this process
+    # Each worker computes with the synchronous dask scheduler so that workers do not oversubscribe cores
+    with ProcessPoolExecutor(max_workers = workers,
+                             mp_context = multiprocessing.get_context("fork"),
+                             initializer = dask.config.set,
+                             initargs = ({'scheduler': 'synchronous'},)) as pool:
+        futures = [pool.submit(epa_scghg_loaded, conf, group, keep_gcnp = gcnp) for group in groups]
+        try:
+            for future in futures:
+                results, records = future.result()
+                if run_report is not None:
+                    run_report.records.extend(records)
+                yield results
+        finally:
+            for future in futures:
+                future.cancel()
+
+# Number of runids and relative tolerance of the check of float32 runs against float64 runs
+float32_check_runids = 200
+float32_rtol = 1e-5
+
+# Checks float32 runs against float64 runs on a sample of n runids spread evenly over the ensemble, before a float32 run
+# Runs of the first pulse year, which discounts over the most years, are computed in both precisions on the sample with
+# adjustment factors normalised over it, so their certainty equivalent SCGHGs differ only by rounding. Differences are
+# taken relative to the mean absolute SCGHG draw of each gas in the float64 run, so that certainty equivalents close to
+# zero do not fail the check. Raises a RuntimeError listing the runs and gases beyond rtol, or returns the largest difference.
+def check_float32(conf, runs, n = float32_check_runids, rtol = float32_rtol):
+    ensemble = ensemble_runids(conf)
+    runids = tuple(int(i) for i in ensemble[np.unique(np.linspace(0, len(ensemble) - 1, min(n, len(ensemble))).round().astype(int))])
+    first = min(run['pulse_year'] for run in runs)
+    largest = 0.0
+    failed = []
+    for run in [run for run in runs if run['pulse_year'] == first]:
+        run = dict(run, runids = runids, runid_chunks = None, normalize = True)
+        with stage('float32_check', **run_labels(run)):
+            reference, result = [epa_scghg(conf, **dict(run, float32 = float32))[0].load() for float32 in [False, True]]
+            collapsed = [(ds.adjustment_factor * ds.scghg).mean(dim = 'runid', dtype = np.float64) for ds in [reference, result]]
+            difference = np.abs(collapsed[1] - collapsed[0]) / np.abs(reference.scghg).mean(dim = 'runid')
+        for gas in difference.gas.values:
+            worst = float(difference.sel(gas = gas).max())
+            largest = max(largest, worst)
+            if not worst <= rtol:
+                failed.append(f"{'territorial U.S.' if run['terr_us'] else 'global'} {run_labels(run)['sector']} {run_labels(run)['discount_rate']} "
+                              f"{gas_conversion_dict[gas]}: {worst:.3g}")
+    if len(failed) > 0:
+        raise RuntimeError(f"float32 SCGHGs differ from float64 SCGHGs on {len(runids)} runids by more than {rtol}:\n" + "\n".join(failed)
+                           + "\nRun in float64, or raise the tolerance if the differences are acceptable")
+    print(f"float32 SCGHGs agree with float64 SCGHGs on {len(runids)} runids: largest relative difference {largest:.3g}")
+    return largest
+
+# Function to perform multiple runs of SCGHGs and combine into one file to save out
+def epa_scghgs(conf,
+             sectors,
+             terr_us,
+             etas_rhos,
+             risk_combos = (('risk_aversion', 'euler_ramsey'),),
+             pulse_years = (2020,2030,2040,2050,2060,2070,2080),
+             gcnp = False,
+             uncollapsed = False,
+             discount_cache = discount_cache,
+             workers = 1,
+             runid_chunks = None,
+             output_format = 'csv',
+             result_cache = None,
+             vectorize_rates = False,
+             conf_savename = "",
+             summary = False,
+             quantiles = (0.05, 0.25, 0.5, 0.75, 0.95),
+             quantile_error = quantile_error,
+             annual = False,
+             preview = None,
+             preview_seed = 0,
+             shard = None,
+             shards = None,
+             write_queue = 1,
+             fused = False,
+             float32 = False,
+             float32_check = float32_check_runids,
+             float32_rtol = float32_rtol):
+
+    if output_format not in ['csv', 'parquet', 'zarr']:
+        raise ValueError(f"Unknown output format {output_format}. Choose from ['csv', 'parquet', 'zarr']")
+
+    # Preview runs compute a stratified sample of preview runids and save certainty equivalent SCGHGs with their standard errors
+    # They are not saved to or read from the result cache
+    runids = None
+    if preview is not None:
+        if gcnp or uncollapsed or summary or annual:
+            raise ValueError("Preview runs only save certainty equivalent SCGHGs with their standard errors")
+        if runid_chunks is not None:
+            raise ValueError("Preview runs are computed in memory and cannot be chunked")
+        if float32:
+            raise ValueError("Preview runs are small enough to be computed in float64")
+        runids, sample = stratified_runids(conf, preview, preview_seed)
+        result_cache = None
+
+    # A shard computes the runids of one part of the ensemble and saves their SCGHGs, ypc^-eta and global consumption no pulse
+    # for each pulse year, to be merged with the other shards by merge_shards. Options that save files take effect in the merge.
+    # Shards are not saved to or read from the result cache
+    if shard is not None:
+        if preview is not None:
+            raise ValueError("Preview runs cannot be sharded")
+        if runid_chunks is not None:
+            raise ValueError("Shards are computed in memory. Use more shards instead of runid chunks")
+        options = dict(sectors = sectors, terr_us = terr_us, etas_rhos = etas_rhos, risk_combos = risk_combos, pulse_years = pulse_years,
+                       gcnp = gcnp, uncollapsed = uncollapsed, output_format = output_format, vectorize_rates = vectorize_rates,
+                       conf_savename = conf_savename, summary = summary, quantiles = quantiles, quantile_error = quantile_error, annual = annual,
+                       fused = fused, float32 = float32)
+        runids = shard_runids(conf, shard)
+        result_cache = None
+
+    # All gases, pulse years and sectors share one store of full distributions, with a group for each gas/pulse_year/sector
+    # Discount rates are a dimension within each group
+    zarr_store = Path(conf['save_path']) / f"{'territorial_us' if terr_us else 'global'}_scghgs" / f"{conf_savename}full_distributions.zarr"
+    # SCGHGs of each pulse year, kept for interpolation to annual SCGHGs
+    annual_collapsed = []
+    annual_full = []
+
+    # Every run requested, in the order they are combined below
+    runs = [dict(sector = sector,
+                 terr_us = terr_us,
+                 discount_type = j[1],
+                 menu_option = j[0],
+                 eta = i[0],
+                 rho = i[1],
+                 pulse_year = pulse_year,
+                 runid_chunks = runid_chunks,
+                 runids = runids,
+                 normalize = shard is None,
+                 fused = fused,
+                 float32 = float32)
+            for j, pulse_year in product(risk_combos, pulse_years)
+            for i, sector in product(etas_rhos, sectors)]
+    manifest = RunManifest(conf, runs)
+    if preview is not None:
+        manifest.grid['preview'] = dict(runids = len(runids), seed = preview_seed)
+    # Float32 runs are checked against float64 before they start, unless float32_check is 0. Shards are checked when they are run.
+    if float32:
+        manifest.grid['float32'] = dict(check_runids = float32_check, rtol = float32_rtol)
+        if shards is None and float32_check > 0:
+            manifest.grid['float32']['max_difference'] = check_float32(conf, runs, float32_check, float32_rtol)
+    # Merged runs read the results of their shards rather than computing them
+    if shards is not None:
+        manifest.grid['shards'] = [i['shard'] for i in shards]
+        results = shard_results(shards, ensemble_runids(conf), fused)
+    else:
+        results = epa_scghg_runs(conf, runs, workers = workers, discount_cache = discount_cache, result_cache = result_cache, gcnp = gcnp, rates = vectorize_rates)
+
+    # CSV, parquet and zarr files are written in the background while the next pulse year is computed, with at most
+    # write_queue pulse years left to write. NetCDF files are written in this thread. tracemalloc keeps a single peak for the process, so with it the files are written in this thread.
+    writer = BackgroundWriter(0 if run_report is not None and run_report.trace_memory else write_queue)
+
+    # Nested for loops to run each combination of SCGHGs requested
+    # Each run of the outer loop saves one set of SCGHGs
+    # The inner loop combines all SCGHG runs for that file
+    for j, pulse_year in product(risk_combos, pulse_years):
+        writer.throttle()
+        # Datasets for all runs of this file, allocated from the first run's results and filled in place
+        df_full_scghg = None
+        df_full_gcnp = None
+        discount_rates = [discount_conversion_dict.get(f"{eta}_{rho}", f"eta{eta}_rho{rho}") for eta, rho in etas_rhos]
+
+        discount_type= j[1]
+        menu_option = j[0]
+        for i, sector in product(etas_rhos, sectors):
+            sector_short = short_sector_name(sector)
+            eta = i[0]
+            rho = i[1]
+            discount_rate = discount_conversion_dict.get(f"{eta}_{rho}", f"eta{eta}_rho{rho}")
+
+            df_single_scghg, df_single_gcnp, meta = next(results)
+
+            # Writes the run into its place among the runs of this file, labelled by discount rate, menu option and sector
+            with stage('combine', pulse_year = pulse_year):
+                cell = dict(discount_rate = discount_rate, menu_option = menu_option, sector = sector_short)
+                if df_full_scghg is None:
+                    df_full_scghg = allocate_results(df_single_scghg, discount_rates, [menu_option], [short_sector_name(s) for s in sectors])
+                fill_results(df_full_scghg, df_single_scghg, **cell)
+
+                # For global consumption no pulse, which is only combined when it is saved
+                if gcnp:
+                    if df_full_gcnp is None:
+                        df_full_gcnp = allocate_results(df_single_gcnp.to_dataset(), discount_rates, [menu_option], [short_sector_name(s) for s in sectors])
+                    fill_results(df_full_gcnp, df_single_gcnp.to_dataset(), **cell)
+
+            manifest.add(meta, pulse_year = pulse_year, **cell)
+
+        print("Processing...")
+
+        if shard is not None:
+            out_dir = shard_path(conf, terr_us, sector_short, conf_savename) / shard.replace('/', 'of')
+            makedir(out_dir)
+            print(f"Saving {'territorial U.S.' if terr_us else 'global'} {sector_short} shard {shard} \n pulse year: {pulse_year}")
+            writer.write('write_shard', dict(pulse_year = pulse_year), df_full_scghg.to_netcdf, out_dir / f"{pulse_year}.nc4")
+            if gcnp:
+                writer.write('write_shard', dict(pulse_year = pulse_year), df_full_gcnp.to_netcdf, out_dir / f"{pulse_year}-gcnp.nc4")
+            # NetCDF reads string coordinates back as fixed width strings, so their types are kept to restore them
+            coord_dtypes = {k: str(v.dtype) for ds in [df_full_scghg, df_full_gcnp] if ds is not None for k, v in ds.coords.items()}
+            continue
+
+        # Saves certainty equivalent SCGHGs of preview runs with their standard errors and 95% confidence intervals
+        # in their own directory, so they are not mistaken for SCGHGs of the full ensemble
+        if preview is not None:
+            out_dir = Path(conf['save_path']) / f"{'territorial_us' if terr_us else 'global'}_scghgs" / 'preview'
+            makedir(out_dir)
+            with stage('preview', pulse_year = pulse_year):
+                collapsed, std_error = preview_errors(df_full_scghg, sample)
+                for gas in ['CO2','CH4', 'N2O']:
+                    table = xr.Dataset(dict(scghg = collapsed.sel(gas = gas, drop = True),
+                                            std_error = std_error.sel(gas = gas, drop = True),
+                                            lower_95 = (collapsed - 1.96 * std_error).sel(gas = gas, drop = True),
+                                            upper_95 = (collapsed + 1.96 * std_error).sel(gas = gas, drop = True)))
+                    table = table.to_dataframe(dim_order = list(table.scghg.dims)).reindex()
+                    table['runids'] = len(runids)
+                    print(f"Saving {'territorial U.S.' if terr_us else 'global'} preview {sector_short} sc-{gas} \n pulse year: {pulse_year}")
+                    writer.submit('write_preview', dict(gas = gas, pulse_year = pulse_year), table.to_csv, out_dir / f"{conf_savename}sc-{gas}-dscim-{sector_short}-{pulse_year}-n{len(runids)}.csv")
+                    manifest.output(out_dir / f"{conf_savename}sc-{gas}-dscim-{sector_short}-{pulse_year}-n{len(runids)}.csv")
+            continue
+
+        # Splits SCGHGs by gas and saves them out separately
+        # For uncollapsed SCGHGs
+        gases = ['CO2','CH4', 'N2O']
+        if uncollapsed:    
+            for gas in gases:
+                out_dir = Path(conf['save_path']) / f"{'territorial_us' if terr_us else 'global'}_scghgs" / 'full_distributions' / gas 
+                makedir(out_dir)
+                print(f"Saving {'territorial U.S.' if terr_us else 'global'} uncollapsed {sector_short} sc-{gas} \n pulse year: {pulse_year}")
+                writer.submit('write_uncollapsed', dict(gas = gas, pulse_year = pulse_year),
+                              save_full_distribution,
+                              df_full_scghg.sel(gas = gas, drop = True),
+                              out_dir / f"{conf_savename}sc-{gas}-dscim-{sector_short}-{pulse_year}-n10000",
+                              output_format,
+                              zarr_store = zarr_store,
+                              group = f"{gas}/{pulse_year}/{sector_short}")
+                manifest.output(zarr_store / gas / str(pulse_year) / sector_short if output_format == 'zarr' else
+                                out_dir / f"{conf_savename}sc-{gas}-dscim-{sector_short}-{pulse_year}-n10000.{output_format}")
+
+        # Summary statistics of the full distributions, with the sketches they come from so that runs can be merged
+        if summary:
+            for gas in gases:
+                out_dir = Path(conf['save_path']) / f"{'territorial_us' if terr_us else 'global'}_scghgs" / 'summary_statistics'
+                makedir(out_dir)
+                print(f"Saving {'territorial U.S.' if terr_us else 'global'} {sector_short} sc-{gas} summary statistics \n pulse year: {pulse_year}")
+                writer.submit('summary', dict(gas = gas, pulse_year = pulse_year),
+                              save_summary,
+                              df_full_scghg.sel(gas = gas, drop = True),
+                              out_dir / f"{conf_savename}sc-{gas}-dscim-{sector_short}-{pulse_year}-summary.csv",
+                              out_dir / f"{conf_savename}sketches-{gas}-dscim-{sector_short}-{pulse_year}.json",
+                              quantiles, quantile_error, runid_chunks)
+                manifest.output(out_dir / f"{conf_savename}sc-{gas}-dscim-{sector_short}-{pulse_year}-summary.csv")
+                manifest.output(out_dir / f"{conf_savename}sketches-{gas}-dscim-{sector_short}-{pulse_year}.json")
+
+        if annual and uncollapsed:
+            annual_full.append(df_full_scghg.expand_dims(pulse_year = [pulse_year]))
+
+        # Applies the adjustment factor to convert to certainty equivalent SCGHGs
+        with stage('collapse', pulse_year = pulse_year):
+            if fused:
+                df_full_scghg = fused_collapse(df_full_scghg)
+            else:
+                # Float32 products are summed over runids in float64
+                df_full_scghg = (df_full_scghg.adjustment_factor * df_full_scghg.scghg).mean(dim = 'runid', **({'dtype': np.float64} if float32 else {}))
+        if annual:
+            annual_collapsed.append(df_full_scghg.expand_dims(pulse_year = [pulse_year]))
+
+        # Splits and saves collapsed SCGHGs
+        for gas in gases:
+            out_dir = Path(conf['save_path']) / f"{'territorial_us' if terr_us else 'global'}_scghgs"   
+            makedir(out_dir)
+            print(f"Saving {'territorial U.S.' if terr_us else 'global'} collapsed {sector_short} sc-{gas} \n pulse year: {pulse_year}")
+            writer.submit('write_collapsed', dict(gas = gas, pulse_year = pulse_year),
+                          save_collapsed, df_full_scghg.sel(gas = gas, drop = True), out_dir / f"{conf_savename}sc-{gas}-dscim-{sector_short}-{pulse_year}.csv")
+            manifest.output(out_dir / f"{conf_savename}sc-{gas}-dscim-{sector_short}-{pulse_year}.csv")
+
+    # The shard is marked as finished once every pulse year is saved, with its runids, options and the attributes of each run
+    if shard is not None:
+        writer.close()
+        with open(out_dir / 'shard.json', 'w') as f:
+            json.dump(dict(shard = shard, runids = list(runids), options = options, coords = coord_dtypes, runs = manifest.runs), f, indent = 1, default = str)
+        if run_report is not None:
+            run_report.save(out_dir / "run-report")
+        print(f"Shard {shard} is available in {str(out_dir)}. Merge all shards with merge_shards.py")
+        return
+
+    # Interpolates SCGHGs to every year between the first and last pulse year, without running the years in between
+    # Collapsed SCGHGs are saved as one table with the columns of EPA/output/scghg_annual.csv
+    if annual:
+        out_dir = Path(conf['save_path']) / f"{'territorial_us' if terr_us else 'global'}_scghgs"
+        print(f"Saving {'territorial U.S.' if terr_us else 'global'} annual {sector_short} scghgs")
+        with stage('annual'):
+            writer.submit('write_annual', {}, annual_table(xr.concat(annual_collapsed, dim = 'pulse_year')).to_csv,
+                          out_dir / f"{conf_savename}scghg-annual-dscim-{sector_short}.csv", index = False)
+            manifest.output(out_dir / f"{conf_savename}scghg-annual-dscim-{sector_short}.csv")
+            # Uncollapsed SCGHGs and adjustment factors are interpolated draw by draw
+            if uncollapsed:
+                df_annual = interpolate_annual(xr.concat(annual_full, dim = 'pulse_year'))
+                for gas in gases:
+                    writer.submit('write_annual', dict(gas = gas),
+                                  save_full_distribution,
+                                  df_annual.sel(gas = gas, drop = True),
+                                  out_dir / 'full_distributions' / gas / f"{conf_savename}sc-{gas}-dscim-{sector_short}-annual-n10000",
+                                  output_format,
+                                  zarr_store = zarr_store,
+                                  group = f"{gas}/annual/{sector_short}")
+                    manifest.output(zarr_store / gas / 'annual' / sector_short if output_format == 'zarr' else
+                                    out_dir / 'full_distributions' / gas / f"{conf_savename}sc-{gas}-dscim-{sector_short}-annual-n10000.{output_format}")
+
+    # Creates attribute files from the manifest, for all runs
+    attrs = manifest.attributes()
+    out_dir = Path(conf['save_path']) / f"{'territorial_us' if terr_us else 'global'}_scghgs" / ('preview' if preview is not None else '')
+    writer.submit('write_attributes', {}, save_attributes, attrs, out_dir / f"attributes-{sector_short}.txt")
+    manifest.output(out_dir / f"attributes-{sector_short}.txt")
+    if uncollapsed:
+        for gas in gases:
+            attrs_save = attrs.copy()
+            attrs_save['gases'] = gas
+            writer.submit('write_attributes', dict(gas = gas), save_attributes, attrs_save, out_dir / 'full_distributions' / gas / f"{conf_savename}attributes-{gas}-{sector_short}.txt")
+            manifest.output(out_dir / 'full_distributions' / gas / f"{conf_savename}attributes-{gas}-{sector_short}.txt")
+
+    # Saves global consumption no pulse
+    # Fewer GCNPs are saved because they vary across fewer dimensions than SCGHGs
+    if gcnp:
+        out_dir = Path(conf['save_path']) / 'gcnp' 
+        makedir(out_dir)
+        df_full_gcnp.attrs=attrs
+        print(f"Saving {sector_short} global consumption no pulse (gcnp)")
+        writer.write('write_gcnp', {}, df_full_gcnp.to_netcdf, out_dir / f"{conf_savename}gcnp-dscim-{sector_short}.nc4")
+        manifest.output(out_dir / f"{conf_savename}gcnp-dscim-{sector_short}.nc4")
+
+    # Waits for the files still being written, raising any write errors
+    writer.close()
+    if gcnp:
+        print(f"gcnp is available in {str(Path(conf['save_path']) / 'gcnp')}")
+
+    # Consolidates metadata across all groups of the full distribution store
+    if uncollapsed and output_format == 'zarr':
+        import zarr
+        zarr.consolidate_metadata(str(zarr_store))
+
+    # Saves the run report and the manifest next to the attribute files
+    if run_report is not None:
+        run_report.save(Path(conf['save_path']) / f"{'territorial_us' if terr_us else 'global'}_scghgs" / f"{conf_savename}run-report-{sector_short}")
+    manifest.save(Path(conf['save_path']) / f"{'territorial_us' if terr_us else 'global'}_scghgs" / ('preview' if preview is not None else '') / f"{conf_savename}run-manifest-{sector_short}.json")
+
+    print(f"{'territorial_us' if terr_us else 'global'}_scghgs are available in {str(Path(conf['save_path']))}/{'territorial_us' if terr_us else 'global'}_scghgs")
+   
+
+# Runs every requested sector and valuation type in this process
+# Sectors are the outer loop so the global and territorial U.S. runs of a sector share cached discount factors
+def epa_scghgs_batch(conf,
+                     sectors,
+                     valuations,
+                     etas_rhos,
+                     risk_combos = (('risk_aversion', 'euler_ramsey'),),
+                     pulse_years = (2020,2030,2040,2050,2060,2070,2080),
+                     gcnp = False,
+                     uncollapsed = False,
+                     workers = 1,
+                     runid_chunks = None,
+                     output_format = 'csv',
+                     result_cache = None,
+                     vectorize_rates = False,
+                     conf_savename = "",
+                     summary = False,
+                     quantiles = (0.05, 0.25, 0.5, 0.75, 0.95),
+                     quantile_error = quantile_error,
+                     annual = False,
+                     preview = None,
+                     preview_seed = 0,
+                     shard = None,
+                     write_queue = 1,
+                     fused = False,
+                     float32 = False,
+                     float32_check = float32_check_runids,
+                     float32_rtol = float32_rtol):
+    for sector, terr_us in product(sectors, valuations):
+        epa_scghgs(conf,
+                 [sector + "_USA" if terr_us else sector],
+                 terr_us,
+                 etas_rhos,
+                 risk_combos,
+                 pulse_years = pulse_years,
+                 gcnp = gcnp,
+                 uncollapsed = uncollapsed,
+                 workers = workers,
+                 runid_chunks = runid_chunks,
+                 output_format = output_format,
+                 result_cache = result_cache,
+                 vectorize_rates = vectorize_rates,
+                 conf_savename = conf_savename,
+                 summary = summary,
+                 quantiles = quantiles,
+                 quantile_error = quantile_error,
+                 annual = annual,
+                 preview = preview,
+                 preview_seed = preview_seed,
+                 shard = shard,
+                 write_queue = write_queue,
+                 fused = fused,
+                 float32 = float32,
+                 float32_check = float32_check,
+                 float32_rtol = float32_rtol)
@@ -0,0 +1,27 @@
+from pathlib import Path
+import argparse
+import os
+
+import dscim_epa
+
+# Merges the shards of runs computed with command_line_scghg.py --shard into the files of runs over the whole ensemble.
+# Each shard holds the SCGHGs of its runids for every pulse year, in <valuation>_scghgs/shards/<sector>/<shard> under the
+# output directory. The merge joins them along runid and normalises the adjustment factors over every runid, so the files
+# saved are the same, bit for bit, as those of a run without shards.
+#
+#   python scripts/merge_shards.py
+
+parser = argparse.ArgumentParser(description = "Merge the shards of DSCIM-EPA runs into the files of runs over the whole ensemble")
+parser.add_argument("conf_name", nargs = "?", default = "generated_conf.yml",
+                    help = "config file in the current working directory (default: generated_conf.yml)")
+parser.add_argument("--shards", nargs = "+",
+                    help = "directories of the shards of a run to merge (default: every run with shards in the output directory)")
+args = parser.parse_args()
+
+conf = dscim_epa.read_conf(Path(os.getcwd()) / args.conf_name)
+paths = args.shards or sorted(p for p in Path(conf['save_path']).glob('*_scghgs/shards/*') if p.is_dir())
+if len(paths) == 0:
+    raise FileNotFoundError(f"No shards in {conf['save_path']}. Compute them with command_line_scghg.py --shard")
+for path in paths:
+    print(f"Merging the shards in {path}")
+    dscim_epa.merge_shards(conf, path)
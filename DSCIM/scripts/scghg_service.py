@@ -0,0 +1,220 @@
+from pathlib import Path
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import argparse
+import json
+import os
+import threading
+import time
+import traceback
+import numpy as np
+
+import dscim_epa
+from dscim_epa import discount_conversion_dict, gas_conversion_dict, sector_names
+
+# Local HTTP service answering one-off SCGHG queries
+# The socioeconomics and climate anomalies are loaded once when the service starts and kept in memory,
+# so a query only reads its damage function coefficients and computes its own run. Input files are checked on every
+# query, and once any of them is replaced the inputs are loaded again and runs from the old inputs are not served.
+#
+#   python scripts/scghg_service.py
+#   curl "http://localhost:8765/scghg?sector=combined&discount_rate=2.0&pulse_year=2020"
+#   curl "http://localhost:8765/scghg?sector=energy&discount_rate=1.5&pulse_year=2030&valuation=territorial_us&quantiles=0.05,0.5,0.95"
+#
+# Collapsed SCGHGs are returned for each gas, as in the collapsed files saved by command_line_scghg.py.
+# quantiles adds quantiles of the full distribution of SCGHGs across runids.
+
+parser = argparse.ArgumentParser(description = "Serve DSCIM-EPA SCGHG queries on localhost, keeping the inputs in memory")
+parser.add_argument("conf_name", nargs = "?", default = "generated_conf.yml",
+                    help = "config file in the current working directory (default: generated_conf.yml)")
+parser.add_argument("--port", type = int, default = 8765, help = "port on localhost to listen on (default: 8765)")
+parser.add_argument("--pulse-years", nargs = "+", type = int,
+                    help = "pulse years whose climate inputs are loaded at startup (default: all pulse years in the config), others are loaded on first use")
+parser.add_argument("--cache-size", type = int, default = 256, help = "number of recent runs kept in memory (default: 256)")
+
+
+# Least recently used runs, keyed on their parameters
+class RunCache:
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last = False)
+
+
+class SCGHGService:
+    def __init__(self, conf, cache_size = 256):
+        self.conf = conf
+        self.sectors = sector_names(conf)
+        self.rates = {v: [float(x) for x in k.split('_')] for k, v in discount_conversion_dict.items()}
+        self.runs = RunCache(cache_size)
+        self.discount_cache = dscim_epa.DiscountCache()
+        # Size and modification time of every input file when the inputs in memory were loaded
+        self.fingerprints = {}
+        # Runs are computed one at a time, with dask using every core for each, while cached runs are answered
+        # concurrently. dscim objects and the discount cache are not safe to use from several threads at once.
+        self.compute_lock = threading.Lock()
+
+    # Size and modification time of every input file of a run, as in the result cache of command_line_scghg.py
+    def input_fingerprints(self, run):
+        eta, rho = self.rates[run['discount_rate']]
+        terr_us = run['valuation'] == 'territorial_us'
+        recipe = dict(sector = self.sectors[run['sector']] + ("_USA" if terr_us else ""), terr_us = terr_us,
+                      menu_option = 'risk_aversion', discount_type = 'euler_ramsey', eta = eta, rho = rho)
+        return {i: dscim_epa.input_fingerprint(i) for i in dscim_epa.run_inputs(self.conf, recipe)}
+
+    # Drops the inputs and discount factors in memory if any of the input files has changed since they were loaded
+    def check_inputs(self, fingerprints):
+        if all(self.fingerprints.get(i, f) == f for i, f in fingerprints.items()):
+            self.fingerprints.update(fingerprints)
+            return
+        print("Input files have changed, loading them again")
+        for cached in [dscim_epa.load_econ_vars, dscim_epa.load_climate_json, dscim_epa.open_damage_function_store]:
+            cached.cache_clear()
+        self.discount_cache = dscim_epa.DiscountCache()
+        self.fingerprints = dict(fingerprints)
+
+    # Loads the socioeconomics and the climate anomalies of a pulse year into memory
+    # Persisting keeps the chunks of the anomalies, so SCGHGs are the same as in a run of command_line_scghg.py
+    def load_inputs(self, pulse_year):
+        inputs = [f"{self.conf['rffdata']['socioec_output']}/rff_{name}_socioeconomics.nc4" for name in ['global', 'USA']]
+        for path in inputs + [self.conf['rff_climate'][k] for k in ['gmst_fair_path', 'gmsl_fair_path', 'damages_pulse_conversion_path']]:
+            self.fingerprints.setdefault(str(path), dscim_epa.input_fingerprint(path))
+        for path in inputs:
+            dscim_epa.load_econ_vars(path).econ_vars
+        climate = dscim_epa.load_climate(self.conf, pulse_year)
+        if 'anomalies' not in vars(climate):
+            climate.anomalies = climate.anomalies.persist()
+
+    # Reads the run of a query, raising ValueError for unknown options
+    def read_query(self, query):
+        sector = query.get('sector', 'combined')
+        if sector not in self.sectors:
+            raise ValueError(f"Unknown sector {sector}. Choose from {list(self.sectors)}")
+        rate = query.get('discount_rate', '2.0')
+        rate = rate if rate.endswith('Ramsey') else f"{float(rate):.1f}% Ramsey"
+        if rate not in self.rates:
+            raise ValueError(f"Unknown discount rate {rate}. Choose from {list(self.rates)}")
+        pulse_year = int(query.get('pulse_year', self.conf['rffdata']['pulse_years'][0]))
+        if pulse_year not in self.conf['rffdata']['pulse_years']:
+            raise ValueError(f"Unknown pulse year {pulse_year}. Choose from {self.conf['rffdata']['pulse_years']}")
+        valuation = query.get('valuation', 'global')
+        if valuation not in ['global', 'territorial_us']:
+            raise ValueError(f"Unknown valuation {valuation}. Choose from ['global', 'territorial_us']")
+        quantiles = [float(q) for q in query['quantiles'].split(',')] if query.get('quantiles') else []
+        if any(q < 0 or q > 1 for q in quantiles):
+            raise ValueError("Quantiles must be between 0 and 1")
+        return dict(sector = sector, discount_rate = rate, pulse_year = pulse_year, valuation = valuation), quantiles
+
+    # Uncollapsed SCGHGs and adjustment factors of a run, from memory or computed
+    # Runs are kept under the fingerprints of their inputs, so a run is computed again once its inputs change
+    def scghgs(self, run):
+        fingerprints = self.input_fingerprints(run)
+        key = tuple(run.values()) + (json.dumps(fingerprints, sort_keys = True),)
+        result = self.runs.get(key)
+        if result is not None:
+            return result, True
+        with self.compute_lock:
+            # Another request may have computed the run while this one waited
+            result = self.runs.get(key)
+            if result is not None:
+                return result, True
+            self.check_inputs(fingerprints)
+            self.load_inputs(run['pulse_year'])
+            eta, rho = self.rates[run['discount_rate']]
+            terr_us = run['valuation'] == 'territorial_us'
+            adjustments, gcnp, meta = dscim_epa.epa_scghg(self.conf,
+                                                          sector = self.sectors[run['sector']] + ("_USA" if terr_us else ""),
+                                                          terr_us = terr_us,
+                                                          eta = eta,
+                                                          rho = rho,
+                                                          pulse_year = run['pulse_year'],
+                                                          discount_cache = self.discount_cache)
+            result = adjustments.load()
+        self.runs.put(key, result)
+        return result, False
+
+    def query(self, query):
+        start = time.perf_counter()
+        run, quantiles = self.read_query(query)
+        adjustments, cached = self.scghgs(run)
+        # As in the collapsed files, certainty equivalent SCGHGs are the mean of adjusted SCGHGs across runids
+        collapsed = (adjustments.adjustment_factor * adjustments.scghg).mean(dim = 'runid')
+        response = dict(run,
+                        units = "2020 PPP-adjusted USD",
+                        scghg = {gas_conversion_dict[gas]: float(collapsed.sel(gas = gas).squeeze()) for gas in collapsed.gas.values})
+        if quantiles:
+            response['quantiles'] = {gas_conversion_dict[gas]: dict(zip([str(q) for q in quantiles],
+                                                                        np.quantile(adjustments.scghg.sel(gas = gas).squeeze().values, quantiles).tolist()))
+                                     for gas in adjustments.gas.values}
+        response.update(cached = cached, seconds = time.perf_counter() - start)
+        return response
+
+    def options(self):
+        return dict(sector = list(self.sectors),
+                    discount_rate = list(self.rates),
+                    pulse_year = self.conf['rffdata']['pulse_years'],
+                    valuation = ['global', 'territorial_us'],
+                    quantiles = "comma separated quantiles of the full distribution, e.g. 0.05,0.5,0.95")
+
+
+class Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def send_json(self, status, content):
+        body = json.dumps(content, indent = 1).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path == '/':
+            self.send_json(200, self.service.options())
+        elif url.path == '/scghg':
+            try:
+                self.send_json(200, self.service.query(query))
+            except ValueError as e:
+                self.send_json(400, dict(error = str(e)))
+            # Any other failure, such as a missing input file, is logged and answered rather than dropping the connection
+            except Exception as e:
+                self.log_error("Query %s failed", self.path)
+                traceback.print_exc()
+                self.send_json(500, dict(error = f"{type(e).__name__}: {e}"))
+        else:
+            self.send_json(404, dict(error = f"Unknown path {url.path}. Use / for the query options or /scghg for SCGHGs"))
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    conf = dscim_epa.read_conf(Path(os.getcwd()) / args.conf_name)
+    service = SCGHGService(conf, cache_size = args.cache_size)
+    for pulse_year in args.pulse_years or conf['rffdata']['pulse_years']:
+        print(f"Loading inputs for pulse year {pulse_year}")
+        service.load_inputs(pulse_year)
+
+    Handler.service = service
+    # Only connections from this machine are accepted
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), Handler)
+    print(f"Serving SCGHGs on http://localhost:{args.port}/scghg")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,27 @@
+from pathlib import Path
+import sys
+
+import pytest
+
+scripts = Path(__file__).resolve().parents[1] / 'scripts'
+sys.path.insert(0, str(scripts))
+
+import benchmark_scghg
+import dscim_epa
+
+# Runids of the synthetic inputs, enough for every sum over runids to be exercised while keeping runs quick
+runids = 20
+
+# Synthetic inputs with the dimensions of the DSCIM-EPA inputs, made once for all tests
+@pytest.fixture(scope = 'session')
+def inputs(tmp_path_factory):
+    base = tmp_path_factory.mktemp('inputs')
+    benchmark_scghg.make_inputs(base, runids)
+    return base
+
+# Config of the synthetic inputs, saving to a directory of its own for each test
+@pytest.fixture
+def conf(inputs, tmp_path):
+    conf = dscim_epa.read_conf(inputs / 'generated_conf.yml')
+    conf['save_path'] = str(tmp_path / 'output')
+    return conf
@@ -0,0 +1,152 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import base64
+import hashlib
+import io
+import subprocess
+import sys
+import threading
+import zipfile
+
+import numpy as np
+import pytest
+
+from conftest import scripts
+
+# Members of the test archive, under inputs/ as in the DSCIM-EPA input archive, with enough bytes for several ranges
+members = {f"inputs/{name}": np.random.default_rng(i).bytes(200_000)
+           for i, name in enumerate(['climate/gmst_pulse.nc', 'econ/rff_global_socioeconomics.nc4', 'damage_functions/CAMEL_m1_c0.20/dfc.nc4'])}
+
+def make_archive():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zip_ref:
+        for name, content in members.items():
+            zip_ref.writestr(name, content)
+    return buffer.getvalue()
+
+archive = make_archive()
+
+# Local stand-in for Google Cloud Storage that serves the archive with Range requests and x-goog-hash
+# Every GET is recorded with the bytes it asked for, and drop closes the connection of that many GETs halfway through
+class ArchiveServer(ThreadingHTTPServer):
+    def __init__(self, goog_hash):
+        super().__init__(('127.0.0.1', 0), ArchiveHandler)
+        self.goog_hash = goog_hash
+        self.drop = 0
+        self.gets = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/dscim_inputs.zip"
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_archive_headers(self, status, length, start = None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('x-goog-hash', self.server.goog_hash)
+        if start is not None:
+            self.send_header('Content-Range', f"bytes {start}-{start + length - 1}/{len(archive)}")
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.send_archive_headers(200, len(archive))
+
+    def do_GET(self):
+        start, end = 0, len(archive) - 1
+        if 'Range' in self.headers:
+            first, last = self.headers['Range'].split('=')[1].split('-')
+            start, end = int(first), min(int(last), len(archive) - 1) if last else len(archive) - 1
+        body = archive[start:end + 1]
+        with self.server.lock:
+            self.server.gets.append((start, end))
+            drop = self.server.drop > 0
+            self.server.drop -= drop
+        self.send_archive_headers(206 if 'Range' in self.headers else 200, len(body), start if 'Range' in self.headers else None)
+        if drop:
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+def goog_hash(md5 = True):
+    if md5:
+        return f"crc32c=AAAAAA==,md5={base64.b64encode(hashlib.md5(archive).digest()).decode()}"
+    import google_crc32c
+    return f"crc32c={base64.b64encode(google_crc32c.Checksum(archive).digest()).decode()}"
+
+@pytest.fixture
+def server():
+    server = ArchiveServer(goog_hash())
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def setup_inputs(server, path, *options):
+    return subprocess.run([sys.executable, str(scripts / 'directory_setup.py'), '--url', server.url, '--chunk-size', '4096', *options],
+                          cwd = path, capture_output = True, text = True)
+
+def assert_inputs(path):
+    for name, content in members.items():
+        assert (path / 'input' / name.split('/', 1)[1]).read_bytes() == content, name
+    assert (path / 'generated_conf.yml').exists()
+    assert sorted(f.name for f in path.iterdir()) == ['generated_conf.yml', 'input']
+
+# An interrupted download is resumed from the parts already on disk, with each connection continuing its own range
+@pytest.mark.parametrize('connections', [1, 3])
+def test_download_resumes(server, tmp_path, connections):
+    server.drop = 1
+    run = setup_inputs(server, tmp_path, '--connections', str(connections))
+    assert run.returncode != 0
+    assert any(f.name.startswith('dscim_inputs.zip.part') for f in tmp_path.iterdir())
+    if connections > 1:
+        assert len(server.gets) == connections
+
+    server.gets = []
+    run = setup_inputs(server, tmp_path, '--connections', str(connections))
+    assert run.returncode == 0, run.stderr
+    assert sum(end - start + 1 for start, end in server.gets) < len(archive)
+    assert_inputs(tmp_path)
+
+# Parts of a download interrupted with another number of connections hold other ranges, and are downloaded again
+def test_download_discards_parts_of_other_connections(server, tmp_path):
+    server.drop = 1
+    assert setup_inputs(server, tmp_path, '--connections', '2').returncode != 0
+
+    server.gets = []
+    run = setup_inputs(server, tmp_path, '--connections', '3')
+    assert run.returncode == 0, run.stderr
+    step = -(-len(archive) // 3)
+    assert sorted(server.gets) == [(start, min(start + step, len(archive)) - 1) for start in range(0, len(archive), step)]
+    assert_inputs(tmp_path)
+
+# --stream unzips the members from the server with Range requests, without saving the archive
+def test_stream(server, tmp_path):
+    run = setup_inputs(server, tmp_path, '--stream', '--connections', '2')
+    assert run.returncode == 0, run.stderr
+    assert all(start > 0 or end < len(archive) - 1 for start, end in server.gets)
+    assert_inputs(tmp_path)
+
+# Archives whose x-goog-hash has no MD5 are checked against their CRC32C
+def test_verify_crc32c(server, tmp_path):
+    pytest.importorskip('google_crc32c')
+    server.goog_hash = goog_hash(md5 = False)
+    run = setup_inputs(server, tmp_path)
+    assert run.returncode == 0, run.stderr
+    assert 'No checksum available' not in run.stdout
+    assert_inputs(tmp_path)
+
+    corrupt = tmp_path / 'corrupt'
+    corrupt.mkdir()
+    server.goog_hash = 'crc32c=AAAAAA=='
+    run = setup_inputs(server, corrupt)
+    assert run.returncode != 0
+    assert 'crc32c of' in run.stderr
+    assert list(corrupt.iterdir()) == []
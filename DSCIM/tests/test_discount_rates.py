@@ -0,0 +1,60 @@
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+
+import pandas as pd
+import yaml
+
+from conftest import scripts
+import dscim_epa
+
+sector = 'CAMEL_m1_c0.20'
+
+# Config of the synthetic inputs with a damage function library of its own, which has coefficients for eta 1.3, rho 0.003
+# in every sector. The shared inputs are left as they are, since other tests and their result cache keys depend on them
+def library_with_pair(inputs, tmp_path):
+    library = tmp_path / 'damage_functions'
+    shutil.copytree(inputs / 'input' / 'damage_functions', library)
+    for path in library.iterdir():
+        shutil.copy(path / 'risk_aversion_euler_ramsey_eta1.244_rho0.002_dfc.nc4', path / 'risk_aversion_euler_ramsey_eta1.3_rho0.003_dfc.nc4')
+    with open(inputs / 'generated_conf.yml', 'r') as stream:
+        conf = yaml.safe_load(stream)
+    conf['paths']['rff_damage_function_library'] = str(library)
+    conf['save_path'] = str(tmp_path / 'output')
+    with open(tmp_path / 'generated_conf.yml', 'w') as outfile:
+        yaml.dump(conf, outfile)
+
+# A pair of eta and rho without a published discount rate runs end to end from the command line, labelled by eta and rho
+def test_non_standard_eta_rho(inputs, tmp_path):
+    library_with_pair(inputs, tmp_path)
+
+    run = subprocess.run([sys.executable, str(scripts / 'command_line_scghg.py'), '--no-result-cache', '--discount-rates', '2.0', 'eta1.3_rho0.003',
+                          '--pulse-years', '2020', '2030', '--annual'], cwd = tmp_path, capture_output = True, text = True)
+    assert run.returncode == 0, run.stderr
+
+    path = tmp_path / 'output' / 'global_scghgs'
+    scghgs = pd.read_csv(path / 'sc-CO2-dscim-combined-2020.csv')
+    assert sorted(scghgs.discount_rate.unique()) == ['2.0% Ramsey', 'eta1.3_rho0.003']
+    annual = pd.read_csv(path / 'scghg-annual-dscim-combined.csv')
+    assert list(annual.columns) == ['gas', 'emission.year', '2.0% Ramsey', 'eta1.3_rho0.003']
+
+# Pairs missing from the consolidated damage function store read their coefficient files, and once added to the store with
+# consolidate_damage_functions.py --discount-rates are read from it, with the same SCGHGs either way
+def test_non_standard_eta_rho_with_store(inputs, tmp_path):
+    library_with_pair(inputs, tmp_path)
+    command = [sys.executable, str(scripts / 'command_line_scghg.py'), '--no-result-cache', '--discount-rates', '2.0', 'eta1.3_rho0.003', '--pulse-years', '2020']
+    scghgs = {}
+    for options in [None, [], ['--discount-rates', 'eta1.3_rho0.003']]:
+        if options is not None:
+            run = subprocess.run([sys.executable, str(scripts / 'consolidate_damage_functions.py')] + options, cwd = tmp_path, capture_output = True, text = True)
+            assert run.returncode == 0, run.stderr
+        run = subprocess.run(command, cwd = tmp_path, capture_output = True, text = True)
+        assert run.returncode == 0, run.stderr
+        scghgs[str(options)] = pd.read_csv(tmp_path / 'output' / 'global_scghgs' / 'sc-CO2-dscim-combined-2020.csv')
+        shutil.rmtree(tmp_path / 'output')
+
+    store = tmp_path / 'damage_functions' / 'damage_function_coefficients.zarr'
+    assert dscim_epa.has_damage_function_coefficients(store, sector, 'risk_aversion', 'euler_ramsey', [1.3], [0.003])
+    for result in scghgs.values():
+        pd.testing.assert_frame_equal(result, scghgs['None'])
@@ -0,0 +1,99 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import dscim_epa
+
+sector = 'CAMEL_m1_c0.20'
+etas_rhos = [[1.016010255, 9.149608e-05], [1.421158116, 0.00461878399]]
+# Every kind of file a run saves
+options = dict(pulse_years = [2020, 2030], uncollapsed = True, summary = True, gcnp = True, annual = True)
+
+# Runs epa_scghgs into an output directory of its own, with a discount cache of its own
+def run(conf, path, **kwargs):
+    conf = dict(conf, save_path = str(path))
+    dscim_epa.epa_scghgs(conf, [sector], False, etas_rhos, discount_cache = dscim_epa.DiscountCache(), **dict(options, **kwargs))
+    return conf
+
+# Files saved by a run, relative to its output directory
+# NetCDF files are read as datasets, and run manifests, which record how a run was made, are left out
+def saved_files(conf):
+    path = Path(conf['save_path'])
+    return {f.relative_to(path): xr.load_dataset(f) if f.suffix == '.nc4' else f.read_bytes()
+            for f in path.rglob('*') if f.is_file() and not f.name.startswith('run-manifest')}
+
+def assert_same_files(result, expected):
+    assert len(expected) > 0
+    assert sorted(result) == sorted(expected)
+    for name, content in expected.items():
+        if isinstance(content, xr.Dataset):
+            xr.testing.assert_identical(result[name], content)
+        else:
+            assert result[name] == content, name
+
+# Runs computed in worker processes save the same files as a serial run
+def test_workers(conf, tmp_path):
+    expected = saved_files(run(conf, tmp_path / 'serial'))
+    assert_same_files(saved_files(run(conf, tmp_path / 'workers', workers = 2)), expected)
+
+# SCGHGs saved by a run, relative to its output directory, with sketches left out
+def saved_tables(conf):
+    path = Path(conf['save_path'])
+    return {f.relative_to(path): pd.read_csv(f, float_precision = 'round_trip') for f in path.rglob('*.csv')}
+
+# Tables hold the same labels, and values that agree to within floating point rounding
+def assert_close_tables(result, expected, rtol):
+    assert len(expected) > 0
+    assert sorted(result) == sorted(expected)
+    for name, df in expected.items():
+        pd.testing.assert_frame_equal(result[name], df, check_exact = False, rtol = rtol, obj = str(name))
+
+# Runs streamed in chunks of runids save the same SCGHGs as runs in memory, up to the order of floating point sums
+def test_runid_chunks(conf, tmp_path):
+    expected = saved_tables(run(conf, tmp_path / 'memory'))
+    result = run(conf, tmp_path / 'chunked', runid_chunks = 7)
+    assert_close_tables(saved_tables(result), expected, rtol = 1e-13)
+    xr.testing.assert_allclose(xr.load_dataset(Path(result['save_path']) / 'gcnp' / 'gcnp-dscim-combined.nc4'),
+                               xr.load_dataset(tmp_path / 'memory' / 'gcnp' / 'gcnp-dscim-combined.nc4'), rtol = 1e-13)
+
+# A re-run from the result cache computes nothing and saves the same files as the run that filled it
+def test_result_cache(conf, tmp_path, monkeypatch):
+    result_cache = dscim_epa.ResultCache(tmp_path / 'result_cache', conf)
+    expected = saved_files(run(conf, tmp_path / 'computed', result_cache = result_cache))
+
+    def compute(*args, **kwargs):
+        raise AssertionError("A cached run was computed")
+    monkeypatch.setattr(dscim_epa, 'epa_scghg_group', compute)
+    assert_same_files(saved_files(run(conf, tmp_path / 'cached', result_cache = result_cache)), expected)
+
+# Discount rates computed in one vectorized pass save the same SCGHGs as separate runs, to within floating point rounding
+def test_vectorize_rates(conf, tmp_path):
+    expected = saved_tables(run(conf, tmp_path / 'separate'))
+    assert_close_tables(saved_tables(run(conf, tmp_path / 'vectorized', vectorize_rates = True)), expected, rtol = 1e-14)
+
+# Samples hold two runids of each stratum, and the same seed draws the same sample
+def test_preview_sample(conf):
+    runids, sample = dscim_epa.stratified_runids(conf, 10, seed = 1)
+    assert len(runids) == 10 and len(set(runids)) == 10
+    assert (sample.groupby('stratum').size() == 2).all()
+    assert dscim_epa.stratified_runids(conf, 10, seed = 1)[0] == runids
+    assert dscim_epa.stratified_runids(conf, 10, seed = 2)[0] != runids
+
+# A preview of every runid of the ensemble gives the SCGHGs of the full run, with no sampling error
+def test_preview_of_every_runid(conf, tmp_path):
+    full = run(conf, tmp_path / 'full', uncollapsed = False, summary = False, gcnp = False, annual = False)
+    preview = run(conf, tmp_path / 'preview', uncollapsed = False, summary = False, gcnp = False, annual = False, preview = 20)
+    for gas in ['CO2', 'CH4', 'N2O']:
+        for pulse_year in options['pulse_years']:
+            expected = pd.read_csv(Path(full['save_path']) / 'global_scghgs' / f"sc-{gas}-dscim-combined-{pulse_year}.csv")
+            result = pd.read_csv(Path(preview['save_path']) / 'global_scghgs' / 'preview' / f"sc-{gas}-dscim-combined-{pulse_year}-n20.csv")
+            assert (result.runids == 20).all()
+            np.testing.assert_array_equal(result.std_error, 0)
+            pd.testing.assert_frame_equal(result[expected.columns], expected, check_exact = False, rtol = 1e-13)
+
+# Files written in the calling thread are the same as files written in the background, with several pulse years queued
+def test_write_queue(conf, tmp_path):
+    expected = saved_files(run(conf, tmp_path / 'inline', write_queue = 0))
+    assert_same_files(saved_files(run(conf, tmp_path / 'queued', write_queue = 2)), expected)
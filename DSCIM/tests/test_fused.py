@@ -0,0 +1,66 @@
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dscim_epa
+
+sector = 'CAMEL_m1_c0.20'
+etas_rhos = [[1.016010255, 9.149608e-05], [1.421158116, 0.00461878399]]
+etas = np.array([1.016010255, 1.244459066, 1.421158116])
+
+# The numba build of the kernels and their NumPy versions, which are used where numba is not installed
+@pytest.fixture(params = ['numba', 'numpy'])
+def kernels(request, monkeypatch):
+    if request.param == 'numba':
+        pytest.importorskip('numba')
+    kernels = dscim_epa.fused_kernels(request.param == 'numba')
+    assert kernels['numba'] == (request.param == 'numba')
+    # Fused runs use this build of the kernels
+    monkeypatch.setattr(dscim_epa, 'fused_kernels', partial(dscim_epa.fused_kernels, request.param == 'numba'))
+    return kernels
+
+@pytest.mark.parametrize('power, normalize', [(True, True), (True, False), (False, True)])
+def test_adjustment_factor(kernels, power, normalize):
+    ypc = np.random.default_rng(0).uniform(1e4, 1e5, (3, 1000))
+    expected = np.power(ypc, -etas[:, None]) if power else ypc
+    if normalize:
+        expected = expected / expected.mean(axis = 1, keepdims = True)
+    values = ypc.copy()
+    kernels['adjustment_factor'](values, etas, power, normalize)
+    np.testing.assert_allclose(values, expected, rtol = 1e-13)
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_weighted_mean(kernels, dtype):
+    rng = np.random.default_rng(0)
+    weights = rng.uniform(0.5, 1.5, (3, 2, 1000)).astype(dtype)
+    values = rng.normal(200, 50, (3, 2, 1000)).astype(dtype)
+    result = kernels['weighted_mean'](weights, values)
+    assert result.dtype == np.float64
+    np.testing.assert_allclose(result, (weights.astype(np.float64) * values).mean(axis = -1), rtol = 1e-13)
+
+# SCGHG files saved by a run, relative to its output directory
+def scghg_files(conf):
+    path = Path(conf['save_path']) / 'global_scghgs'
+    return {f.relative_to(path): pd.read_csv(f, float_precision = 'round_trip') for f in path.rglob('sc-*.csv')}
+
+# Fused runs reproduce the collapsed and uncollapsed SCGHGs of runs without fused kernels, in float64 and float32
+# Runs have a discount cache of their own, so that no adjustment factors come from earlier runs with the other build
+@pytest.mark.parametrize('float32', [False, True])
+def test_fused_runs(kernels, conf, tmp_path, float32):
+    options = dict(pulse_years = [2020, 2030], uncollapsed = True, float32 = float32, discount_cache = dscim_epa.DiscountCache())
+    dscim_epa.epa_scghgs(conf, [sector], False, etas_rhos, **options)
+    expected = scghg_files(conf)
+
+    conf = dict(conf, save_path = str(tmp_path / 'fused'))
+    dscim_epa.epa_scghgs(conf, [sector], False, etas_rhos, fused = True, **options)
+    result = scghg_files(conf)
+
+    assert sorted(result) == sorted(expected)
+    for name, df in expected.items():
+        values = [c for c in ['scghg', 'adjustment_factor'] if c in df.columns]
+        pd.testing.assert_frame_equal(result[name].drop(columns = values), df.drop(columns = values))
+        for c in values:
+            np.testing.assert_allclose(result[name][c], df[c], rtol = 1e-6 if float32 else 1e-12, err_msg = f"{name} {c}")
@@ -0,0 +1,37 @@
+from pathlib import Path
+from itertools import product
+
+import pandas as pd
+import xarray as xr
+
+import dscim_epa
+
+sector = 'CAMEL_m1_c0.20'
+etas_rhos = [[1.016010255, 9.149608e-05], [1.244459066, 0.00197263997]]
+
+# Uncollapsed SCGHGs of one gas saved as the original command_line_scghg.py saved them: each run expanded along
+# discount_rate, menu_option and sector, combined with xr.combine_by_coords and written with to_dataframe
+def save_baseline(conf, gas, pulse_year, path):
+    arrays = []
+    for (eta, rho), s in product(etas_rhos, [sector]):
+        scghg, gcnp, meta = dscim_epa.epa_scghg(conf, sector = s, eta = eta, rho = rho, pulse_year = pulse_year)
+        scghg = scghg.assign_coords(discount_rate = dscim_epa.discount_conversion_dict[f"{eta}_{rho}"], menu_option = 'risk_aversion', sector = 'combined')
+        scghg = scghg.expand_dims(['discount_rate', 'menu_option', 'sector'])
+        if 'simulation' in scghg.dims:
+            scghg = scghg.drop_vars('simulation')
+        arrays.append(scghg)
+    full = xr.combine_by_coords(arrays)
+    full = full.assign_coords(gas = [dscim_epa.gas_conversion_dict[g] for g in full.gas.values])
+    full.sel(gas = gas, drop = True).to_dataframe().reindex().to_csv(path)
+
+def test_uncollapsed_csv_layout(conf, tmp_path):
+    dscim_epa.epa_scghgs(conf, [sector], False, etas_rhos, pulse_years = [2020], uncollapsed = True)
+    for gas in ['CO2', 'CH4', 'N2O']:
+        save_baseline(conf, gas, 2020, tmp_path / f"baseline-{gas}.csv")
+        with open(tmp_path / f"baseline-{gas}.csv") as f:
+            baseline = f.read().splitlines()
+        with open(Path(conf['save_path']) / 'global_scghgs' / 'full_distributions' / gas / f"sc-{gas}-dscim-combined-2020-n10000.csv") as f:
+            result = f.read().splitlines()
+        assert result[0] == baseline[0]
+        assert result[:6] == baseline[:6]
+        assert result == baseline
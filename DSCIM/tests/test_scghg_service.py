@@ -0,0 +1,84 @@
+from urllib.error import HTTPError
+from urllib.request import urlopen
+import json
+import os
+import shutil
+import threading
+
+import pytest
+
+import dscim_epa
+import scghg_service
+
+sector = 'CAMEL_m1_c0.20'
+
+# The service on a free port of localhost, answering queries in a thread of this process
+@pytest.fixture
+def service(conf):
+    service = scghg_service.SCGHGService(conf)
+    handler = type('Handler', (scghg_service.Handler,), dict(service = service))
+    server = scghg_service.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield service, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+# Status and JSON content of the response to a GET request
+def get(url):
+    try:
+        with urlopen(url) as response:
+            return response.status, json.load(response)
+    except HTTPError as e:
+        return e.code, json.load(e)
+
+# Collapsed SCGHGs of a run of epa_scghg, as saved by command_line_scghg.py
+def collapsed(conf, eta, rho, pulse_year):
+    adjustments, gcnp, meta = dscim_epa.epa_scghg(conf, sector = sector, eta = eta, rho = rho, pulse_year = pulse_year, discount_cache = None)
+    scghg = (adjustments.adjustment_factor * adjustments.scghg).mean(dim = 'runid')
+    return {dscim_epa.gas_conversion_dict[gas]: float(scghg.sel(gas = gas).squeeze()) for gas in scghg.gas.values}
+
+def test_query(service, conf):
+    service, url = service
+    status, content = get(f"{url}/scghg?sector=combined&discount_rate=2.0&pulse_year=2030&quantiles=0.05,0.5")
+    assert status == 200
+    assert content['discount_rate'] == '2.0% Ramsey'
+    assert content['cached'] is False
+    assert sorted(content['quantiles']['CO2']) == ['0.05', '0.5']
+    expected = collapsed(conf, 1.244459066, 0.00197263997, 2030)
+    assert content['scghg'] == pytest.approx(expected, rel = 1e-12)
+
+    status, content = get(f"{url}/scghg?sector=combined&discount_rate=2.0&pulse_year=2030")
+    assert status == 200
+    assert content['cached'] is True
+    assert content['scghg'] == pytest.approx(expected, rel = 1e-12)
+
+    status, content = get(f"{url}/scghg?sector=combined&discount_rate=3.0")
+    assert status == 400
+    assert 'Unknown discount rate' in content['error']
+
+# Runs are computed again from the new files once an input is replaced, rather than served from memory
+def test_query_replaced_inputs(inputs, conf, tmp_path):
+    library = tmp_path / 'damage_functions'
+    shutil.copytree(inputs / 'input' / 'damage_functions', library)
+    conf['paths']['rff_damage_function_library'] = str(library)
+    service = scghg_service.SCGHGService(conf)
+    query = dict(sector = 'combined', discount_rate = '2.0', pulse_year = '2020')
+    before = service.query(query)
+
+    path = library / sector / 'risk_aversion_euler_ramsey_eta1.244_rho0.002_dfc.nc4'
+    shutil.copy(library / sector / 'risk_aversion_euler_ramsey_eta1.016_rho0.0_dfc.nc4', path)
+    # A modification time of its own, even on file systems with coarse timestamps
+    os.utime(path, ns = (os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10**9))
+    after = service.query(query)
+    assert after['cached'] is False
+    assert after['scghg'] != before['scghg']
+    assert after['scghg'] == pytest.approx(collapsed(conf, 1.244459066, 0.00197263997, 2020), rel = 1e-12)
+
+# Failures other than unknown query options, such as a missing input file, are answered with a JSON 500 error
+def test_query_error(service, conf):
+    service, url = service
+    service.conf = dict(conf, paths = dict(conf['paths'], rff_damage_function_library = str(conf['save_path'])))
+    status, content = get(f"{url}/scghg?sector=combined&discount_rate=2.0&pulse_year=2020")
+    assert status == 500
+    assert content['error'].startswith('FileNotFoundError')
@@ -0,0 +1,51 @@
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+import yaml
+
+from conftest import scripts
+
+options = ['--sectors', 'combined', '--discount-rates', '1.5', '2.5', '--pulse-years', '2020', '2030', '--uncollapsed']
+
+# Directory with the config of the synthetic inputs, saving to output/ within it
+def run_dir(inputs, path):
+    path.mkdir()
+    with open(inputs / 'generated_conf.yml', 'r') as stream:
+        conf = yaml.safe_load(stream)
+    conf['save_path'] = str(path / 'output')
+    with open(path / 'generated_conf.yml', 'w') as outfile:
+        yaml.dump(conf, outfile)
+    return path
+
+# SCGHG files saved by a run, relative to its output directory
+def scghg_files(path):
+    path = path / 'output' / 'global_scghgs'
+    return {f.relative_to(path): f.read_bytes() for f in path.rglob('sc-*.csv') if 'shards' not in f.parts}
+
+# Shards run as separate processes at the same time, as on several nodes, and merged with merge_shards.py
+# With --write-queue, files are written in the background while the next pulse year is computed and read
+@pytest.mark.parametrize('float32, write_queue', [(False, None), (True, None), (False, 3)])
+def test_merged_shards_match_unsharded_run(inputs, tmp_path, float32, write_queue):
+    run_options = options + ['--no-result-cache', '--gcnp'] + (['--float32'] if float32 else []) + (['--write-queue', str(write_queue)] if write_queue is not None else [])
+    unsharded = run_dir(inputs, tmp_path / 'unsharded')
+    run = subprocess.run([sys.executable, str(scripts / 'command_line_scghg.py')] + run_options, cwd = unsharded, capture_output = True, text = True)
+    assert run.returncode == 0, run.stderr
+
+    sharded = run_dir(inputs, tmp_path / 'sharded')
+    shards = [subprocess.Popen([sys.executable, str(scripts / 'command_line_scghg.py'), '--shard', shard] + run_options,
+                               cwd = sharded, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, text = True)
+              for shard in ['0/3', '1/3', '2/3']]
+    for shard in shards:
+        stderr = shard.communicate()[1]
+        assert shard.returncode == 0, stderr
+    run = subprocess.run([sys.executable, str(scripts / 'merge_shards.py')], cwd = sharded, capture_output = True, text = True)
+    assert run.returncode == 0, run.stderr
+
+    expected = scghg_files(unsharded)
+    merged = scghg_files(sharded)
+    assert len(expected) > 0
+    assert sorted(merged) == sorted(expected)
+    for name, content in expected.items():
+        assert merged[name] == content, name
@@ -0,0 +1,55 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dscim_epa
+
+sector = 'CAMEL_m1_c0.20'
+etas_rhos = [[1.016010255, 9.149608e-05], [1.421158116, 0.00461878399]]
+quantiles = [0, 0.05, 0.25, 0.5, 0.75, 0.95, 1]
+
+# Largest difference from np.quantile allowed for a quantile of the sketch: the relative error of the draws either side
+def tolerance(draws, q, rel_error):
+    return rel_error * max(abs(np.quantile(draws, q, method = 'lower')), abs(np.quantile(draws, q, method = 'higher')))
+
+# Quantiles interpolate between the draws either side of them, as np.quantile does by default, for draws of either sign
+@pytest.mark.parametrize('n', [20, 1001])
+def test_sketch_quantiles(n):
+    rng = np.random.default_rng(n)
+    draws = np.concatenate([rng.lognormal(5, 1, n - n // 4 - 1), -rng.lognormal(3, 1, n // 4), [0.0]])
+    sketch = dscim_epa.SCGHGSketch().add(draws, np.ones(n))
+    for q in quantiles:
+        assert abs(sketch.quantile(q) - np.quantile(draws, q)) <= tolerance(draws, q, sketch.rel_error), q
+    # With 20 draws, q0.05 lies between the two smallest draws rather than at the smallest
+    if n == 20:
+        assert sketch.quantile(0.05) > np.sort(draws)[0] * (1 - sketch.rel_error)
+
+# Sketches of blocks of draws merge into the sketch of all of them
+def test_sketch_merge():
+    draws = np.random.default_rng(0).normal(100, 50, 1000)
+    factors = np.random.default_rng(1).uniform(0.5, 1.5, 1000)
+    whole = dscim_epa.SCGHGSketch().add(draws, factors)
+    merged = dscim_epa.SCGHGSketch()
+    for start in range(0, 1000, 300):
+        merged.merge(dscim_epa.SCGHGSketch.from_dict(dscim_epa.SCGHGSketch().add(draws[start:start + 300], factors[start:start + 300]).to_dict()))
+    assert merged.n == whole.n
+    assert merged.positive == whole.positive and merged.negative == whole.negative and merged.zeros == whole.zeros
+    assert merged.summary(quantiles) == pytest.approx(whole.summary(quantiles), rel = 1e-12)
+
+# Summary statistics saved by a run agree with the full distributions saved by the same run
+def test_summary_statistics(conf):
+    dscim_epa.epa_scghgs(conf, [sector], False, etas_rhos, pulse_years = [2020], uncollapsed = True, summary = True, quantiles = quantiles)
+    path = Path(conf['save_path']) / 'global_scghgs'
+    for gas in ['CO2', 'CH4', 'N2O']:
+        summary = pd.read_csv(path / 'summary_statistics' / f"sc-{gas}-dscim-combined-2020-summary.csv")
+        full = pd.read_csv(path / 'full_distributions' / gas / f"sc-{gas}-dscim-combined-2020-n10000.csv")
+        assert len(summary) == len(etas_rhos)
+        for _, row in summary.iterrows():
+            draws = full[full.discount_rate == row.discount_rate].scghg.values
+            assert row.n == len(draws)
+            assert row['mean'] == pytest.approx(draws.mean(), rel = 1e-12)
+            assert row.variance == pytest.approx(draws.var(ddof = 1), rel = 1e-9)
+            for q in quantiles:
+                assert abs(row[f"q{q:g}"] - np.quantile(draws, q)) <= tolerance(draws, q, dscim_epa.quantile_error), (gas, row.discount_rate, q)